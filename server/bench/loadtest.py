@@ -0,0 +1,260 @@
+# server/bench/loadtest.py
+# Kuormitustesti: N samanaikaista skriptattua sessiota /api/turn:ia vasten
+# prosessin sisällä (httpx + ASGI, ei verkkoa), oletuksena mock-providerilla.
+#
+#   python -m bench.loadtest --sessions 1,10,50 --turns 10,40 --out loadtest.json
+#   python -m bench.loadtest --sessions 20 --turns 20 --baseline loadtest.json
+import argparse
+import asyncio
+import contextvars
+import functools
+import inspect
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from typing import Any, Dict, List, Optional
+
+# olutkagge-questin reitti: Village -> Market -> Blacksmith -> Cave -> Tavern;
+# pidemmät sessiot kiertävät reittiä uudelleen
+SCRIPT = [
+    "look around",
+    "go to market",
+    "buy torch",
+    "ask the merchant about the goblins",
+    "go to blacksmith",
+    "buy dagger",
+    "go north to the cave",
+    "attack the goblin",
+    "take the beer keg",
+    "return to tavern",
+    "give the beer keg to the innkeeper",
+    "go to village",
+]
+
+# mitatut vaiheet -> server.py:n funktiot, joiden ympärille ajastin kääritään
+STAGES = {
+    "intent": ("parse_intent",),
+    "rules": ("pre_narration",),            # sanity check, liikkuminen, kauppa
+    "context": ("build_llm_state",),        # lyhyt/pitkä muisti + recall promptiin
+    "narration": ("make_narration",),
+    "memory": ("record_memory",),
+    "apply": ("apply_gm_result",),
+    "session": ("load_session", "save_session"),
+}
+# "serialize" = kokonaisaika miinus mitatut vaiheet: patch/versio, vastauksen
+# validointi ja JSON-koodaus sekä ASGI-kerros
+
+_TURN: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("loadtest_turn", default=None)
+
+
+def _timed(stage: str, fn):
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                _add(stage, time.perf_counter() - t0)
+    else:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _add(stage, time.perf_counter() - t0)
+    return wrapper
+
+
+def _add(stage: str, seconds: float) -> None:
+    rec = _TURN.get()
+    if rec is not None:
+        rec[stage] = rec.get(stage, 0.0) + seconds
+
+
+def _instrument(server) -> None:
+    for stage, names in STAGES.items():
+        for name in names:
+            setattr(server, name, _timed(stage, getattr(server, name)))
+
+
+def _pct(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def _dist_ms(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"n": 0}
+    ms = [v * 1000 for v in values]
+    return {
+        "n": len(ms),
+        "mean": round(statistics.mean(ms), 3),
+        "p50": round(_pct(ms, 0.50), 3),
+        "p95": round(_pct(ms, 0.95), 3),
+        "p99": round(_pct(ms, 0.99), 3),
+    }
+
+
+async def _session(client, session_id: str, turns: int, think: float, records: List[Dict[str, float]], errors: List[str]):
+    for i in range(turns):
+        rec: Dict[str, float] = {}
+        token = _TURN.set(rec)
+        t0 = time.perf_counter()
+        try:
+            resp = await client.post("/api/turn", json={"session_id": session_id, "text": SCRIPT[i % len(SCRIPT)]})
+            if resp.status_code != 200:
+                errors.append(f"{resp.status_code}: {resp.text[:120]}")
+                continue
+            resp.json()
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+            continue
+        finally:
+            _TURN.reset(token)
+        rec["total"] = time.perf_counter() - t0
+        records.append(rec)
+        if think:
+            await asyncio.sleep(think)
+
+
+async def _run(app, run_id: str, sessions: int, turns: int, think: float) -> Dict[str, Any]:
+    import httpx
+
+    records: List[Dict[str, float]] = []
+    errors: List[str] = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(
+            _session(client, f"{run_id}-{n}", turns, think, records, errors) for n in range(sessions)
+        ))
+        wall = time.perf_counter() - t0
+
+    stages: Dict[str, Any] = {}
+    for stage in [*STAGES, "serialize"]:
+        if stage == "serialize":
+            values = [r["total"] - sum(v for k, v in r.items() if k != "total") for r in records]
+        else:
+            values = [r[stage] for r in records if stage in r]
+        stages[stage] = _dist_ms(values)
+    return {
+        "sessions": sessions,
+        "turns_per_session": turns,
+        "turns": len(records),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "wall_s": round(wall, 3),
+        "throughput_tps": round(len(records) / wall, 2) if wall else 0.0,
+        "latency_ms": _dist_ms([r["total"] for r in records]),
+        "stages_ms": stages,
+    }
+
+
+def _git_rev() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+        return out.stdout.strip()
+    except Exception:
+        return ""
+
+
+def _compare(results: List[Dict[str, Any]], baseline_path: str) -> List[Dict[str, Any]]:
+    with open(baseline_path, encoding="utf-8") as f:
+        base = {(r["sessions"], r["turns_per_session"]): r for r in json.load(f)["runs"]}
+    rows = []
+    for r in results:
+        b = base.get((r["sessions"], r["turns_per_session"]))
+        if not b:
+            continue
+        row = {"sessions": r["sessions"], "turns_per_session": r["turns_per_session"]}
+        for key in ("p50", "p95", "p99"):
+            old, new = b["latency_ms"].get(key), r["latency_ms"].get(key)
+            if old and new is not None:
+                row[f"{key}_change_pct"] = round((new - old) / old * 100, 1)
+        if b["throughput_tps"]:
+            row["throughput_change_pct"] = round((r["throughput_tps"] - b["throughput_tps"]) / b["throughput_tps"] * 100, 1)
+        rows.append(row)
+    return rows
+
+
+def _ints(text: str) -> List[int]:
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Scripted multi-session load test for /api/turn")
+    ap.add_argument("--sessions", default="1,10,50", help="concurrent session counts, comma separated")
+    ap.add_argument("--turns", default="12", help="turns per session, comma separated")
+    ap.add_argument("--think-ms", type=float, default=0.0, help="pause between a session's turns")
+    ap.add_argument("--live", action="store_true", help="use the configured providers instead of mock")
+    ap.add_argument("--mock-latency", type=float, default=0.05, help="MOCK_LATENCY unless already set")
+    ap.add_argument("--mock-tokens-per-sec", type=float, default=0.0, help="MOCK_TOKENS_PER_SEC unless already set")
+    ap.add_argument("--label", default="", help="free-form label stored in the results (e.g. a version)")
+    ap.add_argument("--out", default="loadtest.json", help="machine-readable results file")
+    ap.add_argument("--baseline", default="", help="earlier results file to compare against")
+    args = ap.parse_args()
+
+    # CFG luetaan importissa, joten ympäristö asetetaan ennen serverin importtia
+    if not args.live:
+        os.environ["INTENT_PROVIDER"] = "mock"
+        os.environ["NARRATION_PROVIDER"] = "mock"
+        os.environ.setdefault("NARRATION_MODEL", "mock")
+        os.environ.setdefault("MOCK_LATENCY", str(args.mock_latency))
+        os.environ.setdefault("MOCK_LATENCY_DIST", "lognormal")
+        os.environ.setdefault("MOCK_TOKENS_PER_SEC", str(args.mock_tokens_per_sec))
+
+    import server
+    from config import CFG
+
+    _instrument(server)
+
+    async def run_all() -> List[Dict[str, Any]]:
+        results = []
+        async with server.app.router.lifespan_context(server.app):
+            for turns in _ints(args.turns):
+                for sessions in _ints(args.sessions):
+                    run_id = f"lt-{int(time.time() * 1000)}-{sessions}x{turns}"
+                    r = await _run(server.app, run_id, sessions, turns, args.think_ms / 1000)
+                    results.append(r)
+                    lat = r["latency_ms"]
+                    print(
+                        f"sessions={sessions:<4} turns={turns:<4} tps={r['throughput_tps']:<8} "
+                        f"p50={lat.get('p50')}ms p95={lat.get('p95')}ms p99={lat.get('p99')}ms "
+                        f"errors={r['errors']}"
+                    )
+        return results
+
+    results = asyncio.run(run_all())
+    report: Dict[str, Any] = {
+        "label": args.label,
+        "git_rev": _git_rev(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "config": {
+            "intent_provider": CFG.intent_provider,
+            "narration_provider": CFG.narration_provider,
+            "turn_mode": CFG.turn_mode,
+            "session_backend": CFG.session_backend,
+            "mock_latency": CFG.mock_latency,
+            "mock_latency_dist": CFG.mock_latency_dist,
+            "mock_tokens_per_sec": CFG.mock_tokens_per_sec,
+            "think_ms": args.think_ms,
+        },
+        "runs": results,
+    }
+    if args.baseline:
+        report["compare"] = _compare(results, args.baseline)
+        for row in report["compare"]:
+            print("vs baseline:", json.dumps(row))
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# server/bench/retrieval.py
+# BM25-hakumuistin mittaus: python -m bench.retrieval [--turns 10000] [--queries 500]
+import argparse
+import json
+import random
+import statistics
+import time
+
+from core.retrieval import BM25Index
+
+_PLACES = ["village", "market", "blacksmith", "tavern", "cave", "forest", "river", "ruins"]
+_NOUNS = ["goblin", "keg", "sword", "torch", "rope", "bread", "coin", "map", "shield", "dagger",
+          "merchant", "innkeeper", "guard", "wolf", "bridge", "door", "chest", "lantern", "ale", "herbs"]
+_VERBS = ["look", "talk", "attack", "buy", "take", "open", "search", "follow", "hide", "drink"]
+_FILLER = ("the air is cold and quiet as you move carefully forward while shadows "
+           "dance along the walls and distant voices echo").split()
+
+
+def _turn(rng: random.Random) -> str:
+    player = f"{rng.choice(_VERBS)} the {rng.choice(_NOUNS)}"
+    gm = " ".join(
+        [f"In the {rng.choice(_PLACES)} you {rng.choice(_VERBS)} a {rng.choice(_NOUNS)}."]
+        + rng.sample(_FILLER, 12)
+        + [f"The {rng.choice(_NOUNS)} is near the {rng.choice(_NOUNS)}."]
+    )
+    return f"You: {player} / GM: {gm}"
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="BM25 recall index benchmark")
+    ap.add_argument("--turns", type=int, default=10000)
+    ap.add_argument("--queries", type=int, default=500)
+    ap.add_argument("--k", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    idx = BM25Index(max_docs=args.turns)
+    add_ms = []
+    for seq in range(1, args.turns + 1):
+        text = _turn(rng)
+        t0 = time.perf_counter()
+        idx.add(seq, text)
+        add_ms.append((time.perf_counter() - t0) * 1000)
+
+    search_ms = []
+    for _ in range(args.queries):
+        query = f"{rng.choice(_VERBS)} {rng.choice(_NOUNS)} {rng.choice(_PLACES)}"
+        t0 = time.perf_counter()
+        idx.search(query, k=args.k, before_seq=args.turns - 4)
+        search_ms.append((time.perf_counter() - t0) * 1000)
+
+    print(json.dumps({
+        "turns": args.turns,
+        "index": idx.stats(),
+        "add_ms": {"mean": round(statistics.mean(add_ms), 4), "p99": round(_pct(add_ms, 0.99), 4)},
+        "search_ms": {
+            "p50": round(_pct(search_ms, 0.50), 3),
+            "p95": round(_pct(search_ms, 0.95), 3),
+            "p99": round(_pct(search_ms, 0.99), 3),
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -11,18 +11,133 @@ except Exception:
 @dataclass(frozen=True)
 class LLMConfig:
     # Intent (parser)
-    intent_provider: str = os.environ.get("INTENT_PROVIDER", "groq")      # groq | gemini
+    intent_provider: str = os.environ.get("INTENT_PROVIDER", "groq")      # groq | gemini | mock
     intent_model: str    = os.environ.get("INTENT_MODEL", "llama-3.1-8b-instant")
+    # intent-kutsun temperature; cache päätetään tämän perusteella kutsukohtaisesti
+    intent_temperature: float = float(os.environ.get("INTENT_TEMPERATURE", "0.1"))
+    # sääntöpohjainen tunnistus nappien teksteille ennen LLM-kutsua
+    intent_fast_path: bool = os.environ.get("INTENT_FAST_PATH", "1") != "0"
+    # sessioiden yhteinen intent-cache (koko 0 = pois päältä)
+    intent_cache_size: int = int(os.environ.get("INTENT_CACHE_SIZE", "10000"))
+    intent_cache_ttl: float = float(os.environ.get("INTENT_CACHE_TTL", "600"))
+    # cachetetaan vain ne kutsut, joiden lähetetty temperature on enintään tämä
+    intent_cache_max_temperature: float = float(os.environ.get("INTENT_CACHE_MAX_TEMPERATURE", "0.3"))
 
     # Narration (tarina)
-    narration_provider: str = os.environ.get("NARRATION_PROVIDER", "groq") # groq | gemini
+    narration_provider: str = os.environ.get("NARRATION_PROVIDER", "groq") # groq | gemini | mock
     narration_model: str    = os.environ.get(
         "NARRATION_MODEL",
-        "llama-3.3-70b-versatile" if os.environ.get("NARRATION_PROVIDER","groq").lower()=="groq" else "gemini-1.5-flash"
+        {"groq": "llama-3.3-70b-versatile", "mock": "mock"}.get(
+            os.environ.get("NARRATION_PROVIDER", "groq").lower(), "gemini-1.5-flash"
+        )
     )
+    # narration-cache toistuville, vaarattomille toiminnoille (oletuksena pois):
+    # avaimella (paikka, toiminto, kohde, questin tila, pelaajan kunto) on pieni
+    # joukko vaihtoehtoisia vastauksia, joista tarjotaan jokin muu kuin edellinen
+    narration_cache: bool = os.environ.get("NARRATION_CACHE", "0") == "1"
+    narration_cache_size: int = int(os.environ.get("NARRATION_CACHE_SIZE", "2048"))
+    narration_cache_variants: int = int(os.environ.get("NARRATION_CACHE_VARIANTS", "3"))
+    narration_cache_actions: tuple = tuple(
+        a.strip().upper() for a in os.environ.get("NARRATION_CACHE_ACTIONS", "LOOK,WAIT").split(",") if a.strip()
+    )
+
+    # tarjottujen valintojen spekulatiivinen etukäteisajo (oletuksena pois)
+    speculation: bool = os.environ.get("SPECULATION", "0") == "1"
+    # ajetaanko myös narration etukäteen vai pelkkä intent
+    speculation_narration: bool = os.environ.get("SPECULATION_NARRATION", "0") == "1"
+    speculation_max_concurrency: int = int(os.environ.get("SPECULATION_MAX_CONCURRENCY", "8"))
+    speculation_ttl: float = float(os.environ.get("SPECULATION_TTL", "120"))
+
+    # vuoron LLM-kutsut: "split" = intent + narration erikseen,
+    # "fused" = yksi narration-mallin kutsu palauttaa molemmat (myös streamissa)
+    turn_mode: str = os.environ.get("TURN_MODE", "split").lower()
+
+    # promptin token-budjetit (arvio, user-prompt ilman system-promptia; 0 = ei rajaa)
+    intent_token_budget: int    = int(os.environ.get("INTENT_TOKEN_BUDGET", "400"))
+    narration_token_budget: int = int(os.environ.get("NARRATION_TOKEN_BUDGET", "1200"))
+
+    # sessioiden säilö: muistissa pidettävien määrä, idle-aika ja spill-tiedosto
+    session_max_resident: int = int(os.environ.get("SESSION_MAX_RESIDENT", "10000"))
+    session_idle_ttl: float   = float(os.environ.get("SESSION_IDLE_TTL", "1800"))
+    session_spill_path: str   = os.environ.get("SESSION_SPILL_PATH", "")  # tyhjä = temp-tiedosto
+    # "memory" = prosessin oma (oletus), "sqlite" = usean workerin yhteinen tiedosto
+    session_backend: str = os.environ.get("SESSION_BACKEND", "memory").lower()
+    session_db_path: str = os.environ.get("SESSION_DB_PATH", "aidventure_sessions.sqlite3")
+    # pelitilan lokiin jäävät viimeiset vuorot; koko historia on /api/log:ssa
+    log_tail_size: int = int(os.environ.get("LOG_TAIL_SIZE", "20"))
 
     # API-keyt (vain jos käytössä)
     groq_api_key: str   = os.environ.get("GROQ_API_KEY", "")
     gemini_api_key: str = os.environ.get("GEMINI_API_KEY", "")
 
+    # pitkän muistin tiivistys: ajetaan kun odottavaa tekstiä on tarpeeksi
+    # (vuoroja tai merkkejä) tai sessio on ollut hiljaa idle-ajan; yhteinen,
+    # rajattu työjono, jottei tiivistys kilpaile pelivuorojen kanssa
+    summary_min_turns: int      = int(os.environ.get("SUMMARY_MIN_TURNS", "4"))
+    summary_min_chars: int      = int(os.environ.get("SUMMARY_MIN_CHARS", "1500"))
+    summary_idle_seconds: float = float(os.environ.get("SUMMARY_IDLE_SECONDS", "30"))
+    summary_workers: int        = int(os.environ.get("SUMMARY_WORKERS", "2"))
+    summary_queue_size: int     = int(os.environ.get("SUMMARY_QUEUE_SIZE", "1000"))
+
+    # paikallinen hakumuisti (BM25) koko sessiohistoriasta: montako osumaa
+    # promptiin, vuoroja per sessio, muistissa pidettäviä sessioita, katkaisu
+    recall_k: int              = int(os.environ.get("RECALL_K", "3"))  # 0 = pois päältä
+    recall_max_docs: int       = int(os.environ.get("RECALL_MAX_DOCS", "10000"))
+    recall_max_sessions: int   = int(os.environ.get("RECALL_MAX_SESSIONS", os.environ.get("SESSION_MAX_RESIDENT", "10000")))
+    recall_snippet_chars: int  = int(os.environ.get("RECALL_SNIPPET_CHARS", "300"))
+
+    # LLM-kutsujen aikaraja sekunteina (0 = ei rajaa); streamissa raja koskee
+    # jokaista palaa erikseen
+    llm_timeout: float = float(os.environ.get("LLM_TIMEOUT", "20"))
+    # varareitti: käytetään kun ensisijaisen (provider, model) -parin breaker on
+    # auki tai kutsu epäonnistuu; hedge-pyyntö menee myös tänne
+    llm_backup_provider: str = os.environ.get("LLM_BACKUP_PROVIDER", "").lower()
+    llm_backup_model: str    = os.environ.get("LLM_BACKUP_MODEL", "")
+    # hedged requests (oletuksena pois): jos vastausta ei ole tullut p95-viiveen
+    # kuluessa, lähetetään toinen pyyntö ja otetaan ensimmäinen kelvollinen JSON
+    llm_hedge: bool = os.environ.get("LLM_HEDGE", "0") == "1"
+    llm_hedge_quantile: float      = float(os.environ.get("LLM_HEDGE_QUANTILE", "0.95"))
+    llm_hedge_min_delay: float     = float(os.environ.get("LLM_HEDGE_MIN_DELAY", "0.3"))
+    llm_hedge_default_delay: float = float(os.environ.get("LLM_HEDGE_DEFAULT_DELAY", "2.0"))
+    llm_hedge_min_samples: int     = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", "20"))
+    # circuit breaker per (provider, model)
+    llm_breaker_failures: int   = int(os.environ.get("LLM_BREAKER_FAILURES", "5"))
+    llm_breaker_cooldown: float = float(os.environ.get("LLM_BREAKER_COOLDOWN", "30"))
+
+    # lähtevien kutsujen ajoitus per (provider, model): pyyntö- ja token-bucketit
+    # minuuttirajoina (0 = ei rajaa), LLM_RATE_LIMITS ylikirjoittaa parikohtaisesti
+    # muodossa "groq:llama-3.3-70b-versatile=30/6000,groq:llama-3.1-8b-instant=30/20000"
+    llm_rpm: int = int(os.environ.get("LLM_RPM", "0"))
+    llm_tpm: int = int(os.environ.get("LLM_TPM", "0"))
+    llm_rate_limits: str = os.environ.get("LLM_RATE_LIMITS", "")
+    # jonon koko per prioriteettiluokka ja jonotuksen aikaraja (pelivuorot / tausta)
+    llm_queue_size: int = int(os.environ.get("LLM_QUEUE_SIZE", "256"))
+    llm_queue_timeout: float = float(os.environ.get("LLM_QUEUE_TIMEOUT", "10"))
+    llm_background_queue_timeout: float = float(os.environ.get("LLM_BACKGROUND_QUEUE_TIMEOUT", "120"))
+
+    # mock-provider (INTENT_PROVIDER / NARRATION_PROVIDER = mock): viive ennen
+    # ensimmäistä tokenia (fixed tai lognormal, jolloin MOCK_LATENCY on mediaani),
+    # tuotantonopeus tokeneina sekunnissa (0 = heti) ja virheiden osuus
+    mock_latency: float       = float(os.environ.get("MOCK_LATENCY", "0"))
+    mock_latency_dist: str    = os.environ.get("MOCK_LATENCY_DIST", "fixed").lower()
+    mock_latency_sigma: float = float(os.environ.get("MOCK_LATENCY_SIGMA", "0.5"))
+    mock_tokens_per_sec: float = float(os.environ.get("MOCK_TOKENS_PER_SEC", "0"))
+    mock_error_rate: float    = float(os.environ.get("MOCK_ERROR_RATE", "0"))
+    mock_seed: int            = int(os.environ.get("MOCK_SEED", "0"))
+
+    # sessiokohtainen token-budjetti (0 = ei rajaa): soft-rajan jälkeen muistin
+    # tiivistykset ohitetaan, budjetin loputtua narration vaihtaa pienempään
+    # malliin (oletuksena intent-malli); vuorot eivät epäonnistu budjetin takia
+    session_token_budget: int       = int(os.environ.get("SESSION_TOKEN_BUDGET", "0"))
+    session_budget_soft_ratio: float = float(os.environ.get("SESSION_BUDGET_SOFT_RATIO", "0.8"))
+    budget_fallback_provider: str   = os.environ.get("BUDGET_FALLBACK_PROVIDER", "").lower()
+    budget_fallback_model: str      = os.environ.get("BUDGET_FALLBACK_MODEL", "")
+    # /admin/*-reittien X-Admin-Token (tyhjä = admin-reitit pois käytöstä)
+    admin_token: str = os.environ.get("ADMIN_TOKEN", "")
+
+    # HTTP-yhteyspoolit (registry pitää clientit lämpiminä)
+    http_max_connections: int = int(os.environ.get("LLM_HTTP_MAX_CONNECTIONS", "100"))
+    http_max_keepalive: int   = int(os.environ.get("LLM_HTTP_MAX_KEEPALIVE", "20"))
+    http_keepalive_expiry: float = float(os.environ.get("LLM_HTTP_KEEPALIVE_EXPIRY", "60"))
+
 CFG = LLMConfig()
\ No newline at end of file
@@ -0,0 +1,109 @@
+# server/core/cache.py
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+
+class TTLCache:
+    """
+    Pieni LRU-cache, jossa jokaisella merkinnällä on elinaika (ttl sekunteina).
+    Koko on rajattu max_size:en; vanhin käyttämätön merkintä poistetaan ensin.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """Voimassa olevat (avain, arvo) -parit; ei vaikuta LRU-järjestykseen."""
+        now = time.monotonic()
+        return [(key, value) for key, (expires, value) in self._data.items() if expires >= now]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class VariantPool:
+    """
+    LRU-rajattu avain -> pieni joukko vaihtoehtoisia arvoja. Avain on "täynnä",
+    kun siinä on `variants` arvoa; sitä ennen kutsuja täyttää sitä uusilla.
+    Arvoja ei vanhene ajan mukaan; vanhin käyttämätön avain poistetaan ensin.
+    """
+
+    def __init__(self, max_keys: int = 2048, variants: int = 3):
+        self.max_keys = max_keys
+        self.variants = max(1, variants)
+        self._data: "OrderedDict[Hashable, list]" = OrderedDict()
+        self.evictions = 0
+
+    def full(self, key: Hashable) -> bool:
+        pool = self._data.get(key)
+        return pool is not None and len(pool) >= self.variants
+
+    def pick(self, key: Hashable, accept=lambda v: True) -> Optional[Any]:
+        """Satunnainen arvo, jonka accept hyväksyy (esim. ei sama kuin edellinen)."""
+        pool = self._data.get(key)
+        if not pool:
+            return None
+        self._data.move_to_end(key)
+        choices = [v for v in pool if accept(v)]
+        return random.choice(choices) if choices else None
+
+    def add(self, key: Hashable, value: Any) -> None:
+        if self.max_keys <= 0:
+            return
+        pool = self._data.setdefault(key, [])
+        self._data.move_to_end(key)
+        if len(pool) < self.variants:
+            pool.append(value)
+        while len(self._data) > self.max_keys:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
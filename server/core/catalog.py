@@ -0,0 +1,188 @@
+# server/core/catalog.py
+# Esilaskettu hakemisto item-katalogille. Rakennetaan kerran kun items.json
+# ladataan, jotta nimihaut eivät käy koko katalogia läpi joka kutsulla.
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+
+class AhoCorasick:
+    """Monihakuautomaatti: kaikki tekstissä esiintyvät patternit yhdellä läpikäynnillä."""
+
+    def __init__(self, patterns: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._out: List[Tuple[str, ...]] = [()]
+        for pat in patterns:
+            if not pat:
+                continue
+            node = 0
+            for ch in pat:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._out.append(())
+                node = nxt
+            if pat not in self._out[node]:
+                self._out[node] += (pat,)
+
+        # fail-linkit leveyssuunnassa; tulosteet periytyvät fail-ketjusta
+        self._fail = [0] * len(self._goto)
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for ch, child in self._goto[node].items():
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] += self._out[self._fail[child]]
+                queue.append(child)
+
+    def find(self, text: str) -> Set[str]:
+        found: Set[str] = set()
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+
+class _Trie:
+    """Prefix-trie, jonka solmut tietävät alipuunsa avainten määrän ja ensimmäisen avaimen."""
+
+    def __init__(self):
+        self._children: List[Dict[str, int]] = [{}]
+        self._count: List[int] = [0]
+        self._first: List[Optional[str]] = [None]
+
+    def add(self, word: str, key: str) -> None:
+        node = 0
+        self._mark(node, key)
+        for ch in word:
+            nxt = self._children[node].get(ch)
+            if nxt is None:
+                nxt = len(self._children)
+                self._children[node][ch] = nxt
+                self._children.append({})
+                self._count.append(0)
+                self._first.append(None)
+            node = nxt
+            self._mark(node, key)
+
+    def _mark(self, node: int, key: str) -> None:
+        self._count[node] += 1
+        if self._first[node] is None:
+            self._first[node] = key
+
+    def unique(self, prefix: str) -> Optional[str]:
+        node = 0
+        for ch in prefix:
+            node = self._children[node].get(ch)
+            if node is None:
+                return None
+        return self._first[node] if self._count[node] == 1 else None
+
+
+class ItemIndex:
+    """
+    Katalogin haut vakioajassa (tai haettavan merkkijonon pituuden ajassa):
+
+    - pienaakkosnimi -> avain (ensimmäinen, kuten lineaarisessa haussa)
+    - monikkomuodot ('torchs' -> Torch)
+    - prefix-trie yksikäsitteisille alkuosumille
+    - n-grammi-hakemisto osumille, joissa haku sisältyy nimeen ('map' -> Old Map)
+    - yksi Aho-Corasick-automaatti item-nimille, aliaksille ja lisänimille
+      (kauppojen valikoimat), jolla tekstistä löytyvät kaikki nimet kerralla
+    """
+
+    _GRAM = 3
+
+    def __init__(
+        self,
+        items: Dict[str, Any],
+        aliases: Optional[Dict[str, str]] = None,
+        extra_names: Iterable[str] = (),
+    ):
+        self.items = items
+        self.aliases = dict(aliases or {})
+        self._alias_order = {k: i for i, k in enumerate(self.aliases)}
+        self._alias_values = list(self.aliases.values())
+
+        self._by_lower: Dict[str, str] = {}
+        self._all_by_lower: Dict[str, List[str]] = {}
+        self._plural: Dict[str, str] = {}
+        self._trie = _Trie()
+        self._grams: Dict[str, List[str]] = {}
+        for key in items:
+            low = key.lower()
+            self._by_lower.setdefault(low, key)
+            self._all_by_lower.setdefault(low, []).append(key)
+            self._trie.add(low, key)
+            for g in self._ngrams(low):
+                self._grams.setdefault(g, []).append(key)
+        for low, key in self._by_lower.items():
+            self._plural.setdefault(low + "s", key)
+
+        self._matcher = AhoCorasick(
+            [*self.aliases, *self._all_by_lower, *(n.lower() for n in extra_names)]
+        )
+
+    @classmethod
+    def _ngrams(cls, text: str) -> Set[str]:
+        # kaikki 1..3 merkin palat; lyhyet haut käyttävät 1- ja 2-grammeja
+        return {text[i:i + n] for n in range(1, cls._GRAM + 1) for i in range(len(text) - n + 1)}
+
+    def get(self, name: str) -> Tuple[Optional[str], Any]:
+        key = self._by_lower.get(name.lower())
+        if key is None:
+            return None, None
+        return key, self.items[key]
+
+    def singular(self, name_lower: str) -> Optional[str]:
+        """Monikkomuoto ('daggers') -> avain, jos yksikkö on katalogissa."""
+        return self._plural.get(name_lower)
+
+    def unique_prefix(self, prefix_lower: str) -> Optional[str]:
+        """Ainoa avain, joka alkaa annetulla merkkijonolla."""
+        return self._trie.unique(prefix_lower)
+
+    def unique_in(self, text_lower: str) -> Optional[str]:
+        """Ainoa avain, jonka nimi esiintyy tekstissä ('buy dagger' -> Dagger)."""
+        keys = [k for low in self._matcher.find(text_lower) for k in self._all_by_lower.get(low, ())]
+        return keys[0] if len(keys) == 1 else None
+
+    def unique_containing(self, fragment_lower: str) -> Optional[str]:
+        """Ainoa avain, jonka nimeen fragmentti sisältyy ('map' -> Old Map)."""
+        if not fragment_lower:
+            return self._trie.unique("")
+        # harvinaisin n-grammi rajaa ehdokkaat; lopetetaan heti toisen osuman kohdalla
+        n = min(self._GRAM, len(fragment_lower))
+        grams = {fragment_lower[i:i + n] for i in range(len(fragment_lower) - n + 1)}
+        best = min((self._grams.get(g, ()) for g in grams), key=len)
+        hit = None
+        for key in best:
+            if fragment_lower in key.lower():
+                if hit is not None:
+                    return None
+                hit = key
+        return hit
+
+    def scan(self, text_lower: str) -> Set[str]:
+        """Kaikki tekstissä esiintyvät item-nimet ja aliakset (pienaakkosin)."""
+        return self._matcher.find(text_lower)
+
+    def first_alias(self, found: Set[str], skip: Iterable[str] = ()) -> Optional[str]:
+        """ALIASES-järjestyksessä ensimmäinen löydetty alias (arvo palautetaan)."""
+        skip = set(skip)
+        best = None
+        for pat in found:
+            i = self._alias_order.get(pat)
+            if i is not None and self.aliases[pat] not in skip and (best is None or i < best):
+                best = i
+        if best is None:
+            return None
+        return self._alias_values[best]
@@ -0,0 +1,104 @@
+# server/core/gate.py
+import asyncio
+import copy
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from core.cache import TTLCache
+
+
+class TurnGate:
+    """
+    Sarjallistaa saman session vuorot ja yhdistää tuplapyynnöt.
+
+    - Saman session_id:n vuorot ajetaan yksi kerrallaan (asyncio.Lock per sessio).
+    - Jos pyynnöllä on idempotency key ja sama avain on jo käynnissä,
+      jälkimmäinen odottaa ensimmäisen tulosta eikä tee omia LLM-kutsuja.
+    - Hiljattain valmistuneet avaimet vastataan pienestä tulos-cachesta.
+    """
+
+    def __init__(self, recent_size: int = 10000, recent_ttl: float = 300.0):
+        self._locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._recent = TTLCache(max_size=recent_size, ttl=recent_ttl)
+        self._stats = {"runs": 0, "coalesced": 0, "replayed": 0, "waited": 0}
+
+    @asynccontextmanager
+    async def lock(self, session_id: str):
+        """Session lukko; sanakirjan merkintä poistetaan kun kukaan ei odota."""
+        lock, users = self._locks.get(session_id, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[session_id] = (lock, users + 1)
+        if lock.locked():
+            self._stats["waited"] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[session_id]
+            if users <= 1:
+                del self._locks[session_id]
+            else:
+                self._locks[session_id] = (lock, users - 1)
+
+    def recent(self, session_id: str, key: Optional[str]) -> Optional[Any]:
+        if not key:
+            return None
+        hit = self._recent.get((session_id, key))
+        if hit is not None:
+            self._stats["replayed"] += 1
+        return hit
+
+    def remember(self, session_id: str, key: Optional[str], result: Any) -> None:
+        # kopio: tulos voi viitata session eläviin olioihin (TurnOut.state),
+        # joita myöhemmät vuorot muuttavat; replayn pitää näyttää alkuperäinen
+        if key:
+            self._recent.set((session_id, key), copy.deepcopy(result))
+
+    async def run(self, session_id: str, key: Optional[str], fn: Callable[[], Awaitable[Any]]) -> Any:
+        cached = self.recent(session_id, key)
+        if cached is not None:
+            return cached
+
+        if key:
+            pending = self._inflight.get((session_id, key))
+            if pending is not None:
+                self._stats["coalesced"] += 1
+                # shield: tuplapyynnön katkeaminen ei saa perua alkuperäistä vuoroa
+                return await asyncio.shield(pending)
+            fut = asyncio.get_running_loop().create_future()
+            self._inflight[(session_id, key)] = fut
+
+        try:
+            async with self.lock(session_id):
+                # sama avain ehti valmistua toisesta endpointista lukkoa odottaessa
+                result = self.recent(session_id, key)
+                if result is None:
+                    self._stats["runs"] += 1
+                    result = await fn()
+        except BaseException as e:
+            if key:
+                self._inflight.pop((session_id, key), None)
+                if not fut.done():
+                    if isinstance(e, asyncio.CancelledError):
+                        fut.cancel()
+                    else:
+                        fut.set_exception(e)
+                        # haetaan poikkeus, jottei asyncio valita jos kukaan ei odottanut
+                        fut.exception()
+            raise
+
+        if key:
+            self.remember(session_id, key, result)
+            self._inflight.pop((session_id, key), None)
+            fut.set_result(result)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "active_sessions": len(self._locks),
+            "inflight_keys": len(self._inflight),
+            "recent_results": len(self._recent),
+        }
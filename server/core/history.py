@@ -0,0 +1,191 @@
+# server/core/history.py
+import os
+import sqlite3
+import tempfile
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import CFG
+from core.cache import TTLCache
+from core.store import SqliteWriter, connect_sqlite
+
+
+class HistoryStore:
+    """
+    Sessioiden koko vuorohistoria SQLitessä. Pelitilassa pidetään vain
+    viimeiset CFG.log_tail_size vuoroa; vanhemmat haetaan täältä sivuittain.
+
+    Kirjoitukset tehdään SqliteWriterin säikeessä (record kutsutaan joka
+    vuorolla event loopista); commitoimattomat rivit pidetään _pendingissä ja
+    yhdistetään lukuihin, joten /api/log ja recall näkevät ne heti.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = connect_sqlite(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS history ("
+            " session_id TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " player TEXT NOT NULL,"
+            " gm TEXT NOT NULL,"
+            " PRIMARY KEY (session_id, seq))"
+        )
+        self._db.commit()
+        # session_id -> seq -> (player, gm), kunnes writer on commitoinut rivin
+        self._pending: Dict[str, Dict[int, Tuple[str, str]]] = {}
+        # sessiot, joiden poisto odottaa writeria: levyn rivit eivät enää näy
+        self._cleared: Dict[str, int] = {}
+        # session_id -> suurin jo kirjoitukseen lähetetty seq: pelitilan loki
+        # sisältää joka vuoro koko hännän, mutta vain uudet merkinnät kirjoitetaan.
+        # Unohtunut merkintä (häätö/idle) tarkoittaa vain yhtä INSERT OR IGNORE -kierrosta.
+        self._recorded = TTLCache(max_size=CFG.session_max_resident, ttl=CFG.session_idle_ttl)
+        self._writer = SqliteWriter(path)
+
+    def record(self, session_id: str, log: List[Dict[str, Any]]) -> None:
+        """Kirjaa pelitilan lokin merkinnät; jo kirjatut (sama seq) ohitetaan."""
+        with self._lock:
+            high = self._recorded.get(session_id) or 0
+            pending = self._pending.setdefault(session_id, {})
+            rows: List[Tuple[int, Tuple[str, str]]] = []
+            for e in log:
+                if "turn" not in e or e["turn"] <= high or e["turn"] in pending:
+                    continue
+                row = pending[e["turn"]] = (e.get("player", ""), e.get("gm", ""))
+                rows.append((e["turn"], row))
+            if not pending:
+                del self._pending[session_id]
+            if rows:
+                self._recorded.set(session_id, max(high, max(seq for seq, _ in rows)))
+        if not rows:
+            return
+
+        def op(db: sqlite3.Connection) -> Callable[[], None]:
+            db.executemany(
+                "INSERT OR IGNORE INTO history (session_id, seq, player, gm) VALUES (?, ?, ?, ?)",
+                [(session_id, seq, p, g) for seq, (p, g) in rows],
+            )
+            return lambda: self._settle(session_id, rows)
+
+        self._writer.submit(op)
+
+    def page(self, session_id: str, before: Optional[int] = None, limit: int = 20) -> Dict[str, Any]:
+        """
+        Palauttaa enintään limit vuoroa, jotka ovat vanhempia kuin before
+        (None = uusimmat), aikajärjestyksessä. next_cursor on vanhimman
+        palautetun vuoron seq, tai None jos vanhempia ei ole.
+        """
+        limit = max(1, min(limit, 200))
+        before = before if before is not None else 2 ** 62
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, player, gm FROM history WHERE session_id = ? AND seq < ?"
+                " ORDER BY seq DESC LIMIT ?",
+                (session_id, before, limit + 1),
+            ).fetchall()
+            rows = self._merge(session_id, rows, lambda seq: seq < before)
+        rows = rows[-(limit + 1):]
+        more = len(rows) > limit
+        rows = rows[-limit:]
+        return {
+            "entries": [{"turn": seq, "player": p, "gm": g} for seq, p, g in rows],
+            "next_cursor": rows[0][0] if (rows and more) else None,
+        }
+
+    def since(self, session_id: str, after: int, limit: int = 10000) -> List[Tuple[int, str, str]]:
+        """Vuorot, joiden seq > after (enintään limit uusinta), vanhimmasta uusimpaan."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, player, gm FROM history WHERE session_id = ? AND seq > ?"
+                " ORDER BY seq DESC LIMIT ?",
+                (session_id, after, limit),
+            ).fetchall()
+            rows = self._merge(session_id, rows, lambda seq: seq > after)
+        return rows[-limit:]
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._pending.pop(session_id, None)
+            self._recorded.set(session_id, 0)
+            self._cleared[session_id] = self._cleared.get(session_id, 0) + 1
+
+        def op(db: sqlite3.Connection) -> Callable[[], None]:
+            db.execute("DELETE FROM history WHERE session_id = ?", (session_id,))
+            return lambda: self._settle_delete(session_id)
+
+        self._writer.submit(op)
+
+    def close(self) -> None:
+        self._writer.close()
+        with self._lock:
+            self._db.close()
+
+    # --- sisäiset ---
+
+    def _merge(
+        self, session_id: str, rows: List[Tuple[int, str, str]], keep: Callable[[int], bool]
+    ) -> List[Tuple[int, str, str]]:
+        # kutsutaan lukon alla; palauttaa vanhimmasta uusimpaan
+        if session_id in self._cleared:
+            rows = []
+        pending = self._pending.get(session_id)
+        if pending:
+            merged = {seq: (seq, p, g) for seq, p, g in rows}
+            for seq, (p, g) in pending.items():
+                if keep(seq):
+                    merged.setdefault(seq, (seq, p, g))
+            rows = list(merged.values())
+        return sorted(rows)
+
+    def _settle_delete(self, session_id: str) -> None:
+        with self._lock:
+            n = self._cleared.pop(session_id) - 1
+            if n:
+                self._cleared[session_id] = n
+
+    def _settle(self, session_id: str, rows: List[Tuple[int, Tuple[str, str]]]) -> None:
+        with self._lock:
+            pending = self._pending.get(session_id)
+            if pending is None:
+                return
+            for seq, row in rows:
+                # delete + uusi sessio voi jo odottaa samaa seq:iä uudella rivillä
+                if pending.get(seq) is row:
+                    del pending[seq]
+            if not pending:
+                del self._pending[session_id]
+
+
+_HISTORY: Optional[HistoryStore] = None
+_HISTORY_LOCK = threading.Lock()
+
+
+def get_history() -> HistoryStore:
+    """
+    Historia kulkee samassa tiedostossa kuin sessiot: jaetussa tilassa
+    CFG.session_db_path, muuten prosessin oma temp-tiedosto.
+    """
+    global _HISTORY
+    with _HISTORY_LOCK:
+        if _HISTORY is None:
+            if CFG.session_backend == "sqlite":
+                path = CFG.session_db_path
+            else:
+                path = os.path.join(tempfile.gettempdir(), f"aidventure-history-{os.getpid()}.sqlite3")
+            _HISTORY = HistoryStore(path)
+        return _HISTORY
+
+
+def close_history() -> None:
+    global _HISTORY
+    with _HISTORY_LOCK:
+        if _HISTORY is not None:
+            _HISTORY.close()
+            if CFG.session_backend != "sqlite":
+                for suffix in ("", "-wal", "-shm"):
+                    try:
+                        os.remove(_HISTORY.path + suffix)
+                    except OSError:
+                        pass
+            _HISTORY = None
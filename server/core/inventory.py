@@ -0,0 +1,86 @@
+# server/core/inventory.py
+from typing import Any, Dict, List, Optional
+
+
+class Inventory:
+    """
+    Pelaajan tavarat avainnettuna casefoldatulla nimellä: lisäys, poisto ja
+    määrän haku ovat O(1). Dictin järjestys säilyttää lisäysjärjestyksen.
+
+    Prosessin muistissa olevassa pelitilassa state["inventory"] on tämä olio
+    (Inventory.of liittää sen kerran). Tallennuksissa, vastauksissa, patcheissa,
+    prompteissa ja web-clientin InventoryPanelissa inventaario on listamuodossa
+    [{"name": ..., "count": ...}]; state_to_dict / state_from_dict muuntavat rajalla.
+    """
+
+    __slots__ = ("_items",)
+
+    def __init__(self) -> None:
+        # casefold(name) -> [nimi sellaisena kuin se lisättiin, määrä]
+        self._items: Dict[str, List[Any]] = {}
+
+    @classmethod
+    def from_list(cls, items: Optional[List[Dict[str, Any]]]) -> "Inventory":
+        inv = cls()
+        for it in items or []:
+            inv.add(it["name"], it["count"])
+        return inv
+
+    @classmethod
+    def of(cls, state: Dict[str, Any]) -> "Inventory":
+        """Session oma inventaario; listamuotoinen muunnetaan paikallaan vain kerran."""
+        inv = state.get("inventory")
+        if not isinstance(inv, cls):
+            inv = state["inventory"] = cls.from_list(inv)
+        return inv
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        return [{"name": name, "count": count} for name, count in self._items.values()]
+
+    def names(self) -> List[str]:
+        return [name for name, _ in self._items.values()]
+
+    def count(self, name: str) -> int:
+        entry = self._items.get(name.casefold())
+        return entry[1] if entry else 0
+
+    def has(self, name: str, qty: int = 1) -> bool:
+        return self.count(name) >= qty
+
+    def add(self, name: str, qty: int = 1) -> None:
+        entry = self._items.get(name.casefold())
+        if entry:
+            entry[1] += qty
+        else:
+            self._items[name.casefold()] = [name, qty]
+
+    def remove(self, name: str, qty: int = 1) -> bool:
+        """Vähentää qty kpl; rivi poistuu kun määrä menee nollaan. False jos ei riitä."""
+        key = name.casefold()
+        entry = self._items.get(key)
+        if not entry or entry[1] < qty:
+            return False
+        entry[1] -= qty
+        if entry[1] <= 0:
+            del self._items[key]
+        return True
+
+    def __contains__(self, name: str) -> bool:
+        return name.casefold() in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+def state_to_dict(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Pelitila tallennus-/vastausmuotoon (matala kopio, inventaario listana)."""
+    inv = state.get("inventory")
+    if not isinstance(inv, Inventory):
+        return state
+    return {**state, "inventory": inv.to_list()}
+
+
+def state_from_dict(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Tallennettu pelitila muistiin: inventaario Inventory-olioksi."""
+    Inventory.of(data)
+    return data
@@ -1,4 +1,6 @@
-from typing import List, Dict, Any, Callable, Optional
+from typing import List, Dict, Any, Callable, Optional, Tuple
+
+from core.store import make_store
 
 def _trim_summary(s: str, max_chars: int) -> str:
     if len(s) <= max_chars:
@@ -30,13 +32,30 @@ class MemoryManager:
         if gm_text:
             self._pending_texts.append(gm_text)
 
-    def update_long_summary(self, summarize_func) -> None:
+    async def update_long_summary(self, summarize_func) -> None:
+        result = await self.summarize(summarize_func)
+        if result:
+            self.apply_summary(*result)
+
+    async def summarize(self, summarize_func) -> Optional[Tuple[str, int]]:
+        # summarize_func is an async callable: (prev_summary, pending_texts) -> str
+        # returns (new_summary, number of pending texts it covers) without mutating
         if not self._pending_texts and self._long_summary:
-            return
-        new_summary = summarize_func(self._long_summary, self._pending_texts)
-        if new_summary:
-            self._long_summary = _trim_summary(new_summary.strip(), self.max_long_chars)
-            self._pending_texts.clear()
+            return None
+        consumed = len(self._pending_texts)
+        new_summary = await summarize_func(self._long_summary, list(self._pending_texts))
+        if not new_summary:
+            return None
+        return new_summary, consumed
+
+    def apply_summary(self, new_summary: str, consumed: int) -> None:
+        # texts added while the summary was being written stay pending
+        self._long_summary = _trim_summary(new_summary.strip(), self.max_long_chars)
+        del self._pending_texts[:consumed]
+
+    def pending_size(self) -> Tuple[int, int]:
+        # (number of texts, total characters) waiting for the next summary
+        return len(self._pending_texts), sum(len(t) for t in self._pending_texts)
 
     def get_short_texts(self) -> List[Dict[str, str]]:
         return list(self._short_texts)
@@ -44,16 +63,69 @@ class MemoryManager:
     def get_long_summary(self) -> str:
         return self._long_summary
 
-# Session-scoped registry
-_MANAGERS: Dict[str, MemoryManager] = {}
+    # serialization for spilling evicted managers to disk
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "short_term_limit": self.short_term_limit,
+            "max_long_chars": self.max_long_chars,
+            "short_texts": self._short_texts,
+            "pending_texts": self._pending_texts,
+            "long_summary": self._long_summary,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MemoryManager":
+        mgr = cls(
+            short_term_limit=data.get("short_term_limit", 5),
+            max_long_chars=data.get("max_long_chars", 1200),
+        )
+        mgr._short_texts = list(data.get("short_texts") or [])
+        mgr._pending_texts = list(data.get("pending_texts") or [])
+        mgr._long_summary = data.get("long_summary") or ""
+        return mgr
+
+# Session-scoped registry (bounded in-process store by default,
+# shared SQLite store when SESSION_BACKEND=sqlite)
+_MANAGERS = make_store("memory", dump=MemoryManager.to_dict, load=MemoryManager.from_dict)
+
+def _new_manager() -> MemoryManager:
+    return MemoryManager(short_term_limit=5, max_long_chars=1200)
 
 def get_memory_manager(session_id: str) -> MemoryManager:
     mgr = _MANAGERS.get(session_id)
     if mgr is None:
-        mgr = MemoryManager(short_term_limit=5, max_long_chars=1200)
-        _MANAGERS[session_id] = mgr
+        mgr = _new_manager()
+        _MANAGERS.set(session_id, mgr)
     return mgr
 
+async def aget_memory_manager(session_id: str) -> MemoryManager:
+    """
+    Read-only access for the event loop: the shared store is read in a thread.
+    A missing manager is returned fresh without saving; writes go through aupdate_memory.
+    """
+    mgr, _ = await _MANAGERS.aload(session_id)
+    return mgr if mgr is not None else _new_manager()
+
+async def memory_pending_size(session_id: str) -> Tuple[int, int]:
+    return (await aget_memory_manager(session_id)).pending_size()
+
+def update_memory(session_id: str, fn: Callable[[MemoryManager], None]) -> MemoryManager:
+    """Apply fn to the session's manager and persist it (retries on version conflicts)."""
+    return _MANAGERS.update(session_id, fn, _new_manager)
+
+async def aupdate_memory(session_id: str, fn: Callable[[MemoryManager], None]) -> MemoryManager:
+    """update_memory for the event loop (shared store writes run in a thread)."""
+    return await _MANAGERS.aupdate(session_id, fn, _new_manager)
+
+def memory_pinned(session_id: str):
+    """Context manager: the manager is not evicted while a turn is using it."""
+    return _MANAGERS.pinned(session_id)
+
 def reset_memory(session_id: str) -> None:
-    if session_id in _MANAGERS:
-        del _MANAGERS[session_id]
\ No newline at end of file
+    _MANAGERS.delete(session_id)
+
+def memory_store_stats() -> Dict[str, Any]:
+    return _MANAGERS.stats()
+
+def close_memory_store() -> None:
+    _MANAGERS.close()
\ No newline at end of file
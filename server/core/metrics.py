@@ -0,0 +1,142 @@
+# server/core/metrics.py
+# Kevyt Prometheus-yhteensopiva mittarirekisteri (text exposition format 0.0.4)
+# ilman ulkoisia riippuvuuksia. Mittarit luodaan moduulitasolla kerran ja
+# päivitetään kuumalla polulla pelkillä dict-operaatioilla; /metrics renderöi.
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple
+
+# sekunteja; sama asteikko kuin LLM-reittien histogrammeissa, alapäässä tiheämpi
+# koska sääntölogiikka ja tilan käsittely ovat mikrosekuntiluokkaa
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0)
+
+_REGISTRY: List[Any] = []
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[Any], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _num(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def histogram_lines(
+    name: str,
+    label_names: Sequence[str],
+    label_values: Sequence[Any],
+    buckets: Sequence[float],
+    counts: Sequence[int],
+    total: float,
+    count: int,
+) -> List[str]:
+    """
+    Yhden histogrammisarjan rivit. counts on per-bucket (ei kumulatiivinen),
+    viimeinen alkio = +Inf; myös llm.resilience.LatencyHistogram renderöidään tällä.
+    """
+    lines = []
+    running = 0
+    for upper, n in zip([*buckets, float("inf")], counts):
+        running += n
+        le = (("le", _num(upper)),)
+        lines.append(f"{name}_bucket{_labels(label_names, label_values, le)} {running}")
+    lines.append(f"{name}_sum{_labels(label_names, label_values)} {_num(float(total))}")
+    lines.append(f"{name}_count{_labels(label_names, label_values)} {count}")
+    return lines
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[Any, ...], float] = {}
+        _REGISTRY.append(self)
+
+    def inc(self, *labels: Any, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {_num(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket laskurit, summa, lukumäärä]
+        self._series: Dict[Tuple[Any, ...], List[Any]] = {}
+        _REGISTRY.append(self)
+
+    def observe(self, value: float, *labels: Any) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        counts = series[0]
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, *labels: Any) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in self._series.items():
+            lines.extend(histogram_lines(self.name, self.label_names, labels, self.buckets, counts, total, count))
+        return lines
+
+
+class Gauge:
+    """Arvo luetaan vasta renderöitäessä (esim. muistissa olevien sessioiden määrä)."""
+
+    def __init__(self, name: str, doc: str, read: Callable[[], float]):
+        self.name = name
+        self.doc = doc
+        self._read = read
+        _REGISTRY.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} gauge", f"{self.name} {_num(self._read())}"]
+
+
+class Collector:
+    """Valmiit rivit muualla pidetystä tilasta (esim. LLM-reittien histogrammit)."""
+
+    def __init__(self, collect: Callable[[], List[str]]):
+        self._collect = collect
+        _REGISTRY.append(self)
+
+    def render(self) -> List[str]:
+        return self._collect()
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,64 @@
+# server/core/patch.py
+import copy
+from typing import Any, Dict, List
+
+# JSON Patch (RFC 6902) -tyyliset muutokset: {"op": "add"|"remove"|"replace", "path": "/a/0/b", "value": ...}
+Patch = List[Dict[str, Any]]
+
+
+def _escape(key: Any) -> str:
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def _diff_list(old: List[Any], new: List[Any], path: str, out: Patch) -> None:
+    # rengaspuskuri (log) ja inventaarion lisäykset: vanhan loppuosa on uuden alku
+    # -> k kpl "remove /0" + uudet perään. Täysi log siirtyy joka vuoro yhdellä,
+    # joten siirtymä tarkistetaan myös saman pituisille listoille ennen
+    # alkioittaista vertailua (joka näkisi jokaisen indeksin muuttuneen).
+    shifted = None
+    for k in range(len(old)):
+        tail = old[k:]
+        if len(tail) <= len(new) and new[: len(tail)] == tail:
+            shifted = [{"op": "remove", "path": f"{path}/0"} for _ in range(k)]
+            shifted += [{"op": "add", "path": f"{path}/-", "value": v} for v in new[len(tail):]]
+            break
+    if len(old) == len(new):
+        pairwise: Patch = []
+        for i, (a, b) in enumerate(zip(old, new)):
+            _diff(a, b, f"{path}/{i}", pairwise)
+        if shifted is None or len(pairwise) <= len(shifted):
+            out.extend(pairwise)
+            return
+    if shifted is not None:
+        out.extend(shifted)
+        return
+    # ei yhteistä osaa: tyhjennys ja uudet alkiot (tai koko lista kerralla)
+    out.extend({"op": "remove", "path": f"{path}/0"} for _ in old)
+    out.extend({"op": "add", "path": f"{path}/-", "value": v} for v in new)
+
+
+def _diff(old: Any, new: Any, path: str, out: Patch) -> None:
+    if old == new:
+        return
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                out.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in new.items():
+            sub = f"{path}/{_escape(key)}"
+            if key not in old:
+                out.append({"op": "add", "path": sub, "value": value})
+            else:
+                _diff(old[key], value, sub, out)
+    elif isinstance(old, list) and isinstance(new, list):
+        _diff_list(old, new, path, out)
+    else:
+        out.append({"op": "replace", "path": path, "value": new})
+
+
+def make_patch(old: Dict[str, Any], new: Dict[str, Any]) -> Patch:
+    """Muutokset, joilla old muuttuu new:ksi. Arvot kopioidaan, jotta patch ei elä tilan mukana."""
+    out: Patch = []
+    _diff(old, new, "", out)
+    return copy.deepcopy(out)
+
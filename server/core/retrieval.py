@@ -0,0 +1,153 @@
+# server/core/retrieval.py
+import asyncio
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import CFG
+from core.cache import TTLCache
+from core.history import get_history
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i if in into is it its "
+    "me my of on or our she so that the their them then there they this to was we were "
+    "what with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [w for w in _WORD_RE.findall((text or "").lower()) if len(w) > 1 and w not in _STOPWORDS]
+
+
+class BM25Index:
+    """
+    Inkrementaalinen BM25-hakemisto yhden session vuoroille (puhdas Python).
+
+    - add() on O(lisätyn tekstin pituus)
+    - koko on rajattu max_docs vuoroon; vanhin vuoro poistetaan ensin
+    - search() käy läpi vain kyselyn termien postaukset
+    - lock: synkka ja haku ajetaan säiepoolissa, ja saman session
+      spekulaatiot voivat hakea rinnakkain
+    """
+
+    __slots__ = ("max_docs", "last_seq", "lock", "_docs", "_postings", "_total_len")
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, max_docs: int = 10000):
+        self.max_docs = max_docs
+        self.last_seq = 0
+        self.lock = threading.Lock()
+        # seq -> (pituus, termifrekvenssit, teksti)
+        self._docs: Dict[int, Tuple[int, Dict[str, int], str]] = {}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._total_len = 0
+
+    def add(self, seq: int, text: str) -> None:
+        if seq in self._docs:
+            return
+        tf = Counter(tokenize(text))
+        length = sum(tf.values())
+        self._docs[seq] = (length, tf, text)
+        self._total_len += length
+        for term, n in tf.items():
+            self._postings.setdefault(term, {})[seq] = n
+        self.last_seq = max(self.last_seq, seq)
+        while len(self._docs) > self.max_docs:
+            self._remove(next(iter(self._docs)))
+
+    def _remove(self, seq: int) -> None:
+        length, tf, _ = self._docs.pop(seq)
+        self._total_len -= length
+        for term in tf:
+            posting = self._postings[term]
+            del posting[seq]
+            if not posting:
+                del self._postings[term]
+
+    def search(self, query: str, k: int = 3, before_seq: Optional[int] = None) -> List[Tuple[int, str]]:
+        """k parasta (seq, teksti) -paria; before_seq rajaa pois tuoreet vuorot."""
+        n_docs = len(self._docs)
+        if not n_docs or k <= 0:
+            return []
+        avg_len = (self._total_len / n_docs) or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            posting = self._postings.get(term)
+            if not posting:
+                continue
+            df = len(posting)
+            idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            for seq, n in posting.items():
+                if before_seq is not None and seq >= before_seq:
+                    continue
+                length = self._docs[seq][0]
+                norm = self.K1 * (1.0 - self.B + self.B * length / avg_len)
+                scores[seq] = scores.get(seq, 0.0) + idf * n * (self.K1 + 1.0) / (n + norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda x: x[1])
+        return [(seq, self._docs[seq][2]) for seq, _ in best]
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"docs": len(self._docs), "terms": len(self._postings), "last_seq": self.last_seq}
+
+
+# sessiokohtaiset hakemistot ovat välimuistia: lähde on core.history, joten
+# häädetty tai toisen workerin päivittämä hakemisto täydennetään sieltä.
+# Koko ja idle-aika seuraavat sessiosäilöä (RECALL_MAX_SESSIONS oletuksena
+# SESSION_MAX_RESIDENT), jottei aktiivisen session hakemistoa rakenneta
+# joka vuoro uudelleen alusta.
+_INDEXES = TTLCache(max_size=CFG.recall_max_sessions, ttl=CFG.session_idle_ttl)
+
+
+def _turn_text(player: str, gm: str) -> str:
+    return f"You: {player} / GM: {gm}"
+
+
+def _index(session_id: str) -> BM25Index:
+    idx = _INDEXES.get(session_id)
+    if idx is None:
+        idx = BM25Index(max_docs=CFG.recall_max_docs)
+    _INDEXES.set(session_id, idx)
+    return idx
+
+
+def _sync_and_search(
+    idx: BM25Index, session_id: str, query: str, before_seq: Optional[int]
+) -> List[Tuple[int, str]]:
+    # ajetaan säiepoolissa: historian luku ja tokenointi eivät pysäytä event looppia
+    with idx.lock:
+        # vain edellisen synkan jälkeen kirjatut vuorot (O(uusi teksti))
+        for seq, player, gm in get_history().since(session_id, idx.last_seq, limit=CFG.recall_max_docs):
+            idx.add(seq, _turn_text(player, gm))
+        return idx.search(query, k=CFG.recall_k, before_seq=before_seq)
+
+
+async def recall(session_id: str, query: str, before_seq: Optional[int] = None) -> List[str]:
+    """
+    CFG.recall_k osuvinta aiempaa vuoroa kyselylle (pelaajan teksti + paikka),
+    pois lukien before_seq:stä alkaen tuoreet vuorot, jotka ovat jo lyhyessä muistissa.
+    """
+    if CFG.recall_k <= 0 or not query:
+        return []
+    hits = await asyncio.to_thread(_sync_and_search, _index(session_id), session_id, query, before_seq)
+    limit = CFG.recall_snippet_chars
+    return [
+        f"[turn {seq}] " + (text if len(text) <= limit else text[:limit].rstrip() + "…")
+        for seq, text in hits
+    ]
+
+
+def drop_recall_index(session_id: str) -> None:
+    _INDEXES.set(session_id, BM25Index(max_docs=CFG.recall_max_docs))
+
+
+def recall_stats() -> Dict[str, Any]:
+    return _INDEXES.stats()
@@ -2,12 +2,10 @@
 from typing import Dict, Any
 from core.types import Intent
 from core.state import get_item
+from core.inventory import Inventory
 
 def in_inventory(state: Dict[str, Any], name: str, qty: int = 1) -> bool:
-    for it in state["inventory"]:
-        if it["name"].lower() == name.lower() and it["count"] >= qty:
-            return True
-    return False
+    return Inventory.of(state).has(name, qty)
 
 def sanity_check(state: Dict[str, Any], intent: Intent):
     p = state["player"]
@@ -0,0 +1,92 @@
+# server/core/shop.py
+# core/world.py:n SHOPS-määrittely käännettynä kerran paikkakohtaisiksi
+# hakemistoiksi. Vuoron aikana kauppalogiikka tekee vain dict-hakuja ja yhden
+# tekstiläpikäynnin avainsanoille, kauppojen ja paikkojen määrästä riippumatta.
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from core.catalog import AhoCorasick
+from core.state import get_item
+from core.world import SHOPS, SHOP_HINT_WORDS, SHOP_HAGGLE_WORDS, SHOP_SUPPLY_WORDS
+
+# napit, jos kaupassa ei ole tarjottavaa
+DEFAULT_CHOICES = ["LOOK around", "Go to cave", "Return to tavern"]
+
+
+@dataclass(frozen=True)
+class Shop:
+    id: str
+    catalog: Dict[str, int]           # vain items.json:sta löytyvät, config-järjestyksessä
+    stock: Dict[str, int]             # rajallisen varaston itemit -> kpl per sessio
+    offers: str                       # valmis vastaus hintakyselyyn
+    choices: List[str]                # valmiit napit kaupan jälkeen
+    haggle_text: str
+    food_text: Optional[str]
+    supplies: Tuple[Tuple[str, int], ...]  # "supplies"-ostoksen sisältö (tyhjä = ei myydä)
+    sells_supplies: bool
+
+
+def _compile_shop(shop_id: str, cfg: Dict[str, Any]) -> Shop:
+    catalog: Dict[str, int] = {}
+    stock: Dict[str, int] = {}
+    for name, entry in cfg["catalog"].items():
+        if get_item(name)[0] is None:
+            continue
+        catalog[name] = int(entry["price"])
+        if entry.get("stock") is not None:
+            stock[name] = int(entry["stock"])
+
+    offers = ", ".join(f"{name} for {price} coins" for name, price in catalog.items())
+    buttons = [f"Buy {name}" for name in cfg.get("buttons", []) if get_item(name)[0] is not None]
+
+    return Shop(
+        id=shop_id,
+        catalog=catalog,
+        stock=stock,
+        offers=cfg["offer_text"].format(offers=offers) if offers else cfg["empty_text"],
+        choices=buttons or list(DEFAULT_CHOICES),
+        haggle_text=cfg["haggle_text"],
+        food_text=cfg.get("food_text"),
+        supplies=tuple(sorted(catalog.items(), key=lambda x: x[1])[:2]),
+        sells_supplies=bool(cfg.get("supplies")),
+    )
+
+
+def _compile(shops: Dict[str, Dict[str, Any]]) -> Dict[str, Shop]:
+    by_location: Dict[str, Shop] = {}
+    for shop_id, cfg in shops.items():
+        shop = _compile_shop(shop_id, cfg)
+        for loc in cfg["locations"]:
+            by_location.setdefault(loc, shop)
+    return by_location
+
+
+SHOPS_BY_LOCATION: Dict[str, Shop] = _compile(SHOPS)
+
+# yksi automaatti kaikille kauppasanoille; ryhmät tarkistetaan joukko-operaatioilla
+_HINTS: Set[str] = set(SHOP_HINT_WORDS)
+_HAGGLE: Set[str] = set(SHOP_HAGGLE_WORDS)
+_SUPPLY: Set[str] = set(SHOP_SUPPLY_WORDS)
+_KEYWORDS = AhoCorasick([*_HINTS, *_HAGGLE, *_SUPPLY])
+
+
+def shop_at(location: str) -> Optional[Shop]:
+    return SHOPS_BY_LOCATION.get(location)
+
+
+def shop_choices(location: str) -> List[str]:
+    shop = SHOPS_BY_LOCATION.get(location)
+    return shop.choices if shop else list(DEFAULT_CHOICES)
+
+
+class ShopWords:
+    """Tekstistä löytyneet kauppasanat ryhmittäin (yksi läpikäynti)."""
+
+    __slots__ = ("hint", "haggle", "supplies", "food")
+
+    def __init__(self, text_lower: str):
+        found = _KEYWORDS.find(text_lower)
+        self.hint = bool(found & _HINTS)
+        self.haggle = bool(found & _HAGGLE)
+        self.supplies = bool(found & _SUPPLY)
+        self.food = "food" in found
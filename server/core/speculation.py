@@ -0,0 +1,147 @@
+# server/core/speculation.py
+import asyncio
+import copy
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+_WS = re.compile(r"\s+")
+
+
+def _norm(text: str) -> str:
+    return _WS.sub(" ", (text or "").strip().lower()).strip(" .!?")
+
+
+@dataclass
+class SpecResult:
+    """
+    Yhden spekulatiivisesti ajetun valinnan tulos.
+
+    intent:  valmiiksi parsittu Intent
+    state:   pelitilan kopio vuoron jälkeen (None jos vain intent ajettiin)
+    turn:    valmis TurnOut (None jos vain intent ajettiin)
+    gm_text: GM:n narration muistia varten (None jos ei GM-kutsua)
+    tokens:  arvio kulutetuista tokeneista (hukkametriikkaa varten)
+    """
+    intent: Any
+    state: Optional[Dict[str, Any]] = None
+    turn: Any = None
+    gm_text: Optional[str] = None
+    tokens: int = 0
+
+
+@dataclass
+class _SessionSpec:
+    version: int
+    created: float
+    tasks: Dict[str, asyncio.Task] = field(default_factory=dict)
+
+
+Runner = Callable[[Dict[str, Any], str], Awaitable[SpecResult]]
+
+
+class Speculator:
+    """
+    Ajaa GM:n tarjoamat valinnat etukäteen taustalla.
+
+    launch() käynnistää jokaiselle valinnalle oman taskin tilan kopiolla ja
+    merkitsee ne tilan versiolla. take() palauttaa valmiin tuloksen, jos
+    pelaajan teksti vastaa jotain valintaa ja versio on yhä sama; muuten
+    kaikki session spekulaatiot perutaan.
+    """
+
+    def __init__(self, max_concurrency: int = 8, ttl: float = 120.0):
+        self.max_concurrency = max_concurrency
+        self.ttl = ttl
+        self._sessions: Dict[str, _SessionSpec] = {}
+        self._running = 0
+        self._stats = {
+            "launched": 0,
+            "skipped": 0,
+            "hits": 0,
+            "misses": 0,
+            "cancelled": 0,
+            "failed": 0,
+            "tokens_used": 0,
+            "tokens_wasted": 0,
+        }
+
+    async def launch(self, session_id: str, version: int, snapshot: Dict[str, Any],
+                     choices: List[str], runner: Runner) -> None:
+        self.discard(session_id)
+        self._sweep()
+        entry = _SessionSpec(version=version, created=time.monotonic())
+        for choice in choices:
+            key = _norm(choice)
+            if not key or key in entry.tasks:
+                continue
+            if self._running >= self.max_concurrency:
+                self._stats["skipped"] += 1
+                continue
+            # jokainen valinta saa oman kopionsa, koska runner muokkaa tilaa
+            snap = copy.deepcopy(snapshot)
+            self._running += 1
+            task = asyncio.create_task(self._run(runner, snap, choice))
+            task.add_done_callback(self._finished)
+            entry.tasks[key] = task
+            self._stats["launched"] += 1
+        if entry.tasks:
+            self._sessions[session_id] = entry
+
+    async def _run(self, runner: Runner, snapshot: Dict[str, Any], text: str) -> SpecResult:
+        res = await runner(snapshot, text)
+        self._stats["tokens_used"] += res.tokens
+        return res
+
+    def _finished(self, task: asyncio.Task) -> None:
+        self._running -= 1
+
+    async def take(self, session_id: str, text: str, version: int) -> Optional[SpecResult]:
+        """Palauttaa spekuloidun tuloksen, jos teksti ja versio täsmäävät; muuten None."""
+        entry = self._sessions.pop(session_id, None)
+        if entry is None:
+            return None
+        task = entry.tasks.pop(_norm(text), None) if entry.version == version else None
+        self._cancel(entry)
+        if task is None:
+            self._stats["misses"] += 1
+            return None
+        try:
+            res = await task
+        except (asyncio.CancelledError, Exception):
+            self._stats["failed"] += 1
+            return None
+        self._stats["hits"] += 1
+        return res
+
+    def discard(self, session_id: str) -> None:
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self._cancel(entry)
+
+    def _cancel(self, entry: _SessionSpec) -> None:
+        for task in entry.tasks.values():
+            if task.done():
+                if not task.cancelled() and task.exception() is None:
+                    self._stats["tokens_wasted"] += task.result().tokens
+            else:
+                task.cancel()
+                self._stats["cancelled"] += 1
+        entry.tasks.clear()
+
+    def _sweep(self) -> None:
+        # hylätyt sessiot eivät saa pitää tilakopioita muistissa loputtomiin
+        now = time.monotonic()
+        stale = [sid for sid, e in self._sessions.items() if now - e.created > self.ttl]
+        for sid in stale:
+            self.discard(sid)
+
+    def stats(self) -> Dict[str, Any]:
+        taken = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "running": self._running,
+            "pending_sessions": len(self._sessions),
+            "hit_rate": round(self._stats["hits"] / taken, 3) if taken else 0.0,
+        }
@@ -1,6 +1,11 @@
 import json, os
 from typing import Dict, Any, Tuple
-from core.memory import get_memory_manager
+from config import CFG
+from core.catalog import ItemIndex
+from core.inventory import Inventory
+from core.world import ALIASES, SHOP_ITEM_NAMES
+from core.memory import aget_memory_manager, aupdate_memory, get_memory_manager
+from core.retrieval import recall
 # HUOM: poistin tästä rivin:
 # from llm.narration import update_memory_summary
 
@@ -9,6 +14,9 @@ ITEMS_PATH = os.path.join(os.path.dirname(__file__), "..", "items.json")
 with open(ITEMS_PATH, "r", encoding="utf-8") as f:
     ITEMS_DB = json.load(f)
 
+# hakemisto rakennetaan kerran: nimihaut eivät skannaa katalogia
+ITEM_INDEX = ItemIndex(ITEMS_DB, aliases=ALIASES, extra_names=SHOP_ITEM_NAMES)
+
 
 def new_state() -> Dict[str, Any]:
     # create a fresh game state for a new session
@@ -29,12 +37,18 @@ def new_state() -> Dict[str, Any]:
         "game_over": False, # (valinnainen, mutta järkevä)
     }
 
+def append_log(state: Dict[str, Any], player_text: str, gm_text: str) -> None:
+    # ring buffer: only the latest CFG.log_tail_size turns stay in the state,
+    # the full history is recorded separately (core.history) when the state is saved
+    log = state.setdefault("log", [])
+    log.append({"turn": state.get("turn", 0), "player": player_text, "gm": gm_text})
+    if len(log) > CFG.log_tail_size:
+        del log[: len(log) - CFG.log_tail_size]
+
+
 def get_item(name: str) -> Tuple[str, Any]:
     # case-insensitive item lookup; returns (canonical_name, item_def) or (None, None)
-    for key in ITEMS_DB:
-        if key.lower() == name.lower():
-            return key, ITEMS_DB[key]
-    return None, None
+    return ITEM_INDEX.get(name)
 
 
 def apply_health_change(state: Dict[str, Any], amount: int) -> int:
@@ -66,16 +80,21 @@ def apply_item_effect(state: Dict[str, Any], item_name: str) -> str:
 # MEMORY HELPER FUNCTIONS
 
 
-def add_game_turn(player_text: str, gm_text: str, session_id: str):
-    mm = get_memory_manager(session_id)
-    mm.add_turn_text(player_text, gm_text)
+async def add_game_turn(player_text: str, gm_text: str, session_id: str):
+    await aupdate_memory(session_id, lambda mm: mm.add_turn_text(player_text, gm_text))
 
 
-def update_long_summary(session_id: str):
+async def update_long_summary(session_id: str):
     # Tuodaan tämä vasta kun funktio kutsutaan, ei moduulin latausvaiheessa.
     from llm.narration import update_memory_summary
-    mm = get_memory_manager(session_id)
-    mm.update_long_summary(update_memory_summary)
+    from llm.usage import llm_session
+    mm = await aget_memory_manager(session_id)
+    # LLM-kutsun aikana muisti voi muuttua (toinen vuoro / toinen worker),
+    # joten tulos kirjataan tuoreeseen versioon
+    with llm_session(session_id):
+        result = await mm.summarize(update_memory_summary)
+    if result:
+        await aupdate_memory(session_id, lambda m: m.apply_summary(*result))
 
 
 def get_memory_context(session_id: str):
@@ -86,9 +105,16 @@ def get_memory_context(session_id: str):
     }
 
 
-def build_llm_state(state: Dict[str, Any], session_id: str) -> Dict[str, Any]:
+async def build_llm_state(state: Dict[str, Any], session_id: str, player_text: str = "") -> Dict[str, Any]:
     s = dict(state)
-    mm = get_memory_manager(session_id)
+    s["inventory"] = Inventory.of(state).to_list()
+    mm = await aget_memory_manager(session_id)
     s["memory_long_summary"] = mm.get_long_summary()
     s["memory_short_turns"] = mm.get_short_texts()
+    # older turns relevant to this action (short-term memory already covers the latest ones)
+    location = state.get("world", {}).get("location", "")
+    recent_from = state.get("turn", 0) - mm.short_term_limit + 1
+    recalled = await recall(session_id, f"{player_text} {location}".strip(), before_seq=recent_from)
+    if recalled:
+        s["memory_recall"] = recalled
     return s
@@ -0,0 +1,627 @@
+# server/core/store.py
+import asyncio
+import itertools
+import json
+import logging
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import CFG
+
+logger = logging.getLogger(__name__)
+
+
+class VersionConflict(Exception):
+    """Toinen worker ehti tallentaa session ensin (optimistinen lukitus)."""
+
+
+def connect_sqlite(path: str) -> sqlite3.Connection:
+    # WAL: lukijat eivät odota kirjoittajaa; NORMAL: fsync vain checkpointissa
+    db = sqlite3.connect(path, check_same_thread=False, timeout=10.0)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+class SqliteWriter:
+    """
+    Kirjoitukset omassa säikeessään omalla yhteydellään, jotta commit ja
+    fsync eivät pysäytä event looppia. Operaatiot ajetaan jättöjärjestyksessä
+    ja jonossa odottavat kootaan yhdeksi transaktioksi.
+
+    op(db) voi palauttaa callbackin, joka ajetaan commitin jälkeen (esim.
+    lukijoille näkyvän odottavan kirjoituksen poisto).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self._run, name=f"sqlite-writer:{os.path.basename(path)}", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, op: Callable[[sqlite3.Connection], Optional[Callable[[], None]]]) -> None:
+        self._queue.put(op)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Odottaa, että kaikki tähän mennessä jätetyt kirjoitukset on commitoitu."""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        db = connect_sqlite(self.path)
+        running = True
+        while running:
+            ops = [self._queue.get()]
+            while True:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            after: List[Callable[[], None]] = []
+            waiters: List[threading.Event] = []
+            for op in ops:
+                if op is None:
+                    running = False
+                elif isinstance(op, threading.Event):
+                    waiters.append(op)
+                else:
+                    try:
+                        cb = op(db)
+                    except Exception:
+                        logger.exception("sqlite write to %s failed", self.path)
+                        cb = None
+                    if cb is not None:
+                        after.append(cb)
+            try:
+                db.commit()
+            except Exception:
+                logger.exception("sqlite commit to %s failed", self.path)
+            for cb in after:
+                cb()
+            for ev in waiters:
+                ev.set()
+        db.close()
+
+
+class SqliteSpill:
+    """
+    Levylle valuva varasto häädetyille sessioille (yksi SQLite-tiedosto,
+    namespace erottaa pelitilat ja muistit toisistaan).
+
+    Kirjoitukset menevät SqliteWriterille; commitoimattomat pidetään
+    _pendingissä, josta lukijat näkevät ne heti.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = connect_sqlite(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS spill ("
+            " namespace TEXT NOT NULL,"
+            " session_id TEXT NOT NULL,"
+            " data TEXT NOT NULL,"
+            " PRIMARY KEY (namespace, session_id))"
+        )
+        self._db.commit()
+        # (namespace, session_id) -> (kirjoituksen järjestysnumero, data tai None = poisto)
+        self._pending: Dict[Tuple[str, str], Tuple[int, Optional[str]]] = {}
+        # commitoitujen rivien määrä per namespace: luetaan kerran, sen jälkeen
+        # writer päivittää (stats ei aja SELECTiä joka /metrics-hakukerralla)
+        self._counts: Dict[str, int] = dict(
+            self._db.execute("SELECT namespace, COUNT(*) FROM spill GROUP BY namespace").fetchall()
+        )
+        self._seq = itertools.count()
+        self._writer = SqliteWriter(path)
+
+    def put(self, namespace: str, session_id: str, data: str) -> None:
+        self._write((namespace, session_id), data)
+
+    def take(self, namespace: str, session_id: str) -> Optional[str]:
+        """Hakee ja poistaa merkinnän (rehydraatio siirtää sen takaisin muistiin)."""
+        key = (namespace, session_id)
+        with self._lock:
+            data = self._read(key)
+        if data is not None:
+            self._write(key, None)
+        return data
+
+    def delete(self, namespace: str, session_id: str) -> None:
+        self._write((namespace, session_id), None)
+
+    def contains(self, namespace: str, session_id: str) -> bool:
+        with self._lock:
+            return self._read((namespace, session_id)) is not None
+
+    def keys(self, namespace: str) -> List[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT session_id FROM spill WHERE namespace = ?", (namespace,)
+            ).fetchall()
+            keys = {r[0] for r in rows}
+            for (ns, sid), (_, data) in self._pending.items():
+                if ns != namespace:
+                    continue
+                if data is None:
+                    keys.discard(sid)
+                else:
+                    keys.add(sid)
+            return list(keys)
+
+    def count(self, namespace: str) -> int:
+        """Levylle commitoidut merkinnät (O(1); jonossa olevat näkyvät commitin jälkeen)."""
+        with self._lock:
+            return self._counts.get(namespace, 0)
+
+    def close(self, remove: bool = False) -> None:
+        self._writer.close()
+        with self._lock:
+            self._db.close()
+        if remove:
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(self.path + suffix)
+                except OSError:
+                    pass
+
+    # --- sisäiset ---
+
+    def _read(self, key: Tuple[str, str]) -> Optional[str]:
+        # kutsutaan lukon alla; commitoimaton kirjoitus voittaa levyn
+        pending = self._pending.get(key)
+        if pending is not None:
+            return pending[1]
+        row = self._db.execute(
+            "SELECT data FROM spill WHERE namespace = ? AND session_id = ?", key
+        ).fetchone()
+        return row[0] if row else None
+
+    def _write(self, key: Tuple[str, str], data: Optional[str]) -> None:
+        with self._lock:
+            seq = next(self._seq)
+            self._pending[key] = (seq, data)
+
+        def op(db: sqlite3.Connection) -> Callable[[], None]:
+            if data is None:
+                delta = -db.execute("DELETE FROM spill WHERE namespace = ? AND session_id = ?", key).rowcount
+            else:
+                existed = db.execute(
+                    "SELECT 1 FROM spill WHERE namespace = ? AND session_id = ?", key
+                ).fetchone()
+                db.execute(
+                    "INSERT OR REPLACE INTO spill (namespace, session_id, data) VALUES (?, ?, ?)",
+                    (*key, data),
+                )
+                delta = 0 if existed else 1
+            return lambda: self._settle(key, seq, delta)
+
+        self._writer.submit(op)
+
+    def _settle(self, key: Tuple[str, str], seq: int, delta: int = 0) -> None:
+        # commitin jälkeen levy on ajan tasalla, ellei uudempi kirjoitus odota
+        with self._lock:
+            if delta:
+                self._counts[key[0]] = self._counts.get(key[0], 0) + delta
+            pending = self._pending.get(key)
+            if pending is not None and pending[0] == seq:
+                del self._pending[key]
+
+
+_SPILL: Optional[SqliteSpill] = None
+_SPILL_LOCK = threading.Lock()
+
+
+def default_spill() -> SqliteSpill:
+    """Prosessin yhteinen spill-tiedosto (CFG.session_spill_path tai temp-tiedosto)."""
+    global _SPILL
+    with _SPILL_LOCK:
+        if _SPILL is None:
+            path = CFG.session_spill_path or os.path.join(
+                tempfile.gettempdir(), f"aidventure-spill-{os.getpid()}.sqlite3"
+            )
+            _SPILL = SqliteSpill(path)
+        return _SPILL
+
+
+def close_spill() -> None:
+    """Suljetaan spill sammutuksessa; oletuspolun temp-tiedosto poistetaan."""
+    global _SPILL
+    with _SPILL_LOCK:
+        if _SPILL is not None:
+            _SPILL.close(remove=not CFG.session_spill_path)
+            _SPILL = None
+
+
+class SessionStore:
+    """
+    Rajattu sessiokohtainen säilö: korkeintaan max_resident arvoa muistissa,
+    LRU-häätö ja idle-TTL. Häädetyt arvot sarjallistetaan spilliin ja
+    palautetaan läpinäkyvästi seuraavalla get()-kutsulla.
+
+    HUOM: get() palauttaa muistissa olevan olion; sitä muokataan paikallaan
+    kuten ennenkin vanhaa dictiä. Kesken olevan vuoron ajaksi sessio
+    kiinnitetään (pinned), jottei sen oliota häädetä ja muutoksia menetetä.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        max_resident: int = 10000,
+        idle_ttl: float = 1800.0,
+        dump: Callable[[Any], Any] = lambda v: v,
+        load: Callable[[Any], Any] = lambda v: v,
+        spill: Optional[Callable[[], SqliteSpill]] = None,
+    ):
+        self.namespace = namespace
+        self.max_resident = max_resident
+        self.idle_ttl = idle_ttl
+        self._dump = dump
+        self._load = load
+        self._spill = spill or default_spill
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._seen: Dict[str, float] = {}
+        # session_id -> kiinnitysten määrä; kiinnitettyjä ei häädetä
+        self._pins: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._last_sweep = 0.0
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "rehydrated": 0,
+            "evicted_lru": 0,
+            "evicted_idle": 0,
+        }
+
+    def get(self, session_id: str) -> Optional[Any]:
+        with self._lock:
+            self._sweep()
+            value = self._data.get(session_id)
+            if value is not None:
+                self._touch(session_id)
+                self._stats["hits"] += 1
+                return value
+            value = self._rehydrate(session_id)
+            if value is None:
+                self._stats["misses"] += 1
+            return value
+
+    def set(self, session_id: str, value: Any) -> None:
+        with self._lock:
+            self._sweep()
+            self._put(session_id, value)
+
+    # versioitu rajapinta (sama kuin SharedSessionStore:lla). Prosessin sisällä
+    # arvoa muokataan paikallaan, joten versio on aina 0 ja save vain varmistaa
+    # että juuri tämä olio on säilössä.
+
+    def load(self, session_id: str) -> Tuple[Optional[Any], int]:
+        return self.get(session_id), 0
+
+    def save(self, session_id: str, value: Any, version: int) -> int:
+        with self._lock:
+            if self._data.get(session_id) is not value:
+                self._put(session_id, value)
+            else:
+                self._touch(session_id)
+        return version
+
+    def update(self, session_id: str, fn: Callable[[Any], None], default: Callable[[], Any]) -> Any:
+        """Hakee (tai luo) arvon, ajaa fn(value) ja tallentaa."""
+        with self._lock:
+            value = self.get(session_id)
+            if value is None:
+                value = default()
+                self._put(session_id, value)
+            fn(value)
+            return value
+
+    # async-rajapinta event loopille: muistissa olevat arvot käsitellään
+    # suoraan, spillin luku (häädetty sessio) tehdään säiepoolissa; spillin
+    # kirjoitukset hoitaa SqliteWriter
+
+    async def aload(self, session_id: str) -> Tuple[Optional[Any], int]:
+        await self._aresident(session_id)
+        return self.load(session_id)
+
+    async def asave(self, session_id: str, value: Any, version: int) -> int:
+        return self.save(session_id, value, version)
+
+    async def aupdate(self, session_id: str, fn: Callable[[Any], None], default: Callable[[], Any]) -> Any:
+        await self._aresident(session_id)
+        return self.update(session_id, fn, default)
+
+    @contextmanager
+    def pinned(self, session_id: str) -> Iterator[None]:
+        """Pitää session muistissa lohkon ajan (esim. vuoro odottaa LLM:ää)."""
+        with self._lock:
+            self._pins[session_id] = self._pins.get(session_id, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                n = self._pins.pop(session_id) - 1
+                if n:
+                    self._pins[session_id] = n
+                else:
+                    self._shrink()
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._data.pop(session_id, None)
+            self._seen.pop(session_id, None)
+            self._spill().delete(self.namespace, session_id)
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._data or self._spill().contains(self.namespace, session_id)
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._data.keys()) + self._spill().keys(self.namespace)
+
+    def resident_count(self) -> int:
+        return len(self._data)
+
+    def close(self) -> None:
+        # muistissa olevat arvot katoavat prosessin mukana; spill suljetaan erikseen
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "resident": len(self._data),
+                "spilled": self._spill().count(self.namespace),
+                "max_resident": self.max_resident,
+                "idle_ttl": self.idle_ttl,
+                "pinned": len(self._pins),
+                **self._stats,
+            }
+
+    # --- sisäiset ---
+
+    async def _aresident(self, session_id: str) -> None:
+        """Tuo häädetyn arvon spillistä muistiin säiepoolissa (ei SQLite-lukua loopissa)."""
+        with self._lock:
+            if session_id in self._data:
+                return
+
+        def rehydrate() -> None:
+            with self._lock:
+                if session_id not in self._data:
+                    self._rehydrate(session_id)
+
+        await asyncio.to_thread(rehydrate)
+
+    def _rehydrate(self, session_id: str) -> Optional[Any]:
+        # kutsutaan lukon alla
+        raw = self._spill().take(self.namespace, session_id)
+        if raw is None:
+            return None
+        value = self._load(json.loads(raw))
+        self._stats["rehydrated"] += 1
+        self._put(session_id, value)
+        return value
+
+    def _touch(self, session_id: str) -> None:
+        self._data.move_to_end(session_id)
+        self._seen[session_id] = time.monotonic()
+
+    def _put(self, session_id: str, value: Any) -> None:
+        self._data[session_id] = value
+        self._touch(session_id)
+        self._shrink()
+
+    def _shrink(self) -> None:
+        while len(self._data) > max(1, self.max_resident):
+            # vanhin kiinnittämätön; jos kaikki ovat kesken, raja joustaa hetken
+            sid = next((k for k in self._data if k not in self._pins), None)
+            if sid is None:
+                break
+            self._evict(sid)
+            self._stats["evicted_lru"] += 1
+
+    def _evict(self, session_id: str) -> None:
+        value = self._data.pop(session_id)
+        self._seen.pop(session_id, None)
+        self._spill().put(self.namespace, session_id, json.dumps(self._dump(value), ensure_ascii=False))
+
+    def _sweep(self) -> None:
+        # korkeintaan kerran sekunnissa; LRU-järjestyksen ansiosta vanhimmat ovat alussa
+        now = time.monotonic()
+        if self.idle_ttl <= 0 or now - self._last_sweep < 1.0:
+            return
+        self._last_sweep = now
+        expired = []
+        for sid in self._data:
+            if now - self._seen.get(sid, now) <= self.idle_ttl:
+                break
+            if sid not in self._pins:
+                expired.append(sid)
+        for sid in expired:
+            self._evict(sid)
+            self._stats["evicted_idle"] += 1
+
+
+class SharedSessionStore:
+    """
+    Usean prosessin yhteinen säilö samalla koneella: SQLite WAL-tilassa,
+    jokaisella sessiolla versionumero. save() onnistuu vain jos versio on
+    sama kuin ladattaessa, muuten VersionConflict – näin rinnakkaiset
+    workerit eivät ylikirjoita toistensa muutoksia.
+
+    Arvoja ei cacheteta prosessiin: jokainen load() lukee tuoreen tilan.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        path: str,
+        dump: Callable[[Any], Any] = lambda v: v,
+        load: Callable[[Any], Any] = lambda v: v,
+    ):
+        self.namespace = namespace
+        self.path = path
+        self._dump = dump
+        self._load = load
+        self._lock = threading.Lock()
+        self._db = connect_sqlite(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " namespace TEXT NOT NULL,"
+            " session_id TEXT NOT NULL,"
+            " version INTEGER NOT NULL,"
+            " data TEXT NOT NULL,"
+            " updated REAL NOT NULL,"
+            " PRIMARY KEY (namespace, session_id))"
+        )
+        self._db.commit()
+        self._stats = {"loads": 0, "saves": 0, "conflicts": 0}
+
+    def load(self, session_id: str) -> Tuple[Optional[Any], int]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data, version FROM sessions WHERE namespace = ? AND session_id = ?",
+                (self.namespace, session_id),
+            ).fetchone()
+            self._stats["loads"] += 1
+        if row is None:
+            return None, 0
+        return self._load(json.loads(row[0])), row[1]
+
+    def save(self, session_id: str, value: Any, version: int) -> int:
+        """Tallentaa jos versio täsmää; palauttaa uuden version tai nostaa VersionConflictin."""
+        data = json.dumps(self._dump(value), ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            if version == 0:
+                cur = self._db.execute(
+                    "INSERT OR IGNORE INTO sessions (namespace, session_id, version, data, updated)"
+                    " VALUES (?, ?, 1, ?, ?)",
+                    (self.namespace, session_id, data, now),
+                )
+            else:
+                cur = self._db.execute(
+                    "UPDATE sessions SET version = version + 1, data = ?, updated = ?"
+                    " WHERE namespace = ? AND session_id = ? AND version = ?",
+                    (data, now, self.namespace, session_id, version),
+                )
+            self._db.commit()
+            if cur.rowcount != 1:
+                self._stats["conflicts"] += 1
+                raise VersionConflict(f"{self.namespace}:{session_id} changed since version {version}")
+            self._stats["saves"] += 1
+        return version + 1
+
+    def get(self, session_id: str) -> Optional[Any]:
+        return self.load(session_id)[0]
+
+    # async-rajapinta event loopille: SQLite-lukitus ja commit säiepoolissa
+
+    async def aload(self, session_id: str) -> Tuple[Optional[Any], int]:
+        return await asyncio.to_thread(self.load, session_id)
+
+    async def asave(self, session_id: str, value: Any, version: int) -> int:
+        return await asyncio.to_thread(self.save, session_id, value, version)
+
+    async def aupdate(self, session_id: str, fn: Callable[[Any], None], default: Callable[[], Any]) -> Any:
+        return await asyncio.to_thread(self.update, session_id, fn, default)
+
+    def set(self, session_id: str, value: Any) -> None:
+        # ehdoton kirjoitus (esim. uusi sessio)
+        data = json.dumps(self._dump(value), ensure_ascii=False)
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO sessions (namespace, session_id, version, data, updated) VALUES (?, ?, 1, ?, ?)"
+                " ON CONFLICT (namespace, session_id) DO UPDATE SET"
+                " version = version + 1, data = excluded.data, updated = excluded.updated",
+                (self.namespace, session_id, data, time.time()),
+            )
+            self._db.commit()
+
+    def update(self, session_id: str, fn: Callable[[Any], None], default: Callable[[], Any],
+               retries: int = 5) -> Any:
+        """Read-modify-write: ladataan, ajetaan fn ja tallennetaan; konfliktissa yritetään uudelleen."""
+        for _ in range(retries):
+            value, version = self.load(session_id)
+            if value is None:
+                value = default()
+            fn(value)
+            try:
+                self.save(session_id, value, version)
+                return value
+            except VersionConflict:
+                continue
+        raise VersionConflict(f"{self.namespace}:{session_id} kept changing during update")
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM sessions WHERE namespace = ? AND session_id = ?",
+                (self.namespace, session_id),
+            )
+            self._db.commit()
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.load(session_id)[0] is not None
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT session_id FROM sessions WHERE namespace = ?", (self.namespace,)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def resident_count(self) -> int:
+        # jaetussa tilassa prosessi ei pidä sessioita muistissa
+        return 0
+
+    @contextmanager
+    def pinned(self, session_id: str) -> Iterator[None]:
+        # ei häätöä: jokainen load() lukee tuoreen tilan
+        yield
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count = self._db.execute(
+                "SELECT COUNT(*) FROM sessions WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "sessions": count, **self._stats}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def make_store(
+    namespace: str,
+    dump: Callable[[Any], Any] = lambda v: v,
+    load: Callable[[Any], Any] = lambda v: v,
+):
+    """
+    Valitsee säilön CFG.session_backendin mukaan:
+      "memory" (oletus) – prosessin oma SessionStore, ei konfiguraatiota
+      "sqlite"          – SharedSessionStore tiedostossa CFG.session_db_path
+    """
+    if CFG.session_backend == "sqlite":
+        return SharedSessionStore(namespace, CFG.session_db_path, dump=dump, load=load)
+    return SessionStore(
+        namespace,
+        max_resident=CFG.session_max_resident,
+        idle_ttl=CFG.session_idle_ttl,
+        dump=dump,
+        load=load,
+    )
@@ -0,0 +1,150 @@
+# server/core/summarizer.py
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SummaryScheduler:
+    """
+    Pitkän muistin tiivistyksen ajastus.
+
+    - Tiivistys käynnistyy vasta, kun session odottavaa tekstiä on vähintään
+      min_turns vuoroa tai min_chars merkkiä, tai kun sessio on ollut hiljaa
+      idle_seconds (uusi vuoro siirtää ajastinta eteenpäin).
+    - Sessiolla on korkeintaan yksi tiivistys jonossa tai käynnissä; sen aikana
+      tulleet tekstit jäävät odottamaan ja menevät seuraavaan ajoon yhdessä.
+    - Ajot kulkevat yhteisen, rajatun jonon kautta `workers` kappaleella
+      taustatyöntekijöitä. Täysi jono ei estä vuoroa: sessio yrittää uudelleen
+      idle-ajastimella.
+    """
+
+    def __init__(
+        self,
+        run: Callable[[str], Awaitable[None]],
+        pending: Callable[[str], Awaitable[Tuple[int, int]]],
+        min_turns: int = 4,
+        min_chars: int = 1500,
+        idle_seconds: float = 30.0,
+        workers: int = 2,
+        queue_size: int = 1000,
+    ):
+        self._run = run
+        self._pending = pending
+        self.min_turns = min_turns
+        self.min_chars = min_chars
+        self.idle_seconds = idle_seconds
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._queued: Set[str] = set()
+        self._running: Set[str] = set()
+        self._again: Set[str] = set()
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        # idle-ajastimista käynnistetyt tarkistukset (pending voi lukea jaettua säilöä)
+        self._checks: Set[asyncio.Task] = set()
+        self._stats = {"runs": 0, "failed": 0, "coalesced": 0, "dropped": 0, "idle_triggers": 0}
+
+    async def notify(self, session_id: str) -> None:
+        """Kutsutaan kun sessioon kirjattiin uusi vuoro."""
+        turns, chars = await self._pending(session_id)
+        if turns == 0:
+            return
+        if turns >= self.min_turns or chars >= self.min_chars:
+            self._cancel_timer(session_id)
+            self._enqueue(session_id)
+        else:
+            self._arm_timer(session_id)
+
+    def _enqueue(self, session_id: str) -> None:
+        if session_id in self._running:
+            # käynnissä olevan ajon jälkeen katsotaan uudelleen
+            self._again.add(session_id)
+            self._stats["coalesced"] += 1
+            return
+        if session_id in self._queued:
+            self._stats["coalesced"] += 1
+            return
+        self._start_workers()
+        try:
+            self._queue.put_nowait(session_id)
+        except asyncio.QueueFull:
+            self._stats["dropped"] += 1
+            self._arm_timer(session_id)
+            return
+        self._queued.add(session_id)
+
+    def _arm_timer(self, session_id: str) -> None:
+        self._cancel_timer(session_id)
+        loop = asyncio.get_running_loop()
+        self._timers[session_id] = loop.call_later(self.idle_seconds, self._on_idle, session_id)
+
+    def _cancel_timer(self, session_id: str) -> None:
+        handle = self._timers.pop(session_id, None)
+        if handle is not None:
+            handle.cancel()
+
+    def _on_idle(self, session_id: str) -> None:
+        self._timers.pop(session_id, None)
+        task = asyncio.ensure_future(self._idle_check(session_id))
+        self._checks.add(task)
+        task.add_done_callback(self._checks.discard)
+
+    async def _idle_check(self, session_id: str) -> None:
+        if (await self._pending(session_id))[0] > 0:
+            self._stats["idle_triggers"] += 1
+            self._enqueue(session_id)
+
+    def _start_workers(self) -> None:
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _worker(self) -> None:
+        while True:
+            session_id = await self._queue.get()
+            self._queued.discard(session_id)
+            self._running.add(session_id)
+            try:
+                await self._run(session_id)
+                self._stats["runs"] += 1
+            except Exception:
+                self._stats["failed"] += 1
+                logger.exception("memory summary failed for session %s", session_id)
+            finally:
+                self._running.discard(session_id)
+                self._queue.task_done()
+            if session_id in self._again:
+                self._again.discard(session_id)
+                await self.notify(session_id)
+
+    async def close(self) -> None:
+        for handle in self._timers.values():
+            handle.cancel()
+        self._timers.clear()
+        for task in [*self._tasks, *self._checks]:
+            task.cancel()
+        if self._checks:
+            await asyncio.gather(*self._checks, return_exceptions=True)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._queued.clear()
+        self._running.clear()
+        self._again.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "queued": len(self._queued),
+            "running": len(self._running),
+            "idle_timers": len(self._timers),
+            "min_turns": self.min_turns,
+            "min_chars": self.min_chars,
+            "idle_seconds": self.idle_seconds,
+        }
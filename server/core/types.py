@@ -31,9 +31,16 @@ class GMResult(BaseModel):
 class TurnIn(BaseModel):
     session_id: str
     text: str
+    # valinnainen: sama avain uudelleenyrityksessä -> sama vastaus, ei uusia LLM-kutsuja
+    idempotency_key: Optional[str] = None
+    # valinnainen: clientin tuntema tilan versio -> vastaus patchina tätä versiota vasten
+    base_version: Optional[int] = None
 
 class TurnOut(BaseModel):
     narration: str
     choices: List[str]
     end_game: bool
-    state: Dict[str, Any]
+    # koko tila, tai None kun vastaus on patch clientin base_versionia vasten
+    state: Optional[Dict[str, Any]] = None
+    version: int = 0
+    patch: Optional[List[Dict[str, Any]]] = None
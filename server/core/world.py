@@ -0,0 +1,99 @@
+# server/core/world.py
+# Maailman staattiset määrittelyt: tunnetut paikat ja kauppojen valikoimat.
+# Sekä serverin sääntölogiikka (maybe_move, try_shop_purchase) että
+# intentin fast-path käyttävät näitä, jotta ne pysyvät synkassa.
+
+# (avainsanat, location, narration) – järjestys merkitsee: ensimmäinen osuma voittaa
+MOVE_TARGETS = [
+    (("blacksmith", "smith"), "Blacksmith", "You head to the blacksmith's forge."),
+    (("market",), "Market", "You head to the small village market."),
+    (("tavern",), "Tavern", "You return to the tavern."),
+    (("cave", "north"), "Cave", "You make your way toward the goblin cave."),
+    (("village",), "Village", "You are back in the village square."),
+]
+
+# Kaupat deklaratiivisesti: core/shop.py kääntää nämä kerran käynnistyksessä
+# paikkakohtaisiksi hakemistoiksi (valikoima, valmiit tarjoustekstit ja napit).
+#
+#   locations:   paikat, joissa kauppa palvelee
+#   catalog:     nimi -> {"price": kolikot, "stock": kpl per sessio (puuttuu = rajaton)}
+#   buttons:     "Buy X" -napit kaupan jälkeen (vain items.json:sta löytyvät)
+#   offer_text:  hintakyselyn vastaus, {offers} = "X for N coins, ..."
+#   empty_text:  jos valikoimassa ei ole yhtään tunnettua itemiä
+#   haggle_text: tinkimisyritys
+#   food_text:   ruokaa kysyttäessä (None = ei erikoiskäsittelyä)
+#   supplies:    myydäänkö "supplies/rations/food" -pyynnöllä halvimmat kaksi
+SHOPS = {
+    "market": {
+        "locations": ["Market", "Village"],
+        "catalog": {
+            "Loaf of Bread": {"price": 2},
+            "Torch": {"price": 1},
+            "Rope": {"price": 2},
+            "Bandage": {"price": 2},
+            "Healing Herbs": {"price": 3},
+        },
+        "buttons": ["Torch", "Rope", "Loaf of Bread"],
+        "offer_text": "Stalls around you offer {offers}.",
+        "empty_text": "The market is quiet and offers little right now.",
+        "haggle_text": (
+            "The vendor shakes their head. 'Business is hard enough as it is. "
+            "No special discounts today.'"
+        ),
+        "food_text": None,
+        "supplies": True,
+    },
+    "blacksmith": {
+        "locations": ["Blacksmith"],
+        "catalog": {
+            "Iron Sword": {"price": 10},
+            "Shield": {"price": 8},
+            "Dagger": {"price": 4},
+        },
+        "buttons": ["Dagger", "Iron Sword", "Shield"],
+        "offer_text": "The blacksmith shows you his wares: {offers}.",
+        "empty_text": "The blacksmith shrugs; his racks are bare today.",
+        "haggle_text": (
+            "The blacksmith chuckles. 'A generous offer, but steel doesn't come cheap. "
+            "No discounts today, I'm afraid.'"
+        ),
+        "food_text": (
+            "The blacksmith wipes his hands and grunts: 'I sell steel, not stew. "
+            "For food, try the market in the village square.'"
+        ),
+        "supplies": False,
+    },
+}
+
+# kaikkien kauppojen myyntinimet (fast-path ja item-hakemisto)
+SHOP_ITEM_NAMES = [name for shop in SHOPS.values() for name in shop["catalog"]]
+
+# kauppasanat: hintakysely (ei BUY), tinkiminen ja "supplies"-ostot
+SHOP_HINT_WORDS = [
+    "price", "cost", "buy", "sell", "weapon", "sword", "axe", "shield",
+    "dagger", "torch", "rope", "bread", "food", "rations",
+]
+SHOP_HAGGLE_WORDS = ["discount", "cheaper", "haggle", "bargain"]
+SHOP_SUPPLY_WORDS = ["supplies", "rations", "food"]
+
+# item-nimien aliakset (pienaakkosin) -> items.json-avain; järjestys merkitsee tekstihaussa
+ALIASES = {
+    # raha
+    "gold coins": "Gold Coin",
+    "gold coin": "Gold Coin",
+    "coins": "Gold Coin",
+    "coin": "Gold Coin",
+
+    # kirjoitusvirheitä / paikkoja
+    "supplies": "supplies",
+    "blacsmith": "blacksmith",
+    "black smith": "blacksmith",
+
+    # ruoka
+    "bread": "Loaf of Bread",
+    "loaf": "Loaf of Bread",
+
+    # aseiden yleisnimityksiä
+    "better sword": "Iron Sword",
+    "sword": "Iron Sword",
+}
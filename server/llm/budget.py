@@ -0,0 +1,167 @@
+# server/llm/budget.py
+import logging
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+from core.state import new_state
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Paikallinen arvio tokenien määrästä ilman tokenizer-riippuvuutta:
+    välimerkit ovat omia tokeneitaan ja pitkät sanat pilkotaan ~4 merkin
+    paloihin (BPE-tokenisaattorit käyttäytyvät englannille suunnilleen näin).
+    """
+    n = 0
+    for m in _TOKEN_RE.finditer(text or ""):
+        w = m.group(0)
+        n += 1 if len(w) <= 4 else (len(w) + 3) // 4
+    return n
+
+
+# ----------------- tiivistysaskeleet -----------------
+#
+# Jokainen askel palauttaa uuden, pienemmän state-dictin tai None, jos
+# sillä ei ole enää mitään poistettavaa. Askeleet ajetaan järjestyksessä
+# (vähiten arvokkaat ensin) ja kutakin toistetaan niin kauan kuin budjetti
+# ylittyy. Alkuperäistä dictiä ei koskaan muokata.
+
+_DEFAULTS = new_state()
+
+
+def _filter_items_db(s: Dict[str, Any], hint: str) -> Optional[Dict[str, Any]]:
+    items = s.get("items_db")
+    if not items or s.get("_items_filtered"):
+        return None
+    # pidetään vain itemit, jotka mainitaan pelaajan tekstissä tai inventaariossa
+    relevant = [name for name in items if name.lower() in hint]
+    out = dict(s, items_db=relevant)
+    out["_items_filtered"] = True
+    return out
+
+
+def _drop_items_db(s: Dict[str, Any], hint: str) -> Optional[Dict[str, Any]]:
+    if "items_db" not in s:
+        return None
+    return {k: v for k, v in s.items() if k != "items_db"}
+
+
+def _drop_oldest_log(s: Dict[str, Any], hint: str) -> Optional[Dict[str, Any]]:
+    log = s.get("log_tail")
+    if not log:
+        return None
+    return dict(s, log_tail=log[1:])
+
+
+def _drop_last_recall(s: Dict[str, Any], hint: str) -> Optional[Dict[str, Any]]:
+    # haetut muistot ovat relevanssijärjestyksessä: heikoin osuma pois ensin
+    recalled = s.get("memory_recall")
+    if not recalled:
+        return None
+    return dict(s, memory_recall=recalled[:-1])
+
+
+def _drop_defaults(s: Dict[str, Any], hint: str) -> Optional[Dict[str, Any]]:
+    # kentät, jotka ovat yhä aloitusarvoissaan, eivät kerro mallille mitään uutta
+    changed = False
+    out = dict(s)
+    for section, keep in (("player", ("hp", "max_hp")), ("world", ("location",)), ("quest", ("id", "status"))):
+        cur = s.get(section)
+        if not isinstance(cur, dict):
+            continue
+        default = _DEFAULTS.get(section, {})
+        slim = {
+            k: v for k, v in cur.items()
+            if k in keep or (k != "title" and default.get(k) != v)
+        }
+        if slim != cur:
+            out[section] = slim
+            changed = True
+    return out if changed else None
+
+
+def _drop_oldest_short_memory(s: Dict[str, Any], hint: str) -> Optional[Dict[str, Any]]:
+    turns = s.get("memory_short_turns")
+    if not turns:
+        return None
+    return dict(s, memory_short_turns=turns[1:])
+
+
+def _shorten_long_summary(s: Dict[str, Any], hint: str) -> Optional[Dict[str, Any]]:
+    summary = s.get("memory_long_summary") or ""
+    if len(summary) <= 200:
+        return None
+    return dict(s, memory_long_summary=summary[: len(summary) // 2].rstrip() + "…")
+
+
+_STEPS: List[Callable[[Dict[str, Any], str], Optional[Dict[str, Any]]]] = [
+    _filter_items_db,
+    _drop_items_db,
+    _drop_oldest_log,
+    _drop_last_recall,
+    _drop_defaults,
+    _drop_oldest_short_memory,
+    _shorten_long_summary,
+]
+
+_STATS: Dict[str, Dict[str, int]] = {}
+
+
+def compact_state(
+    kind: str,
+    state: Dict[str, Any],
+    render: Callable[[Dict[str, Any]], str],
+    budget: int,
+    hint: str = "",
+) -> Dict[str, Any]:
+    """
+    Tiivistää LLM:lle lähetettävää statea, kunnes render(state):n
+    token-arvio mahtuu budjettiin (budget <= 0 -> ei tiivistystä).
+
+    kind:   kutsun tyyppi lokia/tilastoja varten ("intent", "narration", ...)
+    render: muodostaa koko user-promptin statesta
+    hint:   vapaa teksti, jonka perusteella items_db:stä valitaan relevantit
+    """
+    hint = (hint or "").lower()
+    for it in state.get("inventory") or []:
+        hint += " " + str(it.get("name", "")).lower()
+    for name in state.get("inventory_items") or []:
+        hint += " " + str(name).lower()
+
+    before = estimate_tokens(render(state))
+    size = before
+    s = state
+    if budget > 0:
+        for step in _STEPS:
+            while size > budget:
+                nxt = step(s, hint)
+                if nxt is None:
+                    break
+                s = nxt
+                size = estimate_tokens(render(_public(s)))
+            if size <= budget:
+                break
+    s = _public(s)
+
+    st = _STATS.setdefault(kind, {"calls": 0, "compacted": 0, "tokens_before": 0, "tokens_after": 0})
+    st["calls"] += 1
+    st["compacted"] += int(s is not state)
+    st["tokens_before"] += before
+    st["tokens_after"] += size
+    logger.info("prompt %s: %d -> %d tokens (budget %d)", kind, before, size, budget)
+    return s
+
+
+def _public(s: Dict[str, Any]) -> Dict[str, Any]:
+    # sisäiset merkinnät (alkavat '_') eivät mene promptiin
+    if any(k.startswith("_") for k in s):
+        return {k: v for k, v in s.items() if not k.startswith("_")}
+    return s
+
+
+def prompt_stats() -> Dict[str, Dict[str, int]]:
+    return {k: dict(v) for k, v in _STATS.items()}
@@ -1,11 +1,21 @@
 # server/llm/intent.py
+import hashlib
 import json
-from typing import Dict, Any
+import re
+import time
+from typing import Dict, Any, Optional, Tuple
 
+from pydantic import ValidationError
+
+from core.cache import TTLCache
+from core.inventory import Inventory
+from core.metrics import Histogram
 from core.types import Intent
 from core.state import ITEMS_DB
-from llm.provider import get_provider
+from core.world import MOVE_TARGETS, SHOP_ITEM_NAMES
+from llm.provider import get_provider, LLM_JSON_ERRORS
 from llm.prompts import INTENT_SYSTEM, intent_user
+from llm.budget import compact_state
 from config import CFG
 
 _ALLOWED_ACTIONS = {
@@ -29,7 +39,7 @@ _ACTION_SYNONYMS = {
     "TRADE": "BUY",
 }
 
-def _normalize_intent_dict(raw: Dict[str, Any]) -> Dict[str, Any]:
+def normalize_intent_dict(raw: Dict[str, Any]) -> Dict[str, Any]:
     if not isinstance(raw, dict):
         raw = {}
 
@@ -73,18 +83,213 @@ def _normalize_intent_dict(raw: Dict[str, Any]) -> Dict[str, Any]:
         "free_text": free_text,
     }
 
-def parse_intent(state, player_text: str) -> Intent:
-    prov = get_provider(CFG.intent_provider)
+# ----------------- sääntöpohjainen fast-path -----------------
+#
+# Nappien tekstit ("Go to cave", "Buy Dagger", "LOOK around") ja yksinkertaiset
+# verbit tunnistetaan ilman LLM-kutsua. Jos tulkinta ei ole varma, palautetaan
+# None ja parse_intent kysyy mallilta kuten ennenkin.
+
+_WS = re.compile(r"\s+")
+_MOVE_RE = re.compile(
+    r"^(?:(?:go|walk|head|travel|move|return|run)(?:\s+back)?(?:\s+(?:to|towards?|into))?"
+    r"|enter|visit)\s+(?:the\s+)?(.+)$"
+)
+_BUY_RE = re.compile(r"^(?:buy|purchase)\s+(?:(a|an|the|some|one|\d+)\s+)?(.+)$")
+_TALK_RE = re.compile(r"^(?:talk|speak|chat)\s+(?:to|with)\s+(?:the\s+)?(.+)$")
+
+# sanat, jotka saavat esiintyä paikan nimen ympärillä ('the goblin cave')
+_PLACE_FILLERS = {"goblin", "village", "square", "forge", "small", "old"}
+# verbin perään sallitut täytesanat ('look around', 'attack again')
+_VERB_FILLERS = {"", "around", "again", "here", "the area", "around here"}
+# yksittäiset verbit, joiden tulkinta on yksiselitteinen
+_SIMPLE_ACTIONS = {"LOOK", "TALK", "ATTACK", "RUN", "WAIT"}
+_SUPPLY_WORDS = {"supplies", "rations", "food"}
+_INVENTORY_PHRASES = {"inventory", "check inventory", "check my inventory", "check the inventory"}
+
+_SHOP_ITEMS = {name.lower(): name for name in SHOP_ITEM_NAMES}
+
+_FAST_STATS = {"hits": 0, "misses": 0}
+
+
+def normalize_text(text: str) -> str:
+    return _WS.sub(" ", (text or "").strip().lower()).strip(" .!?")
+
+
+def _match_location(rest: str) -> Optional[str]:
+    words = rest.split(" ")
+    hits = set()
+    for keywords, location, _ in MOVE_TARGETS:
+        if any(k in words for k in keywords):
+            hits.add(location)
+    # kaikkien sanojen pitää olla tunnettuja: 'cave entrance' -> LLM
+    known = set(_PLACE_FILLERS)
+    for keywords, _, _ in MOVE_TARGETS:
+        known.update(keywords)
+    if any(w not in known for w in words):
+        return None
+    if len(hits) == 1:
+        return hits.pop()
+    # 'village market' -> kauppa voittaa, muuten epäselvä
+    hits.discard("Village")
+    return hits.pop() if len(hits) == 1 else None
+
+
+def _shop_item(rest: str) -> Optional[str]:
+    name = _SHOP_ITEMS.get(rest)
+    if name is None and rest.endswith("s"):
+        name = _SHOP_ITEMS.get(rest[:-1])
+    return name
+
+
+def fast_parse_intent(player_text: str) -> Optional[Intent]:
+    """
+    Palauttaa Intentin ilman LLM:ää, jos teksti on varmasti tunnistettavissa.
+    Muuten None.
+    """
+    text = normalize_text(player_text)
+    if not text:
+        return None
+    raw = player_text.strip()
+
+    if text in _INVENTORY_PHRASES:
+        return Intent(action="LOOK", target="inventory", quantity=1, free_text=raw)
+
+    m = _BUY_RE.match(text)
+    if m:
+        qty_word, rest = m.group(1), m.group(2)
+        qty = int(qty_word) if qty_word and qty_word.isdigit() else 1
+        if rest in _SUPPLY_WORDS:
+            return Intent(action="BUY", quantity=max(1, qty), free_text=raw)
+        item = _shop_item(rest)
+        if item:
+            return Intent(action="BUY", item=item, quantity=max(1, qty), free_text=raw)
+        return None
+
+    m = _MOVE_RE.match(text)
+    if m:
+        location = _match_location(m.group(1))
+        if location:
+            return Intent(action="MOVE", target=location, quantity=1, free_text=raw)
+        return None
+
+    m = _TALK_RE.match(text)
+    if m:
+        return Intent(action="TALK", target=m.group(1), quantity=1, free_text=raw)
+
+    verb, _, rest = text.partition(" ")
+    act = verb.upper()
+    act = _ACTION_SYNONYMS.get(act, act)
+    if act in _SIMPLE_ACTIONS and rest in _VERB_FILLERS:
+        return Intent(action=act, quantity=1, free_text=raw)
+
+    return None
+
+
+def fast_path_stats() -> Dict[str, Any]:
+    total = _FAST_STATS["hits"] + _FAST_STATS["misses"]
+    return {
+        **_FAST_STATS,
+        "hit_rate": round(_FAST_STATS["hits"] / total, 3) if total else 0.0,
+    }
+
+
+# ----------------- sessioiden yhteinen intent-cache -----------------
+#
+# Sama komento samasta tilanteesta (sama paikka, quest ja inventaarion
+# itemit) tuottaa käytännössä saman intentin, joten LLM:n vastaus jaetaan
+# kaikkien sessioiden kesken. Avain = normalisoitu teksti + sormenjälki
+# niistä state-kentistä, jotka intent-malli oikeasti näkee.
+
+_INTENT_CACHE = TTLCache(max_size=CFG.intent_cache_size, ttl=CFG.intent_cache_ttl)
+
+
+def _cache_enabled(temperature: float) -> bool:
+    # korkealla lämpötilalla vastaukset vaihtelevat -> ei cacheteta;
+    # kutsuja antaa sen temperaturen, jolla malli oikeasti kutsutaan
+    return CFG.intent_cache_size > 0 and temperature <= CFG.intent_cache_max_temperature
+
+
+def _state_fingerprint(state_for_llm: Dict[str, Any]) -> str:
+    # items_db on staattinen koko prosessin ajan, joten se jätetään pois
+    fields = {k: v for k, v in state_for_llm.items() if k != "items_db"}
+    blob = json.dumps(fields, ensure_ascii=False, sort_keys=True)
+    return hashlib.blake2b(blob.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def intent_cache_stats() -> Dict[str, Any]:
+    return _INTENT_CACHE.stats()
+
+
+PARSE_INTENT_SECONDS = Histogram(
+    "aidventure_parse_intent_seconds", "parse_intent latency by source", ("source",)
+)
+
+
+async def parse_intent(
+    state, player_text: str, priority: str = "intent", temperature: Optional[float] = None
+) -> Intent:
+    """
+    priority: LLM-jonon luokka (llm.provider.PRIORITIES); spekulointi käyttää "speculative".
+    Token-kirjanpidossa kutsu on aina tyyppiä "intent" prioriteetista riippumatta.
+    temperature: mallikutsun temperature (oletus CFG.intent_temperature); myös
+    cachetus päätetään sen perusteella.
+    """
+    if temperature is None:
+        temperature = CFG.intent_temperature
+    t0 = time.perf_counter()
+    source = "error"
+    try:
+        intent, source = await _parse_intent(state, player_text, priority, temperature)
+        return intent
+    finally:
+        PARSE_INTENT_SECONDS.observe(time.perf_counter() - t0, source)
+
+
+async def _parse_intent(state, player_text: str, priority: str, temperature: float) -> Tuple[Intent, str]:
+    if CFG.intent_fast_path:
+        fast = fast_parse_intent(player_text)
+        if fast is not None:
+            _FAST_STATS["hits"] += 1
+            return fast, "fast_path"
+        _FAST_STATS["misses"] += 1
 
     # erittäin tiivis state intent-mallille
     state_for_llm = {
         "location": state.get("world", {}).get("location"),
         "quest": state.get("quest"),
-        "inventory_items": [it["name"] for it in state.get("inventory", [])],
+        "inventory_items": Inventory.of(state).names(),
         "items_db": list(ITEMS_DB.keys()),
     }
 
-    user = intent_user(player_text, json.dumps(state_for_llm, ensure_ascii=False))
-    raw = prov.chat_json(CFG.intent_model, INTENT_SYSTEM, user, temperature=0.1)
-    data = _normalize_intent_dict(raw)
-    return Intent.model_validate(data)
+    cache_key = None
+    if _cache_enabled(temperature):
+        cache_key = (
+            CFG.intent_provider,
+            CFG.intent_model,
+            normalize_text(player_text),
+            _state_fingerprint(state_for_llm),
+        )
+        cached = _INTENT_CACHE.get(cache_key)
+        if cached is not None:
+            return cached.model_copy(), "cache"
+
+    prov = get_provider(CFG.intent_provider, CFG.intent_model)
+    def render(s: Dict[str, Any]) -> str:
+        return intent_user(player_text, json.dumps(s, ensure_ascii=False))
+
+    compact = compact_state("intent", state_for_llm, render, CFG.intent_token_budget, hint=player_text)
+    user = render(compact)
+    raw = await prov.achat_json(
+        CFG.intent_model, INTENT_SYSTEM, user,
+        temperature=temperature, priority=priority, call="intent",
+    )
+    data = normalize_intent_dict(raw)
+    try:
+        intent = Intent.model_validate(data)
+    except ValidationError:
+        LLM_JSON_ERRORS.inc("intent", "schema")
+        raise
+
+    if cache_key is not None:
+        _INTENT_CACHE.set(cache_key, intent.model_copy())
+    return intent, "llm"
@@ -0,0 +1,217 @@
+# server/llm/mock.py
+# Verkoton provider kuormitustesteihin ja profilointiin (INTENT_PROVIDER=mock /
+# NARRATION_PROVIDER=mock). Vastaukset ovat skeeman mukaisia ja deterministisiä:
+# sama prompti -> sama JSON. Latenssi ja virheet ovat konfiguroitavia (MOCK_*).
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Dict, List
+
+from config import CFG
+from core.world import MOVE_TARGETS
+from llm.prompts import FUSED_SYSTEM, INTENT_SYSTEM, MEMORY_UPDATE_SYSTEM
+from llm.provider import LLMProvider
+from llm.usage import report_usage
+
+_VERBS = [
+    (("go", "walk", "head", "move", "travel", "return", "enter"), "MOVE"),
+    (("buy", "purchase"), "BUY"),
+    (("look", "examine", "inspect", "search"), "LOOK"),
+    (("talk", "ask", "speak", "say"), "TALK"),
+    (("attack", "fight", "hit", "kill", "strike"), "ATTACK"),
+    (("take", "grab", "pick"), "TAKE_ITEM"),
+    (("drop",), "DROP_ITEM"),
+    (("give",), "GIVE_ITEM"),
+    (("use", "drink", "eat"), "USE_ITEM"),
+    (("run", "flee"), "RUN"),
+    (("wait", "rest"), "WAIT"),
+]
+_VERB_ACTION = {verb: action for verbs, action in _VERBS for verb in verbs}
+_FILLER = {"a", "an", "the", "to", "at", "up", "some", "with", "of"}
+_PREPOSITIONS = {"to", "from", "at", "on", "for"}
+_WORD_RE = re.compile(r"[a-z0-9']+")
+
+_OPENINGS = [
+    "The air smells of smoke and old ale.",
+    "A cold wind drifts through {loc}.",
+    "Somewhere nearby a dog barks twice.",
+    "The light shifts as clouds pass over {loc}.",
+]
+_CLOSINGS = [
+    "Nothing seems to stand in your way for now.",
+    "You sense the goblins are not far off.",
+    "The keg will not find its own way home.",
+    "A few villagers glance at you and go back to their work.",
+]
+_ACTION_TEXT = {
+    "MOVE": "You make your way toward {target}.",
+    "BUY": "You ask about the {item} and count your coins.",
+    "LOOK": "You take a careful look around {loc}.",
+    "TALK": "You talk with {target}, who has little to add.",
+    "ATTACK": "You swing at {target}, but the fight ends quickly.",
+    "TAKE_ITEM": "You reach for the {item}.",
+    "DROP_ITEM": "You set the {item} down.",
+    "GIVE_ITEM": "You offer the {item}.",
+    "USE_ITEM": "You use the {item}.",
+    "RUN": "You run until your lungs burn.",
+    "WAIT": "You wait a while and watch the world go by.",
+    "OTHER": "You try that, with mixed results.",
+}
+_CHOICES = ["LOOK around", "Go to market", "Go to blacksmith", "Go to cave", "Return to tavern", "WAIT a moment"]
+
+
+def _section(text: str, head: str, tail: str) -> str:
+    start = text.find(head)
+    if start < 0:
+        return ""
+    start += len(head)
+    end = text.find(tail, start)
+    return text[start:end if end >= 0 else len(text)].strip()
+
+
+def _json_section(text: str, head: str, tail: str) -> Any:
+    try:
+        return json.loads(_section(text, head, tail))
+    except ValueError:
+        return None
+
+
+def mock_intent(player_text: str) -> Dict[str, Any]:
+    text = (player_text or "").lower()
+    words = _WORD_RE.findall(text)
+    idx, action = next(((i, _VERB_ACTION[w]) for i, w in enumerate(words) if w in _VERB_ACTION), (-1, "OTHER"))
+    rest = [w for w in words[idx + 1:] if w not in _FILLER]
+    intent: Dict[str, Any] = {"action": action}
+    if action == "MOVE":
+        for aliases, canonical, _ in MOVE_TARGETS:
+            if any(a in text for a in aliases):
+                intent["target"] = canonical
+                break
+        if "north" in words:
+            intent["direction"] = "north"
+    elif action in ("BUY", "TAKE_ITEM", "DROP_ITEM", "GIVE_ITEM", "USE_ITEM"):
+        # "give keg to barkeep" -> item "keg", target "barkeep"
+        tail = words[idx + 1:]
+        cut = next((i for i, w in enumerate(tail) if w in _PREPOSITIONS), len(tail))
+        rest = [w for w in tail[:cut] if w not in _FILLER]
+        target = " ".join(w for w in tail[cut + 1:] if w not in _FILLER)
+        if target:
+            intent["target"] = target
+        qty = next((int(w) for w in rest if w.isdigit()), None)
+        name = " ".join(w for w in rest if not w.isdigit())
+        if name:
+            intent["item"] = name
+        if qty:
+            intent["quantity"] = qty
+    elif action in ("TALK", "ATTACK") and rest:
+        intent["target"] = " ".join(rest)
+    elif action == "OTHER":
+        intent["free_text"] = player_text
+    return intent
+
+
+def mock_gm(state: Any, intent: Any, rng: random.Random) -> Dict[str, Any]:
+    state = state if isinstance(state, dict) else {}
+    intent = intent if isinstance(intent, dict) else {}
+    loc = str((state.get("world") or {}).get("location") or "the village")
+    action = intent.get("action") if intent.get("action") in _ACTION_TEXT else "OTHER"
+    middle = _ACTION_TEXT[action].format(
+        loc=loc,
+        target=intent.get("target") or "them",
+        item=intent.get("item") or "thing",
+    )
+    narration = " ".join([rng.choice(_OPENINGS).format(loc=loc), middle, rng.choice(_CLOSINGS)])
+    choices = [c for c in _CHOICES if loc.lower() not in c.lower()]
+    return {
+        "narration": narration,
+        "choices": rng.sample(choices, 3),
+        "end_game": False,
+        "health_change": 0,
+        "inventory_change": [],
+    }
+
+
+def mock_summary(prev: str, texts: List[str]) -> Dict[str, Any]:
+    prev = "" if prev == "(none)" else prev
+    combined = " ".join([prev, *(t.split(".")[0] + "." for t in texts if t)]).strip()
+    return {"summary": combined[-600:]}
+
+
+class MockProvider(LLMProvider):
+    """
+    Deterministinen, verkoton provider. Vastauksen sisältö riippuu vain
+    promptista; latenssi (MOCK_LATENCY, MOCK_LATENCY_DIST, MOCK_TOKENS_PER_SEC)
+    ja virheet (MOCK_ERROR_RATE) arvotaan MOCK_SEED:llä siemennetystä RNG:stä.
+    """
+
+    def __init__(self):
+        self._rng = random.Random(CFG.mock_seed)
+        self.calls = 0
+
+    def respond(self, system: str, user: str) -> Dict[str, Any]:
+        rng = random.Random(hashlib.sha256(f"{system}\0{user}".encode("utf-8")).digest())
+        if system == INTENT_SYSTEM:
+            return mock_intent(_section(user, "Player command:\n", "\n\n"))
+        if system == MEMORY_UPDATE_SYSTEM:
+            texts = _json_section(user, "New narration texts (JSON array of strings):\n", "\n\nUpdate")
+            prev = _section(user, "Previous summary (may be empty):\n", "\n\nNew narration")
+            return mock_summary(prev, [str(t) for t in texts or []])
+        if system == FUSED_SYSTEM:
+            intent = mock_intent(_section(user, "Player command:\n", "\n\n"))
+            state = _json_section(user, "Current state:\n", "\n\nServer dice")
+            return {"intent": intent, "gm": mock_gm(state, intent, rng)}
+        state = _json_section(user, "Current state:\n", "\n\nParsed intent")
+        intent = _json_section(user, "Parsed intent:\n", "\n\nServer dice")
+        return mock_gm(state, intent, rng)
+
+    def _first_token_delay(self) -> float:
+        base = max(0.0, CFG.mock_latency)
+        if CFG.mock_latency_dist == "lognormal" and base > 0:
+            # mediaani = MOCK_LATENCY, häntä MOCK_LATENCY_SIGMA:n mukaan
+            return self._rng.lognormvariate(0.0, CFG.mock_latency_sigma) * base
+        return base
+
+    def _token_delay(self) -> float:
+        return 1.0 / CFG.mock_tokens_per_sec if CFG.mock_tokens_per_sec > 0 else 0.0
+
+    def _maybe_fail(self) -> None:
+        self.calls += 1
+        if CFG.mock_error_rate > 0 and self._rng.random() < CFG.mock_error_rate:
+            raise RuntimeError("mock provider: injected error")
+
+    def _latency(self, text: str) -> float:
+        return self._first_token_delay() + (len(text) // 4) * self._token_delay()
+
+    @staticmethod
+    def _report(system: str, user: str, text: str) -> None:
+        # kuten oikea API: usage-lohko jokaisesta vastauksesta (~4 merkkiä / token)
+        report_usage((len(system) + len(user)) // 4, len(text) // 4)
+
+    def chat_json(self, model, system, user, temperature=0.3) -> Dict[str, Any]:
+        self._maybe_fail()
+        res = self.respond(system, user)
+        self._report(system, user, json.dumps(res))
+        time.sleep(self._latency(json.dumps(res)))
+        return res
+
+    async def achat_json(self, model, system, user, temperature=0.3, max_tokens=None) -> Dict[str, Any]:
+        self._maybe_fail()
+        res = self.respond(system, user)
+        self._report(system, user, json.dumps(res))
+        await asyncio.sleep(self._latency(json.dumps(res)))
+        return res
+
+    async def astream_json(self, model, system, user, temperature=0.3) -> AsyncIterator[str]:
+        self._maybe_fail()
+        text = json.dumps(self.respond(system, user), ensure_ascii=False)
+        await asyncio.sleep(self._first_token_delay())
+        delay = self._token_delay()
+        # karkeasti ~4 merkkiä per token
+        for i in range(0, len(text), 4):
+            if delay:
+                await asyncio.sleep(delay)
+            yield text[i:i + 4]
+        self._report(system, user, text)
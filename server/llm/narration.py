@@ -1,12 +1,22 @@
 # server/llm/narration.py
 import json
-from typing import Dict, Any, List
+import time
+from typing import Dict, Any, List, AsyncIterator, Optional, Tuple, Union
 
-from core.types import GMResult
+from pydantic import ValidationError
+
+from core.metrics import Histogram
+from core.types import GMResult, Intent
 from core.state import ITEMS_DB
-from llm.provider import get_provider
+from llm.provider import get_provider, LLM_JSON_ERRORS
+from llm.usage import budget_state, narration_route
 from llm.prompts import NARRATION_SYSTEM, narration_user
 from llm.prompts import MEMORY_UPDATE_SYSTEM, memory_update_user
+from llm.prompts import FUSED_SYSTEM, fused_user
+from llm.intent import normalize_intent_dict, normalize_text
+from llm.stream import JSONFieldStreamer, JSONObjectStreamer
+from llm.budget import compact_state, estimate_tokens
+from core.cache import VariantPool
 from config import CFG
 
 _ACTION_MAP = {
@@ -44,11 +54,10 @@ def _normalize_inventory_change(data: Dict[str, Any]) -> Dict[str, Any]:
     data["narration"] = str(data.get("narration", "")).strip()
     return data
 
-def make_narration(state, intent, dice) -> GMResult:
-    prov = get_provider(CFG.narration_provider)
-
+def _gm_state(state) -> Dict[str, Any]:
     # kevyt state GM:lle
-    log_tail = state.get("log", [])[-3:]  # vain viimeiset 3 vuoroa
+    # vain viimeiset 3 vuoroa; turn-numero on historiaa varten, ei promptiin
+    log_tail = [{"player": e.get("player", ""), "gm": e.get("gm", "")} for e in state.get("log", [])[-3:]]
     state_for_llm = {
         "turn": state.get("turn", 0),
         "player": state.get("player"),
@@ -58,31 +67,283 @@ def make_narration(state, intent, dice) -> GMResult:
         "log_tail": log_tail,
         "items_db": list(ITEMS_DB.keys()),
     }
+    # build_llm_state lisää muistin; NARRATION_SYSTEM viittaa näihin kenttiin
+    for key in ("memory_long_summary", "memory_short_turns", "memory_recall"):
+        if key in state:
+            state_for_llm[key] = state[key]
+    return state_for_llm
+
+def _narration_prompt(state, intent, dice) -> str:
+    intent_json = json.dumps(intent, ensure_ascii=False)
+    dice_json = json.dumps(dice)
+
+    def render(s: Dict[str, Any]) -> str:
+        return narration_user(json.dumps(s, ensure_ascii=False), intent_json, dice_json)
+
+    compact = compact_state("narration", _gm_state(state), render, CFG.narration_token_budget, hint=intent_json)
+    return render(compact)
+
+# ----------------- narration-cache -----------------
+#
+# LOOK/WAIT samassa paikassa tuottaa lähes saman kuvauksen joka kerta ja
+# joka sessiossa. Opt-in (CFG.narration_cache): avaimelle kerätään ensin
+# CFG.narration_cache_variants vastausta, sen jälkeen tarjotaan niistä jokin
+# muu kuin pelaajan edellinen. Vain vastaukset ilman hp-/inventory-muutoksia.
+
+_NARRATION_CACHE = VariantPool(max_keys=CFG.narration_cache_size, variants=CFG.narration_cache_variants)
+_NARRATION_CACHE_STATS = {"lookups": 0, "hits": 0, "fills": 0, "tokens_saved": 0}
+
+
+def _hp_bucket(player: Dict[str, Any]) -> str:
+    hp, max_hp = player.get("hp", 0), player.get("max_hp", 0) or 1
+    ratio = hp / max_hp
+    return "healthy" if ratio >= 0.7 else "hurt" if ratio >= 0.3 else "critical"
+
 
-    user = narration_user(
-        json.dumps(state_for_llm, ensure_ascii=False),
-        json.dumps(intent, ensure_ascii=False),
-        json.dumps(dice),
+def _inventory_fingerprint(state) -> tuple:
+    # "check inventory" (LOOK/inventory) kuvaa pelaajan omat tavarat: vastaus
+    # jaetaan vain sessioille, joilla on täsmälleen sama inventaario
+    return tuple(sorted((i.get("name"), i.get("count")) for i in state.get("inventory") or []))
+
+
+def _narration_cache_key(state, intent, route: Tuple[str, str]) -> Optional[tuple]:
+    """route: (provider, model), jolla narration oikeasti pyydetään (narration_route)."""
+    if not CFG.narration_cache or not isinstance(intent, dict):
+        return None
+    action = intent.get("action")
+    if action not in CFG.narration_cache_actions or intent.get("item") or state.get("game_over"):
+        return None
+    return (
+        *route,
+        (state.get("world") or {}).get("location"),
+        action,
+        normalize_text(intent.get("target") or ""),
+        (state.get("quest") or {}).get("status"),
+        _hp_bucket(state.get("player") or {}),
+        _inventory_fingerprint(state),
     )
-    raw = prov.chat_json(CFG.narration_model, NARRATION_SYSTEM, user, temperature=0.5)
-    clean = _normalize_inventory_change(raw)
-    return GMResult.model_validate(clean)
 
-def update_memory_summary(prev_summary: str, new_texts: List[str]) -> str:
+
+def _cached_narration(key: Optional[tuple], state) -> Optional[GMResult]:
+    if key is None:
+        return None
+    _NARRATION_CACHE_STATS["lookups"] += 1
+    if not _NARRATION_CACHE.full(key):
+        return None
+    log = state.get("log") or []
+    last = log[-1].get("gm", "") if log else ""
+    entry = _NARRATION_CACHE.pick(key, accept=lambda v: v[0].narration not in last)
+    if entry is None:
+        return None
+    gm, tokens = entry
+    _NARRATION_CACHE_STATS["hits"] += 1
+    _NARRATION_CACHE_STATS["tokens_saved"] += tokens
+    return gm.model_copy(deep=True)
+
+
+def _store_narration(key: Optional[tuple], gm: GMResult, user: str) -> None:
+    if key is None or gm.health_change or gm.inventory_change or gm.end_game:
+        return
+    # säästö per osuma: system + user -prompti ja vastaus (paikallinen arvio)
+    tokens = estimate_tokens(NARRATION_SYSTEM) + estimate_tokens(user) + estimate_tokens(gm.model_dump_json())
+    _NARRATION_CACHE.add(key, (gm.model_copy(deep=True), tokens))
+    _NARRATION_CACHE_STATS["fills"] += 1
+
+
+def narration_cache_stats() -> Dict[str, Any]:
+    st = _NARRATION_CACHE_STATS
+    return {
+        **st,
+        "enabled": CFG.narration_cache,
+        "hit_rate": round(st["hits"] / st["lookups"], 3) if st["lookups"] else 0.0,
+        "keys": len(_NARRATION_CACHE),
+        "evictions": _NARRATION_CACHE.evictions,
+    }
+
+
+NARRATION_SECONDS = Histogram(
+    "aidventure_narration_seconds",
+    "Narration latency by mode (call, cache, stream, fused, fused_stream)",
+    ("mode",),
+)
+MEMORY_SUMMARY_SECONDS = Histogram(
+    "aidventure_memory_summary_seconds", "update_memory_summary latency by outcome", ("outcome",)
+)
+
+
+def _validate_intent(data: Any) -> Intent:
+    try:
+        return Intent.model_validate(normalize_intent_dict(data if isinstance(data, dict) else {}))
+    except ValidationError:
+        LLM_JSON_ERRORS.inc("intent", "schema")
+        raise
+
+
+def _validate_gm(data: Dict[str, Any]) -> GMResult:
+    try:
+        return GMResult.model_validate(_normalize_inventory_change(data))
+    except ValidationError:
+        LLM_JSON_ERRORS.inc("narration", "schema")
+        raise
+
+
+async def make_narration(state, intent, dice, priority: str = "narration") -> GMResult:
+    t0 = time.perf_counter()
+    kind, model = narration_route()
+    key = _narration_cache_key(state, intent, (kind, model))
+    cached = _cached_narration(key, state)
+    if cached is not None:
+        NARRATION_SECONDS.observe(time.perf_counter() - t0, "cache")
+        return cached
+    with NARRATION_SECONDS.time("call"):
+        prov = get_provider(kind, model)
+        user = _narration_prompt(state, intent, dice)
+        raw = await prov.achat_json(
+            model, NARRATION_SYSTEM, user, temperature=0.5, priority=priority, call="narration"
+        )
+        gm = _validate_gm(raw)
+    _store_narration(key, gm, user)
+    return gm
+
+async def make_fused_turn(state, player_text: str, dice) -> Tuple[Intent, GMResult]:
+    """
+    Fused-tila: yksi narration-mallin kutsu palauttaa sekä intentin että
+    GM:n tuloksen. Serveri ajaa sanity/move/shop-logiikan intentille ennen
+    kuin GM-kentät kirjataan.
+    """
+    kind, model = narration_route()
+    prov = get_provider(kind, model)
+    user = _fused_prompt(state, player_text, dice)
+    with NARRATION_SECONDS.time("fused"):
+        # intent + GM mahtuu juuri ja juuri 256 tokeniin, annetaan vähän väljyyttä
+        raw = await prov.achat_json(model, FUSED_SYSTEM, user, temperature=0.5, max_tokens=384)
+    if not isinstance(raw, dict):
+        raw = {}
+    intent = _validate_intent(raw.get("intent"))
+    gm_raw = raw.get("gm")
+    if not isinstance(gm_raw, dict):
+        gm_raw = {}
+    return intent, _validate_gm(gm_raw)
+
+def _fused_prompt(state, player_text: str, dice) -> str:
+    dice_json = json.dumps(dice)
+
+    def render(s: Dict[str, Any]) -> str:
+        return fused_user(player_text, json.dumps(s, ensure_ascii=False), dice_json)
+
+    compact = compact_state("fused", _gm_state(state), render, CFG.narration_token_budget, hint=player_text)
+    return render(compact)
+
+async def stream_fused_turn(state, player_text: str, dice) -> AsyncIterator[Tuple[str, Union[str, Intent, GMResult]]]:
+    """
+    Fused-tila streamina: yieldaa ("intent", Intent) heti kun vastauksen
+    intent-objekti on saapunut, sitten ("delta", teksti) narrationin paloille
+    ja lopuksi ("result", GMResult). Ennen intentiä tulleet narration-palat
+    pidätetään, jotta serveri ehtii ajaa sääntönsä (sanity/kauppa) ennen kuin
+    pelaajalle näytetään mitään; jos säännöt hoitavat vuoron, kutsuja sulkee
+    generaattorin ja loppu stream perutaan.
+    """
+    t0 = time.perf_counter()
+    kind, model = narration_route()
+    prov = get_provider(kind, model)
+    user = _fused_prompt(state, player_text, dice)
+    intent_parser = JSONObjectStreamer("intent")
+    parser = JSONFieldStreamer("narration")
+    intent: Optional[Intent] = None
+    held: List[str] = []
+    async for chunk in prov.astream_json(model, FUSED_SYSTEM, user, temperature=0.5):
+        delta = parser.feed(chunk)
+        if intent is None:
+            try:
+                raw_intent = intent_parser.feed(chunk)
+            except ValueError:
+                LLM_JSON_ERRORS.inc("intent", "decode")
+                raise
+            if raw_intent is not None:
+                intent = _validate_intent(raw_intent)
+                yield "intent", intent
+                if held:
+                    yield "delta", "".join(held)
+                    held.clear()
+        if delta:
+            if intent is None:
+                held.append(delta)
+            else:
+                yield "delta", delta
+    try:
+        raw = parser.result()
+    except ValueError:
+        LLM_JSON_ERRORS.inc("narration", "decode")
+        raise
+    if not isinstance(raw, dict):
+        raw = {}
+    if intent is None:
+        yield "intent", _validate_intent(raw.get("intent"))
+        if held:
+            yield "delta", "".join(held)
+    gm_raw = raw.get("gm")
+    gm = _validate_gm(gm_raw if isinstance(gm_raw, dict) else {})
+    NARRATION_SECONDS.observe(time.perf_counter() - t0, "fused_stream")
+    yield "result", gm
+
+async def stream_narration(state, intent, dice) -> AsyncIterator[Tuple[str, Union[str, GMResult]]]:
+    """
+    Kuten make_narration, mutta streamaa narration-kentän paloina:
+    yieldaa ("delta", teksti) jokaiselle uudelle palalle ja lopuksi
+    ("result", GMResult), kun koko JSON-objekti on valmis.
+    """
+    t0 = time.perf_counter()
+    kind, model = narration_route()
+    key = _narration_cache_key(state, intent, (kind, model))
+    cached = _cached_narration(key, state)
+    if cached is not None:
+        NARRATION_SECONDS.observe(time.perf_counter() - t0, "cache")
+        yield "delta", cached.narration
+        yield "result", cached
+        return
+    prov = get_provider(kind, model)
+    user = _narration_prompt(state, intent, dice)
+    parser = JSONFieldStreamer("narration")
+    async for chunk in prov.astream_json(model, NARRATION_SYSTEM, user, temperature=0.5):
+        delta = parser.feed(chunk)
+        if delta:
+            yield "delta", delta
+    try:
+        raw = parser.result()
+    except ValueError:
+        LLM_JSON_ERRORS.inc("narration", "decode")
+        raise
+    gm = _validate_gm(raw)
+    NARRATION_SECONDS.observe(time.perf_counter() - t0, "stream")
+    _store_narration(key, gm, user)
+    yield "result", gm
+
+async def update_memory_summary(prev_summary: str, new_texts: List[str]) -> str:
     prev = (prev_summary or "").strip()
     texts = [t.strip() for t in (new_texts or []) if t and t.strip()]
     if not texts and prev:
+        MEMORY_SUMMARY_SECONDS.observe(0.0, "skipped")
         return prev
 
-    prov = get_provider(CFG.narration_provider)
+    t0 = time.perf_counter()
+    if budget_state() != "ok":
+        # sessiobudjetti lähellä loppua: tiivistys ilman LLM-kutsua
+        MEMORY_SUMMARY_SECONDS.observe(0.0, "skipped_budget")
+        return ((prev + " " if prev else "") + " ".join(texts)).strip()[:1200]
+    prov = get_provider(CFG.narration_provider, CFG.narration_model)
     user = memory_update_user(prev, json.dumps(texts, ensure_ascii=False))
     try:
-        resp = prov.chat_json(CFG.narration_model, MEMORY_UPDATE_SYSTEM, user, temperature=0.2)
+        resp = await prov.achat_json(
+            CFG.narration_model, MEMORY_UPDATE_SYSTEM, user,
+            temperature=0.2, priority="summary", call="summary",
+        )
         summary = str(resp.get("summary", "")).strip()
         if summary:
+            MEMORY_SUMMARY_SECONDS.observe(time.perf_counter() - t0, "ok")
             return summary
     except Exception:
         pass
+    MEMORY_SUMMARY_SECONDS.observe(time.perf_counter() - t0, "fallback")
     # Fallback: simple concatenation with gentle trimming
     combined = (prev + " " if prev else "") + " ".join(texts)
     return combined.strip()[:1200]
\ No newline at end of file
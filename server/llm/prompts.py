@@ -41,6 +41,8 @@ NARRATION_SYSTEM = (
     "- Keep the world consistent; don't teleport or reset the player.\n\n"
     "- Use state.memory_long_summary and state.memory_short_turns to maintain continuity; "
     "  avoid repeating unchanged ambience or the same observation each turn.\n"
+    "- state.memory_recall (if present) lists earlier turns relevant to this action; "
+    "  use them for facts the player may refer back to.\n"
     "Quest / story rules:\n"
     "- Side activities (visiting blacksmith/market/tavern, chatting, small trades) are allowed.\n"
     "- Gently remind the player of the keg quest from time to time, but not in every single reply.\n"
@@ -75,6 +77,28 @@ def narration_user(state_json: str, intent_json: str, dice_json: str) -> str:
         "Return one JSON object with the required keys and formats. No extra text."
     )
 
+FUSED_SYSTEM = (
+    "You do two jobs in a single reply for a small text adventure game:\n"
+    "1) parse the player's raw command into a structured intent, and\n"
+    "2) act as the game master (GM) and narrate the outcome of that intent.\n\n"
+    "ALWAYS return ONLY JSON of the form {\"intent\": {...}, \"gm\": {...}}.\n"
+    "The 'intent' object follows the INTENT RULES and the 'gm' object follows the GM RULES below. "
+    "Where a section says 'return only JSON with keys', it describes that nested object.\n"
+    "The server validates the intent before applying your gm object, so keep them consistent.\n"
+    "- If the intent is MOVE to a known place (Village, Blacksmith, Market, Tavern, Cave), "
+    "the server moves the player there; narrate the arrival at that place.\n\n"
+    "INTENT RULES:\n" + INTENT_SYSTEM + "\n"
+    "GM RULES:\n" + NARRATION_SYSTEM
+)
+
+def fused_user(text: str, state_json: str, dice_json: str) -> str:
+    return (
+        "Player command:\n" + text + "\n\n"
+        "Current state:\n" + state_json + "\n\n"
+        "Server dice (for inspiration): " + dice_json + "\n\n"
+        "Return one JSON object {\"intent\": ..., \"gm\": ...}. No extra text."
+    )
+
 MEMORY_UPDATE_SYSTEM = """You maintain a concise long-term memory for a text adventure.
 Return strict JSON: {"summary": "<updated concise summary>"}.
 Use 3–6 sentences in past tense (~60–140 words).
@@ -1,10 +1,18 @@
 # server/llm/provider.py
 import os
 import json
+import time
+import heapq
+import asyncio
+import itertools
+import threading
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple, AsyncIterator
 
 from config import CFG
+from core.metrics import Collector, Counter, histogram_lines
+from llm.resilience import CircuitBreaker, LatencyHistogram, TokenBucket
+from llm.usage import record as record_usage, report_usage, tracking_call
 
 
 class LLMProvider(ABC):
@@ -21,14 +29,77 @@ class LLMProvider(ABC):
         """
         ...
 
+    @abstractmethod
+    async def achat_json(
+        self,
+        model: str,
+        system: str,
+        user: str,
+        temperature: float = 0.3,
+        max_tokens: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Async-versio chat_jsonista: ei varaa threadpool-workeria
+        verkkokutsun ajaksi. max_tokens=None -> providerin oletus.
+        """
+        ...
+
+    async def astream_json(
+        self,
+        model: str,
+        system: str,
+        user: str,
+        temperature: float = 0.3,
+    ) -> AsyncIterator[str]:
+        """
+        Streamaa mallin JSON-vastauksen raakatekstinä pala kerrallaan.
+        Oletus: ei oikeaa streamausta, koko vastaus yhtenä palana.
+        """
+        yield json.dumps(await self.achat_json(model, system, user, temperature), ensure_ascii=False)
+
+    def close(self) -> None:
+        """Sulkee synkronisen clientin yhteyspoolin (jos on)."""
+
+    async def aclose(self) -> None:
+        """Sulkee async-clientin yhteyspoolin (jos on)."""
+
 
 # --- Groq (llama) provider -------------------------------------------------
 
 
 class GroqProvider(LLMProvider):
     def __init__(self, api_key: Optional[str] = None):
-        from groq import Groq  # asennettu pipillä: pip install groq
-        self.client = Groq(api_key=api_key or CFG.groq_api_key)
+        from groq import Groq, AsyncGroq  # asennettu pipillä: pip install groq
+        import httpx  # tulee groqin mukana
+
+        key = api_key or CFG.groq_api_key
+        # omat httpx-poolit, jotta keep-alive -yhteydet pysyvät lämpiminä
+        # vuorosta toiseen (registry pitää providerin elossa koko prosessin ajan)
+        limits = httpx.Limits(
+            max_connections=CFG.http_max_connections,
+            max_keepalive_connections=CFG.http_max_keepalive,
+            keepalive_expiry=CFG.http_keepalive_expiry,
+        )
+        self.client = Groq(api_key=key, http_client=httpx.Client(limits=limits))
+        self.aclient = AsyncGroq(api_key=key, http_client=httpx.AsyncClient(limits=limits))
+
+    def close(self) -> None:
+        self.client.close()
+
+    async def aclose(self) -> None:
+        await self.aclient.close()
+
+    @staticmethod
+    def _messages(system: str, user: str):
+        return [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user},
+        ]
+
+    @staticmethod
+    def _report(usage) -> None:
+        if usage is not None:
+            report_usage(getattr(usage, "prompt_tokens", 0), getattr(usage, "completion_tokens", 0))
 
     def chat_json(
         self,
@@ -43,16 +114,60 @@ class GroqProvider(LLMProvider):
         """
         resp = self.client.chat.completions.create(
             model=model,
-            messages=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": user},
-            ],
+            messages=self._messages(system, user),
             response_format={"type": "json_object"},
             temperature=temperature,
             max_tokens=256,  # riittää hyvin intentille ja GM-jsonille
         )
+        self._report(getattr(resp, "usage", None))
+        return json.loads(resp.choices[0].message.content)
+
+    async def achat_json(
+        self,
+        model: str,
+        system: str,
+        user: str,
+        temperature: float = 0.3,
+        max_tokens: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Sama kuin chat_json, mutta AsyncGroq-clientillä.
+        """
+        resp = await self.aclient.chat.completions.create(
+            model=model,
+            messages=self._messages(system, user),
+            response_format={"type": "json_object"},
+            temperature=temperature,
+            max_tokens=max_tokens or 256,
+        )
+        self._report(getattr(resp, "usage", None))
         return json.loads(resp.choices[0].message.content)
 
+    async def astream_json(
+        self,
+        model: str,
+        system: str,
+        user: str,
+        temperature: float = 0.3,
+    ) -> AsyncIterator[str]:
+        # JSON mode ei tue streamausta, joten luotetaan promptiin
+        # (NARRATION_SYSTEM vaatii pelkän JSONin)
+        stream = await self.aclient.chat.completions.create(
+            model=model,
+            messages=self._messages(system, user),
+            temperature=temperature,
+            max_tokens=256,
+            stream=True,
+        )
+        async for chunk in stream:
+            # Groq kertoo usagen viimeisessä palassa (x_groq.usage)
+            self._report(getattr(getattr(chunk, "x_groq", None), "usage", None))
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
 
 # --- Gemini (valinnainen, fallbackaa Groq:iin jos ei toimi) -----------------
 
@@ -69,6 +184,15 @@ class GeminiProvider(LLMProvider):
             raise RuntimeError("GEMINI_API_KEY missing")
         genai.configure(api_key=key)
         self.genai = genai
+        # GenerativeModel-handlet cachetetaan mallinimen mukaan
+        self._models: Dict[str, Any] = {}
+
+    def _model(self, model: str):
+        m = self._models.get(model)
+        if m is None:
+            m = self.genai.GenerativeModel(model)
+            self._models[model] = m
+        return m
 
     def chat_json(
         self,
@@ -80,13 +204,71 @@ class GeminiProvider(LLMProvider):
         """
         Rakentaa yhden promptin ja pyytää minified JSONin.
         """
-        prompt = f"{system}\n\nUSER:\n{user}\n\nReturn ONLY valid minified JSON."
-        m = self.genai.GenerativeModel(model)
+        m = self._model(model)
         resp = m.generate_content(
-            prompt,
+            self._prompt(system, user),
             generation_config={"temperature": temperature},
         )
-        text = resp.text.strip()
+        self._report(getattr(resp, "usage_metadata", None))
+        return self._parse(resp.text)
+
+    async def achat_json(
+        self,
+        model: str,
+        system: str,
+        user: str,
+        temperature: float = 0.3,
+        max_tokens: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Async-versio: generate_content_async ei blokkaa event looppia.
+        """
+        m = self._model(model)
+        generation_config: Dict[str, Any] = {"temperature": temperature}
+        if max_tokens:
+            generation_config["max_output_tokens"] = max_tokens
+        resp = await m.generate_content_async(
+            self._prompt(system, user),
+            generation_config=generation_config,
+        )
+        self._report(getattr(resp, "usage_metadata", None))
+        return self._parse(resp.text)
+
+    async def astream_json(
+        self,
+        model: str,
+        system: str,
+        user: str,
+        temperature: float = 0.3,
+    ) -> AsyncIterator[str]:
+        m = self._model(model)
+        resp = await m.generate_content_async(
+            self._prompt(system, user),
+            generation_config={"temperature": temperature},
+            stream=True,
+        )
+        usage = None
+        async for chunk in resp:
+            # usage_metadata on kumulatiivinen, joten vain viimeinen kirjataan
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            if chunk.text:
+                yield chunk.text
+        self._report(usage)
+
+    @staticmethod
+    def _report(usage) -> None:
+        if usage is not None:
+            report_usage(
+                getattr(usage, "prompt_token_count", 0), getattr(usage, "candidates_token_count", 0)
+            )
+
+    @staticmethod
+    def _prompt(system: str, user: str) -> str:
+        return f"{system}\n\nUSER:\n{user}\n\nReturn ONLY valid minified JSON."
+
+    @staticmethod
+    def _parse(text: str) -> Dict[str, Any]:
+        text = text.strip()
         # stripataan mahdolliset ```json -aidat
         if text.startswith("```"):
             text = text.strip("`")
@@ -97,13 +279,10 @@ class GeminiProvider(LLMProvider):
 # --- providerin valinta -----------------------------------------------------
 
 
-def get_provider(kind: Optional[str]) -> LLMProvider:
-    """
-    Valitsee providerin CFG:n (tai annetun stringin) perusteella.
-
-    kind: "groq" | "gemini" | None
-    """
-    k = (kind or "groq").lower()
+def _build_provider(k: str) -> LLMProvider:
+    if k == "mock":
+        from llm.mock import MockProvider  # verkoton, kuormitustesteihin
+        return MockProvider()
     if k == "gemini":
         try:
             return GeminiProvider()
@@ -112,3 +291,559 @@ def get_provider(kind: Optional[str]) -> LLMProvider:
             return GroqProvider()
     # default: groq
     return GroqProvider()
+
+
+# Prosessinlaajuinen registry: (provider, model) -> provider-instanssi.
+# Clientit ja niiden yhteyspoolit luodaan kerran ja käytetään uudelleen.
+_REGISTRY: Dict[Tuple[str, str], LLMProvider] = {}
+_REGISTRY_STATS: Dict[Tuple[str, str], Dict[str, int]] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def _registered(key: Tuple[str, str], count: bool = True) -> LLMProvider:
+    prov = _REGISTRY.get(key)
+    if prov is not None:
+        if count:
+            _REGISTRY_STATS[key]["hits"] += 1
+        return prov
+    with _REGISTRY_LOCK:
+        prov = _REGISTRY.get(key)
+        if prov is None:
+            prov = _build_provider(key[0])
+            _REGISTRY[key] = prov
+            _REGISTRY_STATS[key] = {"created": 1, "hits": 0}
+        elif count:
+            _REGISTRY_STATS[key]["hits"] += 1
+    return prov
+
+
+def get_provider(kind: Optional[str], model: Optional[str] = None) -> LLMProvider:
+    """
+    Valitsee providerin CFG:n (tai annetun stringin) perusteella ja palauttaa
+    registrystä jo lämpimän instanssin, jos sellainen on. Instanssi on
+    käärittynä RoutedProvideriin (aikarajat, breaker, hedge, varareitti).
+
+    kind: "groq" | "gemini" | "mock" | None
+    model: mallinimi registry-avaimeksi (valinnainen)
+    """
+    key = ((kind or "groq").lower(), model or "")
+    _registered(key)
+    routed = _ROUTED.get(key)
+    if routed is None:
+        routed = _ROUTED.setdefault(key, RoutedProvider(key))
+    return routed
+
+
+# --- lähtevien kutsujen ajoitus ---------------------------------------------
+
+# pienempi = kiireellisempi; pelaajan odottama narration ohittaa intentin,
+# taustalla ajettava muistin tiivistys tulee niiden jälkeen ja spekulatiivinen
+# etukäteisajo (tarjotut valinnat) jää viimeiseksi
+PRIORITIES = {"narration": 0, "intent": 1, "summary": 2, "speculative": 3}
+_BACKGROUND = frozenset({"summary", "speculative"})
+
+
+class SchedulerBusy(RuntimeError):
+    """Jono on täynnä tai kutsu ei päässyt jonosta aikarajan sisällä."""
+
+
+def _rate_limits() -> Dict[Tuple[str, str], Tuple[int, int]]:
+    limits: Dict[Tuple[str, str], Tuple[int, int]] = {}
+    for entry in CFG.llm_rate_limits.split(","):
+        name, sep, value = entry.strip().rpartition("=")
+        if not sep:
+            continue
+        kind, _, model = name.partition(":")
+        rpm, _, tpm = value.partition("/")
+        limits[(kind.strip().lower(), model.strip())] = (int(rpm or 0), int(tpm or 0))
+    return limits
+
+
+_RATE_LIMITS = _rate_limits()
+
+
+def _estimate_cost(system: str, user: str, max_tokens: Optional[int]) -> int:
+    # karkea arvio (~4 merkkiä / token) riittää bucketille: prompt + vastauksen katto
+    return (len(system) + len(user)) // 4 + (max_tokens or 256)
+
+
+class OutboundScheduler:
+    """
+    Yhden (provider, model) -parin lähtevät kutsut.
+
+    - pyyntö- ja token-bucket (minuuttirajat); jos molemmissa on tilaa eikä
+      kukaan jonota, kutsu lähtee heti
+    - muuten kutsu jonottaa prioriteettijonossa; yksi dispatcher päästää aina
+      kiireellisimmän läpi, kun bucketit sallivat
+    - jonon koko on rajattu per prioriteettiluokka ja jonotuksella on aikaraja:
+      molemmat päätyvät SchedulerBusy-virheeseen
+    - jonotusaika mitataan erikseen providerin latenssista
+    """
+
+    def __init__(self, rpm: int, tpm: int, queue_size: int):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.queue_size = queue_size
+        self._heap: List[Tuple[int, int, asyncio.Future, int]] = []
+        self._seq = itertools.count()
+        self._depth = {name: 0 for name in PRIORITIES}
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.wait = {name: LatencyHistogram() for name in PRIORITIES}
+        self.counts = {"admitted": 0, "queued": 0, "rejected": 0, "expired": 0}
+
+    def _ready(self, cost: int) -> float:
+        return max(self.requests.wait_time(1), self.tokens.wait_time(cost))
+
+    def _admit(self, cost: int) -> None:
+        self.requests.take(1)
+        self.tokens.take(cost)
+        self.counts["admitted"] += 1
+
+    async def acquire(self, priority: str, cost: int, timeout: float) -> float:
+        """Odottaa vuoroa; palauttaa jonotusajan sekunteina."""
+        rank = PRIORITIES[priority]
+        if not self._heap and self._ready(cost) <= 0:
+            self._admit(cost)
+            self.wait[priority].observe(0.0)
+            return 0.0
+        if self._depth[priority] >= self.queue_size:
+            self.counts["rejected"] += 1
+            raise SchedulerBusy(f"LLM queue full ({priority})")
+
+        t0 = time.perf_counter()
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (rank, next(self._seq), fut, cost))
+        self._depth[priority] += 1
+        self.counts["queued"] += 1
+        self._kick()
+        try:
+            await _deadline(fut, timeout)
+        except asyncio.TimeoutError:
+            self.counts["expired"] += 1
+            raise SchedulerBusy(f"LLM queue wait exceeded {timeout}s ({priority})") from None
+        finally:
+            self._depth[priority] -= 1
+        waited = time.perf_counter() - t0
+        self.wait[priority].observe(waited)
+        return waited
+
+    def _kick(self) -> None:
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch())
+        else:
+            # uusi tulija voi olla kiireellisempi kuin nykyinen jonon kärki
+            self._wake.set()
+
+    async def _dispatch(self) -> None:
+        while self._heap:
+            _, _, fut, cost = self._heap[0]
+            if fut.done():  # aikaraja ylittyi tai kutsu peruttiin
+                heapq.heappop(self._heap)
+                continue
+            delay = self._ready(cost)
+            if delay <= 0:
+                heapq.heappop(self._heap)
+                self._admit(cost)
+                fut.set_result(None)
+                continue
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counts,
+            "rpm": int(self.requests.capacity),
+            "tpm": int(self.tokens.capacity),
+            "waiting": dict(self._depth),
+            "queue_wait": {name: h.snapshot() for name, h in self.wait.items() if h.count},
+        }
+
+
+# --- aikarajat, circuit breaker ja hedged requests --------------------------
+
+
+class ProviderUnavailable(RuntimeError):
+    """Kaikkien reittien breaker on auki."""
+
+
+class _Target:
+    """
+    Yhden (provider, model) -parin breaker, ajoitus, latenssihistogrammit ja laskurit.
+    latency = kokonaisten JSON-kutsujen kesto (hedge-viive lasketaan siitä),
+    first_chunk = streamin ensimmäisen palan viive; koko streamin kesto riippuu
+    vastauksen pituudesta eikä kuulu kumpaankaan.
+    """
+
+    __slots__ = ("key", "breaker", "latency", "first_chunk", "scheduler", "counts")
+
+    def __init__(self, key: Tuple[str, str]):
+        self.key = key
+        rpm, tpm = _RATE_LIMITS.get(key, (CFG.llm_rpm, CFG.llm_tpm))
+        self.scheduler = OutboundScheduler(rpm, tpm, CFG.llm_queue_size)
+        self.breaker = CircuitBreaker(CFG.llm_breaker_failures, CFG.llm_breaker_cooldown)
+        self.latency = LatencyHistogram()
+        self.first_chunk = LatencyHistogram()
+        self.counts = {"calls": 0, "errors": 0, "timeouts": 0, "cancelled": 0, "short_circuited": 0}
+
+    def hedge_delay(self) -> float:
+        if self.latency.samples() < CFG.llm_hedge_min_samples:
+            return CFG.llm_hedge_default_delay
+        q = self.latency.quantile(CFG.llm_hedge_quantile) or CFG.llm_hedge_default_delay
+        return max(CFG.llm_hedge_min_delay, q)
+
+
+_TARGETS: Dict[Tuple[str, str], _Target] = {}
+_ROUTED: Dict[Tuple[str, str], "RoutedProvider"] = {}
+_ROUTING_STATS = {"hedged": 0, "hedge_wins": 0, "failovers": 0, "unavailable": 0}
+
+# call = PRIORITIES-avain, stage = "decode" (ei JSON-objekti) | "schema" (pydantic)
+LLM_JSON_ERRORS = Counter(
+    "aidventure_llm_json_errors_total", "LLM replies that were not valid JSON or failed the schema", ("call", "stage")
+)
+
+
+def _target(key: Tuple[str, str]) -> _Target:
+    t = _TARGETS.get(key)
+    if t is None:
+        t = _TARGETS.setdefault(key, _Target(key))
+    return t
+
+
+def _backup_key(primary: Tuple[str, str]) -> Optional[Tuple[str, str]]:
+    if not CFG.llm_backup_provider and not CFG.llm_backup_model:
+        return None
+    key = (CFG.llm_backup_provider or primary[0], CFG.llm_backup_model or primary[1])
+    return None if key == primary else key
+
+
+async def _deadline(aw, timeout: float):
+    if not (timeout and timeout > 0):
+        return await aw
+    if hasattr(asyncio, "timeout"):
+        # Python < 3.12: wait_for palauttaa tuloksen ja nielee peruutuksen, jos
+        # aw valmistuu samalla kierroksella (perutun kutsujan pitää silti loppua)
+        async with asyncio.timeout(timeout):
+            return await aw
+    return await asyncio.wait_for(aw, timeout)
+
+
+class RoutedProvider(LLMProvider):
+    """
+    Ensisijainen (provider, model) ja valinnainen varareitti
+    (LLM_BACKUP_PROVIDER / LLM_BACKUP_MODEL):
+
+    - jokaisella kutsulla on aikaraja (LLM_TIMEOUT)
+    - reitti, jonka breaker on auki, ohitetaan; epäonnistunut kutsu
+      yritetään kerran seuraavalla reitillä
+    - LLM_HEDGE=1: jos ensimmäinen vastaus ei ole tullut reitin p95-viiveessä,
+      toinen pyyntö lähtee varareitille (tai samalle, jos varaa ei ole) ja
+      ensimmäinen kelvollinen JSON voittaa; hävinnyt pyyntö perutaan
+    - jokainen kutsu kulkee reitin OutboundSchedulerin läpi; priority on
+      PRIORITIES-avain (narration | intent | summary | speculative)
+    - call on kutsutyyppi token-kirjanpitoon (intent | narration | summary);
+      oletuksena priority, spekuloiva kutsu antaa sen erikseen
+    """
+
+    def __init__(self, key: Tuple[str, str]):
+        self.key = key
+
+    def _routes(self, model: str) -> List[_Target]:
+        primary = (self.key[0], model or self.key[1])
+        keys = [primary]
+        backup = _backup_key(primary)
+        if backup is not None:
+            keys.append(backup)
+        routes = []
+        for key in keys:
+            t = _target(key)
+            if t.breaker.available():
+                routes.append(t)
+            else:
+                t.counts["short_circuited"] += 1
+        if not routes:
+            _ROUTING_STATS["unavailable"] += 1
+            raise ProviderUnavailable(f"circuit open for {', '.join(f'{k}:{m}' for k, m in keys)}")
+        return routes
+
+    def chat_json(self, model, system, user, temperature=0.3):
+        return _registered(self.key, count=False).chat_json(model or self.key[1], system, user, temperature)
+
+    @staticmethod
+    def _queue_timeout(priority: str) -> float:
+        return CFG.llm_background_queue_timeout if priority in _BACKGROUND else CFG.llm_queue_timeout
+
+    @staticmethod
+    def _admit(t: _Target) -> bool:
+        """Varaa breakerin luvan; palauttaa onko kutsu half_open-tilan koekutsu."""
+        if not t.breaker.allow():
+            # toinen kutsu koettelee jo reittiä (tai breaker ehti aueta)
+            t.counts["short_circuited"] += 1
+            raise ProviderUnavailable(f"circuit open for {t.key[0]}:{t.key[1]}")
+        return t.breaker.probing
+
+    async def _call(self, t: _Target, priority, call, system, user, temperature, max_tokens) -> Dict[str, Any]:
+        prov = _registered(t.key, count=False)
+        cost = _estimate_cost(system, user, max_tokens)
+        probe = self._admit(t)
+        try:
+            await t.scheduler.acquire(priority, cost, self._queue_timeout(priority))
+            t.counts["calls"] += 1
+            t0 = time.perf_counter()
+            try:
+                with tracking_call() as usage:
+                    res = await _deadline(
+                        prov.achat_json(t.key[1], system, user, temperature, max_tokens), CFG.llm_timeout
+                    )
+                if not isinstance(res, dict):
+                    raise ValueError("LLM returned non-object JSON")
+            except asyncio.CancelledError:
+                # hedgen hävinnyt pyyntö tai asiakas katkaisi: ei provideri-virhe
+                t.counts["cancelled"] += 1
+                raise
+            except asyncio.TimeoutError:
+                t.counts["timeouts"] += 1
+                t.breaker.failure()
+                raise
+            except ValueError:
+                # malli vastasi, mutta vastaus ei ollut JSON-objekti
+                t.counts["errors"] += 1
+                t.breaker.failure()
+                LLM_JSON_ERRORS.inc(call, "decode")
+                raise
+            except Exception:
+                t.counts["errors"] += 1
+                t.breaker.failure()
+                raise
+        finally:
+            # success/failure vapauttaa jo; tämä kattaa perutun tai jonoon jääneen koekutsun
+            if probe:
+                t.breaker.release()
+        t.breaker.success()
+        t.latency.observe(time.perf_counter() - t0)
+        record_usage(*t.key, call, usage, len(system) + len(user), len(json.dumps(res)))
+        return res
+
+    async def achat_json(
+        self, model, system, user, temperature=0.3, max_tokens=None, priority="narration", call=None
+    ):
+        routes = self._routes(model)
+        args = (priority, call or priority, system, user, temperature, max_tokens)
+        if CFG.llm_hedge:
+            return await self._hedged(routes, args)
+        try:
+            return await self._call(routes[0], *args)
+        except Exception:
+            if len(routes) < 2:
+                raise
+        _ROUTING_STATS["failovers"] += 1
+        return await self._call(routes[1], *args)
+
+    async def _hedged(self, routes: List[_Target], args) -> Dict[str, Any]:
+        first = routes[0]
+        second = routes[1] if len(routes) > 1 else first
+        primary = asyncio.ensure_future(self._call(first, *args))
+        tasks = {primary}
+        error: Optional[BaseException] = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=first.hedge_delay())
+            if not done:
+                _ROUTING_STATS["hedged"] += 1
+            elif primary.exception() is None:
+                return primary.result()
+            else:
+                error = primary.exception()
+                tasks.clear()
+                _ROUTING_STATS["failovers"] += 1
+            hedge = asyncio.ensure_future(self._call(second, *args))
+            tasks.add(hedge)
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge and error is None:
+                            _ROUTING_STATS["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def astream_json(
+        self, model, system, user, temperature=0.3, priority="narration", call=None
+    ) -> AsyncIterator[str]:
+        # streamia ei voi hedgata (palat menevät jo asiakkaalle), mutta
+        # aikaraja, breaker ja varareitti ennen ensimmäistä palaa toimivat
+        routes = self._routes(model)
+        for i, t in enumerate(routes):
+            prov = _registered(t.key, count=False)
+            try:
+                probe = self._admit(t)
+            except ProviderUnavailable:
+                if i == len(routes) - 1:
+                    raise
+                _ROUTING_STATS["failovers"] += 1
+                continue
+            try:
+                await t.scheduler.acquire(
+                    priority, _estimate_cost(system, user, None), self._queue_timeout(priority)
+                )
+            except BaseException as e:
+                if probe:
+                    t.breaker.release()
+                if not isinstance(e, SchedulerBusy) or i == len(routes) - 1:
+                    raise
+                _ROUTING_STATS["failovers"] += 1
+                continue
+            t.counts["calls"] += 1
+            t0 = time.perf_counter()
+            started = False
+            chars = 0
+            stream = prov.astream_json(t.key[1], system, user, temperature).__aiter__()
+            try:
+                with tracking_call() as usage:
+                    while True:
+                        try:
+                            chunk = await _deadline(stream.__anext__(), CFG.llm_timeout)
+                        except StopAsyncIteration:
+                            break
+                        if not started:
+                            started = True
+                            t.first_chunk.observe(time.perf_counter() - t0)
+                        chars += len(chunk)
+                        yield chunk
+            except asyncio.CancelledError:
+                t.counts["cancelled"] += 1
+                raise
+            except Exception as e:
+                t.counts["timeouts" if isinstance(e, asyncio.TimeoutError) else "errors"] += 1
+                t.breaker.failure()
+                if started or i == len(routes) - 1:
+                    raise
+                _ROUTING_STATS["failovers"] += 1
+                continue
+            finally:
+                # kuluttaja sulki streamin kesken (GeneratorExit) tai se peruttiin:
+                # koekutsu vapautetaan ennen awaitia, jottei se jää varatuksi
+                if probe:
+                    t.breaker.release()
+                aclose = getattr(stream, "aclose", None)
+                if aclose is not None:
+                    try:
+                        await aclose()
+                    except Exception:
+                        pass
+            t.breaker.success()
+            record_usage(*t.key, call or priority, usage, len(system) + len(user), chars)
+            return
+
+
+def routing_stats() -> Dict[str, Any]:
+    """Reittien breakerit, ajoitus, latenssihistogrammit ja hedge/failover-laskurit."""
+    return {
+        **_ROUTING_STATS,
+        "hedge_enabled": CFG.llm_hedge,
+        "timeout": CFG.llm_timeout,
+        "targets": {
+            f"{kind}:{model}" if model else kind: {
+                **t.counts,
+                "breaker": t.breaker.snapshot(),
+                "latency": t.latency.snapshot(),
+                "stream_first_chunk": t.first_chunk.snapshot(),
+                "scheduler": t.scheduler.stats(),
+                "hedge_delay": round(t.hedge_delay(), 3),
+            }
+            for (kind, model), t in _TARGETS.items()
+        },
+    }
+
+
+def provider_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Registryn laskurit: montako clientia luotu ja montako get_provider-hakua
+    sai jo lämpimän instanssin (hits). HTTP-yhteyksien uudelleenkäyttöä
+    (keep-alive) nämä eivät mittaa; sen hoitaa clientin httpx-pooli.
+    """
+    return {
+        f"{kind}:{model}" if model else kind: dict(stats)
+        for (kind, model), stats in _REGISTRY_STATS.items()
+    }
+
+
+def _route_metric_lines() -> List[str]:
+    """/metrics: reittien latenssi- ja jonotushistogrammit, tapahtumat ja breakerit."""
+    route = ("provider", "model")
+    lines = [
+        "# HELP aidventure_llm_call_seconds LLM provider latency after admission",
+        "# TYPE aidventure_llm_call_seconds histogram",
+    ]
+    for key, t in _TARGETS.items():
+        h = t.latency
+        lines += histogram_lines("aidventure_llm_call_seconds", route, key, h.buckets, h.counts, h.sum, h.count)
+    lines += [
+        "# HELP aidventure_llm_stream_first_chunk_seconds Time to the first streamed chunk after admission",
+        "# TYPE aidventure_llm_stream_first_chunk_seconds histogram",
+    ]
+    for key, t in _TARGETS.items():
+        h = t.first_chunk
+        if h.count:
+            lines += histogram_lines(
+                "aidventure_llm_stream_first_chunk_seconds", route, key, h.buckets, h.counts, h.sum, h.count
+            )
+    lines += [
+        "# HELP aidventure_llm_queue_wait_seconds Time spent in the outbound scheduler queue",
+        "# TYPE aidventure_llm_queue_wait_seconds histogram",
+    ]
+    for key, t in _TARGETS.items():
+        for priority, h in t.scheduler.wait.items():
+            if h.count:
+                lines += histogram_lines(
+                    "aidventure_llm_queue_wait_seconds", (*route, "priority"), (*key, priority),
+                    h.buckets, h.counts, h.sum, h.count,
+                )
+    lines += [
+        "# HELP aidventure_llm_route_events_total LLM route calls, errors, timeouts and short-circuits",
+        "# TYPE aidventure_llm_route_events_total counter",
+    ]
+    for (kind, model), t in _TARGETS.items():
+        for event, n in t.counts.items():
+            lines.append(f'aidventure_llm_route_events_total{{provider="{kind}",model="{model}",event="{event}"}} {n}')
+    lines += [
+        "# HELP aidventure_llm_breaker_open Whether the route's circuit breaker is open (1) or not (0)",
+        "# TYPE aidventure_llm_breaker_open gauge",
+    ]
+    for (kind, model), t in _TARGETS.items():
+        is_open = 1 if t.breaker.snapshot()["state"] == "open" else 0
+        lines.append(f'aidventure_llm_breaker_open{{provider="{kind}",model="{model}"}} {is_open}')
+    lines += [
+        "# HELP aidventure_llm_routing_total Hedged requests, hedge wins, failovers and unavailable routes",
+        "# TYPE aidventure_llm_routing_total counter",
+    ]
+    for event, n in _ROUTING_STATS.items():
+        lines.append(f'aidventure_llm_routing_total{{event="{event}"}} {n}')
+    return lines
+
+
+Collector(_route_metric_lines)
+
+
+async def shutdown_providers() -> None:
+    """Sulkee kaikkien registryn providerien yhteyspoolit (FastAPI lifespan)."""
+    with _REGISTRY_LOCK:
+        providers = list(_REGISTRY.values())
+        _REGISTRY.clear()
+    for prov in providers:
+        # erilliset yritykset: synkronisen poolin virhe ei saa jättää async-poolia auki
+        try:
+            prov.close()
+        except Exception:
+            pass
+        try:
+            await prov.aclose()
+        except Exception:
+            pass
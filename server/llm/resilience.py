@@ -0,0 +1,156 @@
+# server/llm/resilience.py
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+# histogrammin ylärajat sekunteina (Prometheus-tyyliset kumulatiiviset bucketit)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+
+
+class LatencyHistogram:
+    """
+    Kiinteät bucketit raportointiin ja liukuva ikkuna tuoreista mittauksista
+    kvantiileja varten (hedge-viive lasketaan p95:stä).
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, window: int = 500):
+        self.buckets = tuple(buckets)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)  # viimeinen = +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._recent: Deque[float] = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.sum += seconds
+        self._recent.append(seconds)
+        for i, upper in enumerate(self.buckets):
+            if seconds <= upper:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self._recent:
+            return None
+        values = sorted(self._recent)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def samples(self) -> int:
+        return len(self._recent)
+
+    def snapshot(self) -> Dict[str, Any]:
+        p50, p95, p99 = (self.quantile(q) for q in (0.5, 0.95, 0.99))
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "buckets": {
+                **{str(b): c for b, c in zip(self.buckets, self.counts)},
+                "+Inf": self.counts[-1],
+            },
+            "p50": round(p50, 3) if p50 is not None else None,
+            "p95": round(p95, 3) if p95 is not None else None,
+            "p99": round(p99, 3) if p99 is not None else None,
+        }
+
+
+class CircuitBreaker:
+    """
+    closed -> (failure_threshold peräkkäistä virhettä) -> open
+    open   -> (cooldown kulunut) -> half_open: yksi koekutsu päästetään läpi,
+              muut ohitetaan kunnes se ratkeaa
+    half_open -> onnistuminen sulkee, virhe avaa uudelleen; jos koekutsu
+              perutaan ilman tulosta (release), seuraava kutsu saa kokeilla
+    """
+
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_count = 0
+        self.probing = False
+
+    def _cooled(self) -> None:
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+
+    def available(self) -> bool:
+        """Voisiko kutsu päästä läpi; ei varaa koekutsua (reititys, raportointi)."""
+        self._cooled()
+        return self.state == "closed" or (self.state == "half_open" and not self.probing)
+
+    def allow(self) -> bool:
+        """
+        Varaa kutsulle luvan. half_open-tilassa vain yksi kutsu kerrallaan
+        saa luvan; sen jälkeen probing on True, kunnes success/failure/release.
+        """
+        if not self.available():
+            return False
+        if self.state == "half_open":
+            self.probing = True
+        return True
+
+    def release(self) -> None:
+        """Koekutsu päättyi ilman tulosta (peruttu, jono täynnä, stream suljettu)."""
+        self.probing = False
+
+    def success(self) -> None:
+        self.failures = 0
+        self.state = "closed"
+        self.probing = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        self.probing = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opened_count += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._cooled()
+        return {
+            "state": self.state,
+            "probing": self.probing,
+            "consecutive_failures": self.failures,
+            "opened": self.opened_count,
+        }
+
+
+class TokenBucket:
+    """
+    Minuuttirajan token bucket: täyttyy tasaisesti rate_per_min / 60 sekunnissa,
+    kapasiteetti on minuutin kiintiö. rate_per_min <= 0 = ei rajaa.
+    """
+
+    def __init__(self, rate_per_min: float):
+        self.capacity = float(rate_per_min)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self._at = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._at) * self.rate)
+        self._at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Sekunnit siihen, kunnes amount on saatavilla (0 = heti)."""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        # kiintiötä suurempi pyyntö pääsee läpi täydestä bucketista
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        if not self.unlimited:
+            self._refill()
+            self.level -= min(amount, self.capacity)
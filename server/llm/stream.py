@@ -0,0 +1,131 @@
+# server/llm/stream.py
+import json
+import re
+from typing import Any, Dict, Optional
+
+_ESCAPES = {
+    '"': '"', "\\": "\\", "/": "/",
+    "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t",
+}
+
+
+class JSONFieldStreamer:
+    """
+    Inkrementaalinen parseri streamattavalle JSON-objektille.
+
+    feed() ottaa vastaan mallin tekstipaloja ja palauttaa valitun
+    string-kentän (oletuksena 'narration') uudet merkit heti kun ne ovat
+    tulleet, vaikka objekti olisi vielä kesken. result() parsii koko
+    objektin, kun stream on loppunut.
+    """
+
+    def __init__(self, field: str = "narration"):
+        self._key = re.compile(r'"' + re.escape(field) + r'"\s*:\s*"')
+        self._buf = ""
+        self._pos = -1      # kentän arvon seuraava lukemattoman merkin indeksi
+        self.done = False   # kentän string on luettu loppuun
+
+    def feed(self, chunk: str) -> str:
+        self._buf += chunk or ""
+        if self.done:
+            return ""
+        if self._pos < 0:
+            m = self._key.search(self._buf)
+            if not m:
+                return ""
+            self._pos = m.end()
+
+        out = []
+        buf, i = self._buf, self._pos
+        while i < len(buf):
+            c = buf[i]
+            if c == '"':
+                self.done = True
+                i += 1
+                break
+            if c != "\\":
+                out.append(c)
+                i += 1
+                continue
+            # escape-sekvenssi: odotetaan kunnes se on kokonaan saapunut
+            if i + 1 >= len(buf):
+                break
+            e = buf[i + 1]
+            if e != "u":
+                out.append(_ESCAPES.get(e, e))
+                i += 2
+                continue
+            if i + 6 > len(buf):
+                break
+            code = int(buf[i + 2:i + 6], 16)
+            if 0xD800 <= code < 0xDC00:
+                # surrogaattipari: tarvitaan myös toinen puolisko
+                if i + 12 > len(buf):
+                    break
+                out.append(json.loads('"' + buf[i:i + 12] + '"'))
+                i += 12
+            else:
+                out.append(chr(code))
+                i += 6
+        self._pos = i
+        return "".join(out)
+
+    def result(self) -> Dict[str, Any]:
+        text = self._buf.strip()
+        # mahdolliset ```json -aidat ja muu roska objektin ympäriltä pois
+        start, end = text.find("{"), text.rfind("}")
+        if start < 0 or end < start:
+            raise ValueError("stream did not contain a JSON object")
+        return json.loads(text[start:end + 1])
+
+
+class JSONObjectStreamer:
+    """
+    Palauttaa streamattavan JSON-vastauksen valitun objektikentän (esim.
+    fused-vastauksen 'intent') heti kun se on kokonaan saapunut, vaikka
+    muu vastaus olisi vielä kesken.
+    """
+
+    def __init__(self, field: str):
+        self._key = re.compile(r'"' + re.escape(field) + r'"\s*:\s*\{')
+        self._buf = ""
+        self._start = -1    # objektin '{' puskurissa
+        self._pos = 0       # seuraava skannaamaton merkki
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+        self.value: Optional[Dict[str, Any]] = None
+
+    def feed(self, chunk: str) -> Optional[Dict[str, Any]]:
+        """Palauttaa objektin sillä kutsulla, jolla se valmistuu; muuten None."""
+        self._buf += chunk or ""
+        if self.value is not None:
+            return None
+        if self._start < 0:
+            m = self._key.search(self._buf)
+            if not m:
+                return None
+            self._start = self._pos = m.end() - 1
+
+        buf, i = self._buf, self._pos
+        while i < len(buf):
+            c = buf[i]
+            i += 1
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif c == "\\":
+                    self._esc = True
+                elif c == '"':
+                    self._in_str = False
+            elif c == '"':
+                self._in_str = True
+            elif c == "{":
+                self._depth += 1
+            elif c == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.value = json.loads(buf[self._start:i])
+                    return self.value
+        self._pos = i
+        return None
@@ -0,0 +1,298 @@
+# server/llm/usage.py
+# LLM-kutsujen token-kulutus: providerit ilmoittavat vastauksen usage-lohkon
+# (report_usage), RoutedProvider kirjaa sen (record) sessiolle, mallille ja
+# kutsutyypille. Sessio kulkee contextvarissa (llm_session), joten intent-,
+# narration- ja tiivistysfunktioiden signatuureihin ei tarvitse koskea.
+import asyncio
+import heapq
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config import CFG
+from core.cache import TTLCache
+from core.metrics import Counter
+from core.store import make_store, VersionConflict
+
+logger = logging.getLogger(__name__)
+
+_SESSION: ContextVar[Optional[str]] = ContextVar("llm_session", default=None)
+# yhden kutsun usage; provider täyttää, RoutedProvider lukee (dict jaetaan myös
+# wait_for/hedge-taskien kopioimiin konteksteihin)
+_CALL: ContextVar[Optional[Dict[str, int]]] = ContextVar("llm_call_usage", default=None)
+# metered()-lohkon kirjatut tokenit (esim. yhden spekulaation kulutus)
+_METER: ContextVar[Optional[Dict[str, int]]] = ContextVar("llm_meter", default=None)
+
+# sessiokohtainen kulutus samassa säilössä kuin pelitila ja muisti
+# (SESSION_BACKEND=sqlite -> yhteinen kaikille workereille)
+_SESSIONS = make_store("usage")
+# prosessin viimeksi aktiiviset sessiot kokonaismäärineen (top-lista adminille)
+_RECENT = TTLCache(max_size=CFG.session_max_resident, ttl=CFG.session_idle_ttl)
+# kirjaamattomat lisäykset sessioittain: LLM-kutsu päivittää vain tämän, ja
+# _flush vie ne säilöön kerran _FLUSH_DELAY-jaksossa (jaetussa tilassa
+# SQLite-commit säiepoolissa, ei yhtä kirjoitusta per kutsu event loopissa)
+_PENDING: Dict[str, Dict[str, Any]] = {}
+_PENDING_LOCK = threading.Lock()
+_FLUSH_DELAY = 1.0
+_flush_scheduled = False
+# (provider, model, call) -> laskurit
+_BY_ROUTE: Dict[Tuple[str, str, str], Dict[str, int]] = {}
+
+LLM_TOKENS = Counter(
+    "aidventure_llm_tokens_total", "LLM tokens by route, call type and kind", ("provider", "model", "call", "kind")
+)
+
+
+@contextmanager
+def llm_session(session_id: Optional[str]) -> Iterator[None]:
+    """Kohdistaa lohkon sisällä tehdyt LLM-kutsut sessiolle."""
+    token = _SESSION.set(session_id)
+    try:
+        yield
+    finally:
+        _SESSION.reset(token)
+
+
+@contextmanager
+def metered() -> Iterator[Dict[str, int]]:
+    """
+    Laskee lohkon sisällä kirjatut tokenit (prompt + completion). Luku perustuu
+    samaan kuin sessiokirjanpito: providerin usageen tai lähetetyn, jo
+    tiivistetyn promptin pituuteen.
+    """
+    meter = {"prompt": 0, "completion": 0}
+    token = _METER.set(meter)
+    try:
+        yield meter
+    finally:
+        _METER.reset(token)
+
+
+def current_session() -> Optional[str]:
+    return _SESSION.get()
+
+
+def _new_holder() -> Dict[str, int]:
+    return {"prompt": 0, "completion": 0, "reported": 0}
+
+
+@contextmanager
+def tracking_call() -> Iterator[Dict[str, int]]:
+    """
+    Yhden kutsun usage-kirjanpito; provider täyttää report_usagella.
+    Toimii myös async-generaattorissa yieldien yli (stream).
+    """
+    holder = _new_holder()
+    token = _CALL.set(holder)
+    try:
+        yield holder
+    finally:
+        try:
+            _CALL.reset(token)
+        except ValueError:
+            # generaattori suljettiin toisesta kontekstista (esim. GC:n aclose);
+            # alkuperäistä kontekstia ei enää käytetä
+            pass
+
+
+def report_usage(prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> None:
+    """Providerit kutsuvat tätä vastauksen usage-tiedoilla (jos API antaa ne)."""
+    holder = _CALL.get()
+    if holder is None:
+        return
+    holder["prompt"] += int(prompt_tokens or 0)
+    holder["completion"] += int(completion_tokens or 0)
+    holder["reported"] = 1
+
+
+def _new_usage() -> Dict[str, Any]:
+    return {"total": 0, "calls": {}, "models": {}}
+
+
+def _add(bucket: Dict[str, int], prompt: int, completion: int, estimated: bool) -> None:
+    bucket["calls"] = bucket.get("calls", 0) + 1
+    bucket["prompt_tokens"] = bucket.get("prompt_tokens", 0) + prompt
+    bucket["completion_tokens"] = bucket.get("completion_tokens", 0) + completion
+    if estimated:
+        bucket["estimated_calls"] = bucket.get("estimated_calls", 0) + 1
+
+
+def _merge(usage: Dict[str, Any], delta: Dict[str, Any]) -> None:
+    usage["total"] += delta["total"]
+    for section in ("calls", "models"):
+        for name, counts in delta[section].items():
+            bucket = usage[section].setdefault(name, {})
+            for k, v in counts.items():
+                bucket[k] = bucket.get(k, 0) + v
+
+
+def record(provider: str, model: str, call: str, holder: Dict[str, int], prompt_chars: int, completion_chars: int) -> None:
+    """
+    Kirjaa yhden onnistuneen kutsun. Jos provider ei ilmoittanut usagea,
+    käytetään karkeaa arviota (~4 merkkiä / token) ja kutsu merkitään arvioksi.
+    """
+    estimated = not holder["reported"]
+    prompt = prompt_chars // 4 if estimated else holder["prompt"]
+    completion = completion_chars // 4 if estimated else holder["completion"]
+
+    _add(_BY_ROUTE.setdefault((provider, model, call), {}), prompt, completion, estimated)
+    LLM_TOKENS.inc(provider, model, call, "prompt", amount=prompt)
+    LLM_TOKENS.inc(provider, model, call, "completion", amount=completion)
+
+    meter = _METER.get()
+    if meter is not None:
+        meter["prompt"] += prompt
+        meter["completion"] += completion
+
+    session_id = _SESSION.get()
+    if not session_id:
+        return
+
+    with _PENDING_LOCK:
+        usage = _PENDING.setdefault(session_id, _new_usage())
+        usage["total"] += prompt + completion
+        _add(usage["calls"].setdefault(call, {}), prompt, completion, estimated)
+        _add(usage["models"].setdefault(f"{provider}:{model}", {}), prompt, completion, estimated)
+    _schedule_flush()
+
+
+def _schedule_flush() -> None:
+    global _flush_scheduled
+    if _flush_scheduled:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        flush_usage()
+        return
+    _flush_scheduled = True
+    loop.call_later(_FLUSH_DELAY, lambda: asyncio.ensure_future(_flush()))
+
+
+def _take_pending() -> Dict[str, Dict[str, Any]]:
+    global _PENDING
+    with _PENDING_LOCK:
+        pending, _PENDING = _PENDING, {}
+    return pending
+
+
+async def _flush() -> None:
+    global _flush_scheduled
+    _flush_scheduled = False
+    for session_id, delta in _take_pending().items():
+        try:
+            usage = await _SESSIONS.aupdate(session_id, lambda u, d=delta: _merge(u, d), _new_usage)
+        except VersionConflict:
+            # kirjanpito ei saa kaataa vuoroa; kilpaileva kirjaus voittaa
+            logger.warning("token usage for session %s not recorded (version conflict)", session_id)
+            continue
+        except Exception:
+            logger.exception("token usage for session %s not recorded", session_id)
+            continue
+        _RECENT.set(session_id, usage["total"])
+
+
+def flush_usage() -> None:
+    """Kirjaa odottavat lisäykset heti (sammutus, kutsut ilman event loopia)."""
+    for session_id, delta in _take_pending().items():
+        try:
+            usage = _SESSIONS.update(session_id, lambda u, d=delta: _merge(u, d), _new_usage)
+        except VersionConflict:
+            logger.warning("token usage for session %s not recorded (version conflict)", session_id)
+            continue
+        _RECENT.set(session_id, usage["total"])
+
+
+def _session_total(session_id: str) -> Dict[str, Any]:
+    """Säilön arvo + vielä kirjaamattomat lisäykset (kopio)."""
+    usage = _new_usage()
+    stored = _SESSIONS.get(session_id)
+    if stored:
+        _merge(usage, stored)
+    with _PENDING_LOCK:
+        delta = _PENDING.get(session_id)
+        if delta:
+            _merge(usage, delta)
+    return usage
+
+
+def session_tokens(session_id: Optional[str]) -> int:
+    if not session_id:
+        return 0
+    usage = _SESSIONS.get(session_id)
+    with _PENDING_LOCK:
+        delta = _PENDING.get(session_id)
+        pending = delta["total"] if delta else 0
+    return (usage["total"] if usage else 0) + pending
+
+
+def budget_state(session_id: Optional[str] = None) -> str:
+    """
+    "ok" | "soft" | "exhausted" sessiobudjetin (SESSION_TOKEN_BUDGET) mukaan.
+    soft: tiivistykset ohitetaan; exhausted: lisäksi narration pienemmällä mallilla.
+    Vuorot eivät koskaan epäonnistu budjetin takia.
+    """
+    limit = CFG.session_token_budget
+    if limit <= 0:
+        return "ok"
+    used = session_tokens(session_id if session_id is not None else _SESSION.get())
+    if used >= limit:
+        return "exhausted"
+    if used >= limit * CFG.session_budget_soft_ratio:
+        return "soft"
+    return "ok"
+
+
+def narration_route() -> Tuple[str, str]:
+    """(provider, model) narrationille; loppuneella budjetilla vaihdetaan pienempään malliin."""
+    if budget_state() == "exhausted":
+        return (
+            CFG.budget_fallback_provider or CFG.intent_provider,
+            CFG.budget_fallback_model or CFG.intent_model,
+        )
+    return CFG.narration_provider, CFG.narration_model
+
+
+def reset_usage(session_id: str) -> None:
+    with _PENDING_LOCK:
+        _PENDING.pop(session_id, None)
+    _SESSIONS.delete(session_id)
+
+
+def close_usage_store() -> None:
+    flush_usage()
+    _SESSIONS.close()
+
+
+def session_usage(session_id: str) -> Dict[str, Any]:
+    usage = _session_total(session_id)
+    return {
+        "session_id": session_id,
+        **usage,
+        "budget": {
+            "limit": CFG.session_token_budget,
+            "used": usage["total"],
+            "state": budget_state(session_id),
+        },
+    }
+
+
+def usage_report(top: int = 20) -> Dict[str, Any]:
+    by_model: Dict[str, Dict[str, int]] = {}
+    by_call: Dict[str, Dict[str, int]] = {}
+    for (provider, model, call), counts in _BY_ROUTE.items():
+        for bucket in (by_model.setdefault(f"{provider}:{model}", {}), by_call.setdefault(call, {})):
+            for k, v in counts.items():
+                bucket[k] = bucket.get(k, 0) + v
+    recent: List[Tuple[str, int]] = _RECENT.items()
+    return {
+        "by_model": by_model,
+        "by_call": by_call,
+        "top_sessions": [
+            {"session_id": sid, "tokens": total}
+            for sid, total in heapq.nlargest(top, recent, key=lambda x: x[1])
+        ],
+        "session_token_budget": CFG.session_token_budget,
+    }
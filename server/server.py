@@ -1,34 +1,122 @@
 import os
+import contextlib
+import copy
+import functools
 import json
+import logging
 import random
-import re
-from typing import Dict, Any
+import secrets
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Any, Iterator
 
-from fastapi import FastAPI, BackgroundTasks
+from fastapi import FastAPI, BackgroundTasks, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 
-from core.types import TurnIn, TurnOut, Intent
+from core.types import TurnIn, TurnOut, Intent, GMResult
 from core.state import (
     new_state,
     apply_health_change,
     apply_item_effect,
     get_item,
     ITEMS_DB,
+    ITEM_INDEX,
     build_llm_state,
     add_game_turn,
     get_memory_context,
     update_long_summary,
+    append_log,
 )
 from core.sanity import sanity_check
-from core.memory import reset_memory
-from llm.intent import parse_intent
-from llm.narration import make_narration
+from core.inventory import Inventory, state_from_dict, state_to_dict
+from core.world import ALIASES, MOVE_TARGETS
+from core.shop import ShopWords, shop_at, shop_choices
+from core.memory import memory_pending_size, memory_pinned, reset_memory, memory_store_stats, close_memory_store
+from core.summarizer import SummaryScheduler
+from core.store import make_store, close_spill, VersionConflict
+from core.speculation import Speculator, SpecResult
+from core.gate import TurnGate
+from core.history import get_history, close_history
+from core.retrieval import drop_recall_index, recall_stats
+from core.patch import make_patch
+from core.metrics import Counter, Gauge, Histogram, render_metrics
+from llm.intent import parse_intent, fast_parse_intent, fast_path_stats, intent_cache_stats
+from llm.narration import (
+    make_narration, make_fused_turn, stream_fused_turn, stream_narration, narration_cache_stats,
+)
+from llm.provider import provider_stats, routing_stats, shutdown_providers
+from llm.budget import prompt_stats
+from llm.usage import close_usage_store, llm_session, metered, reset_usage, session_usage, usage_report
+from config import CFG
+
+logger = logging.getLogger(__name__)
 
 # ----------------- FastAPI & session management -----------------
 
-SESSIONS: Dict[str, Dict[str, Any]] = {}
+# pelitilat: oletuksena rajattu määrä muistissa (häädetyt valuvat levylle),
+# SESSION_BACKEND=sqlite -> usean workerin yhteinen, versioitu säilö (core/store.py)
+SESSIONS = make_store("state", dump=state_to_dict, load=state_from_dict)
+
+# saman session vuorot yksi kerrallaan + idempotency-avaimet
+GATE = TurnGate()
+
+# tarjottujen valintojen etukäteisajo (CFG.speculation)
+SPECULATOR = Speculator(
+    max_concurrency=CFG.speculation_max_concurrency,
+    ttl=CFG.speculation_ttl,
+)
+
+
+# pitkän muistin tiivistys: debounce + yksi ajo per sessio + rajattu työjono
+SUMMARIES = SummaryScheduler(
+    run=update_long_summary,
+    pending=memory_pending_size,
+    min_turns=CFG.summary_min_turns,
+    min_chars=CFG.summary_min_chars,
+    idle_seconds=CFG.summary_idle_seconds,
+    workers=CFG.summary_workers,
+    queue_size=CFG.summary_queue_size,
+)
+
+# /metrics: kuuman polun latenssit ja lopputulokset (Prometheus text format)
+TURN_SECONDS = Histogram("aidventure_turn_seconds", "Whole turn latency by endpoint", ("endpoint",))
+SANITY_SECONDS = Histogram("aidventure_sanity_check_seconds", "sanity_check latency")
+SANITY_TOTAL = Counter("aidventure_sanity_checks_total", "sanity_check results", ("result",))
+SHOP_SECONDS = Histogram("aidventure_shop_seconds", "try_shop_purchase latency")
+SHOP_TOTAL = Counter(
+    "aidventure_shop_total", "Rule-based shop outcomes (short_circuit = turn answered without narration)", ("outcome",)
+)
+APPLY_SECONDS = Histogram("aidventure_state_apply_seconds", "apply_gm_result latency")
+ITEMS_DROPPED = Counter(
+    "aidventure_inventory_changes_dropped_total", "GM inventory changes ignored by the server", ("reason",)
+)
+
+
+def _resident(stats: Dict[str, Any]) -> int:
+    # SessionStore: "resident"; SharedSessionStore (sqlite): kaikki tiedoston sessiot
+    return stats.get("resident", stats.get("sessions", 0))
+
+
+Gauge("aidventure_sessions_resident", "Game sessions held by this process", lambda: _resident(SESSIONS.stats()))
+Gauge("aidventure_memory_managers_resident", "Memory managers held by this process", lambda: _resident(memory_store_stats()))
+Gauge("aidventure_summary_jobs_queued", "Memory summary jobs waiting in the queue", lambda: SUMMARIES.stats()["queued"])
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await SUMMARIES.close()
+    # suljetaan LLM-clienttien yhteyspoolit siististi
+    await shutdown_providers()
+    SESSIONS.close()
+    close_memory_store()
+    close_usage_store()
+    close_spill()
+    close_history()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -45,43 +133,68 @@ def health_check():
         "intent_model": os.getenv("INTENT_MODEL", "unknown"),
         "narration_provider": os.getenv("NARRATION_PROVIDER", "unknown"),
         "narration_model": os.getenv("NARRATION_MODEL", "unknown"),
+        "providers": provider_stats(),
+        "llm_routing": routing_stats(),
+        "intent_fast_path": fast_path_stats(),
+        "intent_cache": intent_cache_stats(),
+        "narration_cache": narration_cache_stats(),
+        "turn_mode": CFG.turn_mode,
+        "speculation": SPECULATOR.stats(),
+        "turn_gate": GATE.stats(),
+        "prompt_tokens": prompt_stats(),
+        "sessions": SESSIONS.stats(),
+        "memory_managers": memory_store_stats(),
+        "memory_summaries": SUMMARIES.stats(),
+        "memory_recall": recall_stats(),
     }
 
 
-def ensure_session(session_id: str) -> Dict[str, Any]:
-    """Luo uuden pelitilan jos sessiota ei ole, muuten palauttaa olemassa olevan."""
-    if session_id not in SESSIONS:
-        SESSIONS[session_id] = new_state()
-        # clear memory for a fresh adventure
-        reset_memory(session_id)
-    return SESSIONS[session_id]
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus text exposition format."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 
-# ----------------- Item-nimien normalisointi -----------------
+async def load_session(session_id: str) -> tuple[Dict[str, Any], int]:
+    """
+    Palauttaa (pelitila, versio). Luo uuden pelitilan jos sessiota ei ole.
+    Versio annetaan takaisin save_session:lle vuoron lopuksi.
+    """
+    state, version = await SESSIONS.aload(session_id)
+    if state is None:
+        state = new_state()
+        try:
+            version = await SESSIONS.asave(session_id, state, 0)
+        except VersionConflict:
+            # toinen worker loi session samaan aikaan – käytetään sitä
+            return await SESSIONS.aload(session_id)
+        # clear memory and history for a fresh adventure
+        reset_memory(session_id)
+        get_history().delete(session_id)
+        drop_recall_index(session_id)
+        reset_usage(session_id)
+    # inventaario pysyy Inventory-oliona koko vuoron ajan
+    Inventory.of(state)
+    return state, version
 
-ALIASES = {
-    # raha
-    "gold coins": "Gold Coin",
-    "gold coin": "Gold Coin",
-    "coins": "Gold Coin",
-    "coin": "Gold Coin",
 
-    # kirjoitusvirheitä / paikkoja
-    "supplies": "supplies",
-    "blacsmith": "blacksmith",
-    "black smith": "blacksmith",
+async def ensure_session(session_id: str) -> Dict[str, Any]:
+    """Luo uuden pelitilan jos sessiota ei ole, muuten palauttaa olemassa olevan."""
+    return (await load_session(session_id))[0]
 
-    # ruoka
-    "bread": "Loaf of Bread",
-    "loaf": "Loaf of Bread",
 
-    # aseiden yleisnimityksiä
-    "better sword": "Iron Sword",
-    "sword": "Iron Sword",
-}
+async def save_session(session_id: str, state: Dict[str, Any], version: int) -> int:
+    """Tallentaa vuoron tuloksen; rinnakkainen muutos toisessa workerissa -> 409."""
+    try:
+        version = await SESSIONS.asave(session_id, state, version)
+    except VersionConflict:
+        raise HTTPException(status_code=409, detail="Session was updated concurrently, please retry.")
+    # state["log"] on rajattu rengaspuskuri; koko historia kirjataan erikseen
+    get_history().record(session_id, state.get("log") or [])
+    return version
 
-_WORD_S = re.compile(r"s$", re.IGNORECASE)
 
+# ----------------- Item-nimien normalisointi -----------------
 
 def normalize_item_name(name: str) -> str | None:
     """
@@ -107,28 +220,22 @@ def normalize_item_name(name: str) -> str | None:
         return key
 
     # monikko → yksikkö
-    if _WORD_S.search(raw):
-        singular = _WORD_S.sub("", raw)
-        key2, _ = get_item(singular)
-        if key2:
-            return key2
+    key = ITEM_INDEX.singular(raw_lower)
+    if key:
+        return key
 
     # alkuosumalla yksi match
-    starts = [k for k in ITEMS_DB.keys() if k.lower().startswith(raw_lower)]
-    if len(starts) == 1:
-        return starts[0]
+    key = ITEM_INDEX.unique_prefix(raw_lower)
+    if key:
+        return key
 
     # item-nimi sisältyy tähän merkkijonoon: 'buy dagger' -> 'Dagger'
-    key_in_raw = [k for k in ITEMS_DB.keys() if k.lower() in raw_lower]
-    if len(key_in_raw) == 1:
-        return key_in_raw[0]
+    key = ITEM_INDEX.unique_in(raw_lower)
+    if key:
+        return key
 
     # tämä merkkijono sisältyy item-nimeen: 'map' -> 'Old Map'
-    contains = [k for k in ITEMS_DB.keys() if raw_lower in k.lower()]
-    if len(contains) == 1:
-        return contains[0]
-
-    return None
+    return ITEM_INDEX.unique_containing(raw_lower)
 
 
 def extract_item_from_text(text: str, catalog: Dict[str, int]) -> str | None:
@@ -139,16 +246,16 @@ def extract_item_from_text(text: str, catalog: Dict[str, int]) -> str | None:
     if not text:
         return None
     lower = text.lower()
+    # kaikki tekstin aliakset ja item-nimet yhdellä läpikäynnillä
+    found = ITEM_INDEX.scan(lower)
 
     # alias-substringit – esim. 'bread' tekstissä -> Loaf of Bread
-    for alias_key, alias_val in ALIASES.items():
-        if alias_val == "supplies":
-            continue
-        if alias_key in lower:
-            return alias_val
+    alias = ITEM_INDEX.first_alias(found, skip=("supplies",))
+    if alias:
+        return alias
 
     # katalogin item-nimet tekstissä: 'buy dagger' -> 'Dagger'
-    hits = [name for name in catalog.keys() if name.lower() in lower]
+    hits = [name for name in catalog.keys() if name.lower() in found]
     if len(hits) == 1:
         return hits[0]
 
@@ -178,21 +285,10 @@ def maybe_move(state: Dict[str, Any], intent: Intent, raw_text: str = "") -> str
 
     # varsinaiset MOVE-komennot
     if intent.action == "MOVE":
-        if "blacksmith" in t or "smith" in t:
-            state["world"]["location"] = "Blacksmith"
-            return "You head to the blacksmith's forge."
-        if "market" in t:
-            state["world"]["location"] = "Market"
-            return "You head to the small village market."
-        if "tavern" in t:
-            state["world"]["location"] = "Tavern"
-            return "You return to the tavern."
-        if "cave" in t or "north" in t:
-            state["world"]["location"] = "Cave"
-            return "You make your way toward the goblin cave."
-        if "village" in t:
-            state["world"]["location"] = "Village"
-            return "You are back in the village square."
+        for keywords, location, text in MOVE_TARGETS:
+            if any(k in t for k in keywords):
+                state["world"]["location"] = location
+                return text
 
         # muu liikkuminen (esim. 'go to ruins') annetaan GM:n tulkittavaksi.
         # Serveri ei muuta locationia, mutta GM voi kuvailla ympäristöä
@@ -203,31 +299,16 @@ def maybe_move(state: Dict[str, Any], intent: Intent, raw_text: str = "") -> str
 # ----------------- raha & inventory-utilityt -----------------
 
 
-def count_coins(state: Dict[str, Any]) -> int:
-    for it in state["inventory"]:
-        if it["name"].lower() == "gold coin":
-            return it["count"]
-    return 0
+def count_coins(inv: Inventory) -> int:
+    return inv.count("Gold Coin")
 
 
-def add_item(state: Dict[str, Any], name: str, qty: int) -> None:
-    for it in state["inventory"]:
-        if it["name"].lower() == name.lower():
-            it["count"] += qty
-            return
-    state["inventory"].append({"name": name, "count": qty})
+def add_item(inv: Inventory, name: str, qty: int) -> None:
+    inv.add(name, qty)
 
 
-def remove_coins(state: Dict[str, Any], qty: int) -> bool:
-    for it in state["inventory"]:
-        if it["name"].lower() == "gold coin":
-            if it["count"] >= qty:
-                it["count"] -= qty
-                if it["count"] == 0:
-                    state["inventory"].remove(it)
-                return True
-            return False
-    return False
+def remove_coins(inv: Inventory, qty: int) -> bool:
+    return inv.remove("Gold Coin", qty)
 
 
 # ----------------- yksinkertainen kauppalogiikka -----------------
@@ -235,104 +316,37 @@ def remove_coins(state: Dict[str, Any], qty: int) -> bool:
 
 def try_shop_purchase(state: Dict[str, Any], intent: Intent, raw_text: str) -> str | None:
     """
-    Yksinkertainen sääntöpohjainen kauppa:
-
-      - Market / Village: Loaf of Bread (2c), Torch (1c), Rope (2c),
-                          Bandage (2c), Healing Herbs (3c)
-      - Blacksmith: Iron Sword (10c), Shield (8c), Dagger (4c)
+    Yksinkertainen sääntöpohjainen kauppa core/world.py:n SHOPS-määrittelyn
+    mukaan (esim. Market / Village: leipä, soihtu, köysi...; Blacksmith: aseet).
 
     Tämän on tarkoitus kattaa *perustapaukset*.
     Kaikki monimutkaisempi kaupankäynti (tinkiminen, erikoisesineet,
     random NPC-kauppiaat uusissa paikoissa) annetaan GM:n hoidettavaksi.
     """
-    loc = state["world"]["location"]
-    text = (intent.free_text or raw_text or "").lower()
-
     # vain tietyt paikat saavat automaattisen shop-käsittelyn
-    if loc not in ("Blacksmith", "Market", "Village"):
+    shop = shop_at(state["world"]["location"])
+    if shop is None:
         return None
 
-    market_catalog = {
-        "Loaf of Bread": 2,
-        "Torch": 1,
-        "Rope": 2,
-        "Bandage": 2,
-        "Healing Herbs": 3,
-    }
-    blacksmith_catalog = {
-        "Iron Sword": 10,
-        "Shield": 8,
-        "Dagger": 4,
-    }
-
-    def filter_existing(catalog: Dict[str, int]) -> Dict[str, int]:
-        out: Dict[str, int] = {}
-        for name, price in catalog.items():
-            k, _ = get_item(name)
-            if k:
-                out[name] = price
-        return out
-
-    market_catalog = filter_existing(market_catalog)
-    blacksmith_catalog = filter_existing(blacksmith_catalog)
-    catalog = market_catalog if loc in ("Market", "Village") else blacksmith_catalog
+    text = (intent.free_text or raw_text or "").lower()
+    words = ShopWords(text)
+    catalog = shop.catalog
 
     # --- hinnan/kaupan kysely ilman ostamista ---
-    hint_words = [
-        "price",
-        "cost",
-        "buy",
-        "sell",
-        "weapon",
-        "sword",
-        "axe",
-        "shield",
-        "dagger",
-        "torch",
-        "rope",
-        "bread",
-        "food",
-        "rations",
-    ]
-    if intent.action != "BUY" and any(w in text for w in hint_words):
-        if loc == "Blacksmith":
-            offers = [f"{name} for {price} coins" for name, price in blacksmith_catalog.items()]
-            return (
-                "The blacksmith shows you his wares: " + ", ".join(offers) + "."
-                if offers
-                else "The blacksmith shrugs; his racks are bare today."
-            )
-        else:
-            offers = [f"{name} for {price} coins" for name, price in market_catalog.items()]
-            return (
-                "Stalls around you offer " + ", ".join(offers) + "."
-                if offers
-                else "The market is quiet and offers little right now."
-            )
+    if intent.action != "BUY" and words.hint:
+        return shop.offers
 
     # jos intent ei ole BUY, ei tehdä mitään – GM hoitaa muun kaupankäynnin
     if intent.action != "BUY":
         return None
 
     # tinkiminen ym. erikoistilanteet → GM:n vastuulle
-    if "discount" in text or "cheaper" in text or "haggle" in text or "bargain" in text:
-        if loc == "Blacksmith":
-            return (
-                "The blacksmith chuckles. 'A generous offer, but steel doesn't come cheap. "
-                "No discounts today, I'm afraid.'"
-            )
-        else:
-            return (
-                "The vendor shakes their head. 'Business is hard enough as it is. "
-                "No special discounts today.'"
-            )
-
-    # ruoka sepältä → ohjaus markkinalle
-    if "food" in text and loc == "Blacksmith":
-        return (
-            "The blacksmith wipes his hands and grunts: 'I sell steel, not stew. "
-            "For food, try the market in the village square.'"
-        )
+    if words.haggle:
+        return shop.haggle_text
+
+    # ruoka kaupasta, joka ei sitä myy → ohjaus muualle
+    if words.food and shop.food_text:
+        return shop.food_text
 
     # --- varsinainen ostaminen: vain selkeät tapaukset ---
     asked_item: str | None = None
@@ -349,17 +363,14 @@ def try_shop_purchase(state: Dict[str, Any], intent: Intent, raw_text: str) -> s
         if extracted:
             asked_item = extracted
 
-    lower = text
     wanted: list[tuple[str, int]] = []
 
     # 3) "supplies" / "rations" / "food" marketissa → halvimmat pari juttua
     if not asked_item:
-        if loc in ("Market", "Village") and (
-            "supplies" in lower or "rations" in lower or "food" in lower
-        ):
+        if shop.sells_supplies and words.supplies:
             if not catalog:
                 return "There aren't any suitable supplies available to buy here."
-            wanted = sorted(catalog.items(), key=lambda x: x[1])[:2]
+            wanted = list(shop.supplies)
         else:
             # epäselvä ostotilanne → anna GM:n käsitellä, ei pakoteta virheviestiä
             return None
@@ -369,100 +380,106 @@ def try_shop_purchase(state: Dict[str, Any], intent: Intent, raw_text: str) -> s
             return None
         wanted = [(asked_item, catalog[asked_item])]
 
+    # rajallinen varasto (SHOPS[...]["catalog"][x]["stock"]) lasketaan sessiokohtaisesti
+    sold = state["world"].get("shop_sold", {})
+    for name, _ in wanted:
+        if name in shop.stock and sold.get(f"{shop.id}:{name}", 0) >= shop.stock[name]:
+            return f"The {name} is sold out here."
+
     total = sum(price for _, price in wanted)
-    if count_coins(state) < total:
+    inv = Inventory.of(state)
+    if count_coins(inv) < total:
         items_list = ", ".join(name for name, _ in wanted)
         return f"You don't have enough coins to buy {items_list}. Total cost is {total}."
 
-    if not remove_coins(state, total):
+    if not remove_coins(inv, total):
         return "Purchase failed: not enough Gold Coins."
 
     for name, _ in wanted:
-        add_item(state, name, 1)
+        add_item(inv, name, 1)
+        if name in shop.stock:
+            sold = state["world"].setdefault("shop_sold", {})
+            sold[f"{shop.id}:{name}"] = sold.get(f"{shop.id}:{name}", 0) + 1
 
     items_list = ", ".join(name for name, _ in wanted)
     return f"You buy {items_list} for {total} Gold Coin(s)."
 
-# Include memory in LLM state and record the turn
-def handle_turn(state, intent, dice, session_id: str, background_tasks: BackgroundTasks | None = None, player_text: str = ""):
-    state_for_llm = build_llm_state(state, session_id)
+# Include memory in LLM state; the turn is recorded by the caller after the save
+async def handle_turn(state, intent, dice, session_id: str, player_text: str = ""):
+    state_for_llm = await build_llm_state(state, session_id, player_text)
     intent_dict = intent.model_dump() if hasattr(intent, "model_dump") else intent
-    gm_result = make_narration(state_for_llm, intent_dict, dice)
+    return await make_narration(state_for_llm, intent_dict, dice)
 
-    # Record player + gm pair for short memory
-    add_game_turn(player_text or "", gm_result.narration, session_id)
 
-    # Update long summary in background
-    if background_tasks is not None:
-        background_tasks.add_task(update_long_summary, session_id)
-    else:
-        update_long_summary(session_id)
+async def record_memory(session_id: str, player_text: str, gm_text: str):
+    # Record player + gm pair for short memory (only for saved turns, so a
+    # 409-rejected turn never reaches memory, history or recall)
+    await add_game_turn(player_text or "", gm_text, session_id)
 
-    return gm_result
+    # Long summary is debounced: SUMMARIES runs it once enough text is pending
+    # or the session goes idle, at most one run per session at a time
+    await SUMMARIES.notify(session_id)
 
 # ----------------- pää-endpoint / peliturni -----------------
 
 
-@app.post("/api/turn", response_model=TurnOut)
-def turn(payload: TurnIn, background_tasks: BackgroundTasks):
-    state = ensure_session(payload.session_id)
-    dice = {"d20": random.randint(1, 20)}
-
-    # 1) parse player intent (LLM #1)
-    intent = parse_intent(state, payload.text)
+def pre_narration(state: Dict[str, Any], intent: Intent, player_text: str) -> tuple[TurnOut | None, str]:
+    """
+    Sanity check, liikkuminen ja sääntöpohjainen kauppa ennen GM:ää.
 
+    Palauttaa (valmis TurnOut, move_text). Jos TurnOut ei ole None, vuoro
+    hoitui kokonaan ilman narration-kutsua.
+    """
     # 2) sanity check ennen mitään muutoksia
-    ok, reason = sanity_check(state, intent)
+    with SANITY_SECONDS.time():
+        ok, reason = sanity_check(state, intent)
+    SANITY_TOTAL.inc("ok" if ok else "rejected")
     if not ok:
         narration = f"{reason} Try something else."
         choices = ["LOOK around", "Go to cave", "Check inventory"]
         state["turn"] += 1
-        state["log"].append({"player": payload.text, "gm": narration})
+        append_log(state, player_text, narration)
         return TurnOut(
             narration=narration,
             choices=choices,
             end_game=False,
             state=state,
-        )
+        ), ""
 
     # 3) liikkuminen + mahdollinen sääntöpohjainen kauppa
-    move_text = maybe_move(state, intent, payload.text)
+    move_text = maybe_move(state, intent, player_text)
 
-    shop_text = try_shop_purchase(state, intent, payload.text)
+    with SHOP_SECONDS.time():
+        shop_text = try_shop_purchase(state, intent, player_text)
+    SHOP_TOTAL.inc("short_circuit" if shop_text else "pass")
     if shop_text:
         # Jos kauppa hoitui täysin sääntölogiikalla, ei kutsuta GM:ää erikseen.
         narration = (move_text + " " if move_text else "") + shop_text
         narration = narration.strip()
 
         state["turn"] += 1
-        state["log"].append({"player": payload.text, "gm": narration})
+        append_log(state, player_text, narration)
 
-        # Tarjoa fiksut nappivalinnat tunnetuissa paikoissa
-        if state["world"]["location"] == "Blacksmith":
-            base_choices = ["Buy Dagger", "Buy Iron Sword", "Buy Shield"]
-        elif state["world"]["location"] in ("Market", "Village"):
-            base_choices = ["Buy Torch", "Buy Rope", "Buy Loaf of Bread"]
-        else:
-            base_choices = []
-
-        def exists(name: str) -> bool:
-            k, _ = get_item(name)
-            return k is not None
-
-        choices = [c for c in base_choices if exists(c.split("Buy ", 1)[1])]
-        if not choices:
-            choices = ["LOOK around", "Go to cave", "Return to tavern"]
+        # Tarjoa fiksut nappivalinnat tunnetuissa paikoissa (valmiiksi lasketut)
+        choices = list(shop_choices(state["world"]["location"]))
 
         return TurnOut(
             narration=narration,
             choices=choices,
             end_game=False,
             state=state,
-        )
+        ), move_text
 
-    # 4) varsinaisen GM-narration kutsu (LLM #2)
-    gm = handle_turn(state, intent, dice, payload.session_id, background_tasks, player_text=payload.text)
+    return None, move_text
+
+
+def apply_gm_result(state: Dict[str, Any], gm: GMResult, move_text: str, player_text: str) -> TurnOut:
+    """Vie GM:n tuloksen (hp, inventory, loki, pelin loppu) pelitilaan."""
+    with APPLY_SECONDS.time():
+        return _apply_gm_result(state, gm, move_text, player_text)
 
+
+def _apply_gm_result(state: Dict[str, Any], gm: GMResult, move_text: str, player_text: str) -> TurnOut:
     # 5) hp ja inventoryn muutokset turvallisesti
     apply_health_change(state, int(gm.health_change))
 
@@ -470,7 +487,7 @@ def turn(payload: TurnIn, background_tasks: BackgroundTasks):
     narration = narration.strip()
 
     inventory_change = gm.inventory_change or []
-    current_inv = {it["name"].lower(): it for it in state["inventory"]}
+    inv = Inventory.of(state)
 
     for ch in inventory_change:
         action = ch.action
@@ -482,38 +499,31 @@ def turn(payload: TurnIn, background_tasks: BackgroundTasks):
 
         # tuntemattomat itemit ohitetaan hiljaa – ei rikota immersiota
         if not item_name:
+            ITEMS_DROPPED.inc("unknown_item")
             continue
 
         key, item_def = get_item(item_name)
         if not key:
+            ITEMS_DROPPED.inc("unknown_item")
             continue
 
-        lname = key.lower()
-
         if action in ("use", "remove"):
-            if lname not in current_inv or current_inv[lname]["count"] < count:
+            if not inv.has(key, count):
+                ITEMS_DROPPED.inc("not_in_inventory")
                 continue
             if action == "use" and item_def.get("type") == "consumable":
                 eff = apply_item_effect(state, key)
                 if eff:
                     narration += " " + eff
-            if current_inv[lname]["count"] > count:
-                current_inv[lname]["count"] -= count
-            else:
-                state["inventory"].remove(current_inv[lname])
-                del current_inv[lname]
+            inv.remove(key, count)
 
         elif action == "add":
-            if lname in current_inv:
-                current_inv[lname]["count"] += count
-            else:
-                state["inventory"].append({"name": key, "count": count})
-                current_inv[lname] = {"name": key, "count": count}
+            inv.add(key, count)
             narration += f" You obtained {key}."
 
     # 6) päivitä loki & turn
     state["turn"] += 1
-    state["log"].append({"player": payload.text, "gm": narration})
+    append_log(state, player_text, narration)
 
     # 7) pelin päättyminen
     if gm.end_game:
@@ -525,12 +535,334 @@ def turn(payload: TurnIn, background_tasks: BackgroundTasks):
         end_game=gm.end_game,
         state=state,
     )
-    
+
+
+async def _speculate_choice(session_id: str, snapshot: Dict[str, Any], text: str) -> SpecResult:
+    """Ajaa yhden tarjotun valinnan vuoron tilan kopiolla; sessioon ei kosketa."""
+    # spekulaation kulutus lasketaan session budjettiin; hukkametriikan arvio
+    # tulee oikeasti lähetetyistä (tiivistetyistä) prompteista ja vastauksista
+    with llm_session(session_id), metered() as meter:
+        res = await _speculate(session_id, snapshot, text)
+    res.tokens = meter["prompt"] + meter["completion"]
+    return res
+
+
+async def _speculate(session_id: str, snapshot: Dict[str, Any], text: str) -> SpecResult:
+    # alin jonoluokka: etukäteisajo ei saa ohittaa oikeita vuoroja rajoitetulla reitillä
+    intent = await parse_intent(snapshot, text, priority="speculative")
+    if not CFG.speculation_narration:
+        return SpecResult(intent=intent)
+
+    dice = {"d20": random.randint(1, 20)}
+    early, move_text = pre_narration(snapshot, intent, text)
+    if early is not None:
+        return SpecResult(intent=intent, state=snapshot, turn=early)
+
+    state_for_llm = await build_llm_state(snapshot, session_id, text)
+    gm = await make_narration(state_for_llm, intent.model_dump(), dice, priority="speculative")
+    out = apply_gm_result(snapshot, gm, move_text, text)
+    return SpecResult(intent=intent, state=snapshot, turn=out, gm_text=gm.narration)
+
+
+@app.post("/api/turn", response_model=TurnOut)
+async def turn(payload: TurnIn, background_tasks: BackgroundTasks):
+    # saman session vuorot sarjallistetaan; tuplapyyntö samalla avaimella
+    # odottaa ensimmäisen tulosta
+    with TURN_SECONDS.time("turn"):
+        return await GATE.run(
+            payload.session_id,
+            payload.idempotency_key,
+            lambda: _turn_locked(payload, background_tasks),
+        )
+
+
+def state_version(state: Dict[str, Any]) -> int:
+    # jokainen tilan muutos on vuoro ja kasvattaa turn-laskuria täsmälleen yhdellä
+    return int(state.get("turn", 0))
+
+
+def base_snapshot(state: Dict[str, Any], base_version: int | None) -> Dict[str, Any] | None:
+    """Kopio vuoroa edeltävästä tilasta, jos client tuntee juuri sen version."""
+    if base_version is None or base_version != state_version(state):
+        return None
+    return copy.deepcopy(state_to_dict(state))
+
+
+def finalize_turn(out: TurnOut, before: Dict[str, Any] | None) -> TurnOut:
+    """
+    Lisää vastaukseen tilan version. Jos clientin versio vastasi vuoroa
+    edeltävää tilaa, koko tilan sijaan palautetaan patch; muuten täysi tila.
+    """
+    version = state_version(out.state)
+    state = state_to_dict(out.state)
+    if before is None:
+        return out.model_copy(update={"state": state, "version": version})
+    return out.model_copy(update={"state": None, "patch": make_patch(before, state), "version": version})
+
+
+@contextmanager
+def _pinned(session_id: str) -> Iterator[None]:
+    # vuoron ajan tila ja muisti pysyvät muistissa: häätö kesken LLM-kutsun
+    # veisi spilliin vanhan kopion ja vuoron muutokset katoaisivat
+    with SESSIONS.pinned(session_id), memory_pinned(session_id):
+        yield
+
+
+async def _turn_locked(payload: TurnIn, background_tasks: BackgroundTasks) -> TurnOut:
+    with _pinned(payload.session_id):
+        state, version = await load_session(payload.session_id)
+        before = base_snapshot(state, payload.base_version)
+        with llm_session(payload.session_id):
+            out, gm_text = await _play_turn(state, payload)
+        await save_session(payload.session_id, state, version)
+        if gm_text is not None:
+            await record_memory(payload.session_id, payload.text, gm_text)
+
+    # spekuloidaan seuraavaa vuoroa tarjottujen valintojen pohjalta
+    if CFG.speculation and not out.end_game:
+        background_tasks.add_task(
+            SPECULATOR.launch,
+            payload.session_id,
+            state["turn"],
+            copy.deepcopy(state),
+            out.choices,
+            functools.partial(_speculate_choice, payload.session_id),
+        )
+    return finalize_turn(out, before)
+
+
+def _fused_turn(text: str) -> bool:
+    """Ajetaanko vuoro fused-kutsuna: vain jos fast-path (päällä ollessaan) ei tunnista tekstiä."""
+    if CFG.turn_mode != "fused":
+        return False
+    return not (CFG.intent_fast_path and fast_parse_intent(text) is not None)
+
+
+async def _play_turn(state: Dict[str, Any], payload: TurnIn) -> tuple[TurnOut, str | None]:
+    """Pelaa vuoron tilaan; palauttaa (tulos, muistiin kirjattava GM-teksti tai None)."""
+    dice = {"d20": random.randint(1, 20)}
+
+    spec = None
+    if CFG.speculation:
+        spec = await SPECULATOR.take(payload.session_id, payload.text, state["turn"])
+    if spec is not None and spec.turn is not None:
+        # valmiiksi laskettu vuoro kirjataan kerralla
+        state.clear()
+        state.update(spec.state)
+        return spec.turn.model_copy(update={"state": state}), spec.gm_text
+
+    # fused-tila: intent + narration yhdellä kutsulla, ellei fast-path tunnista tekstiä
+    if spec is None and _fused_turn(payload.text):
+        return await _play_fused_turn(state, payload, dice)
+
+    # 1) parse player intent (LLM #1)
+    intent = spec.intent if spec is not None else await parse_intent(state, payload.text)
+
+    # 2–3) sanity, liikkuminen ja kauppa
+    early, move_text = pre_narration(state, intent, payload.text)
+    if early is not None:
+        return early, None
+
+    # 4) varsinaisen GM-narration kutsu (LLM #2)
+    gm = await handle_turn(state, intent, dice, payload.session_id, player_text=payload.text)
+
+    # 5–7) hp, inventory, loki
+    return apply_gm_result(state, gm, move_text, payload.text), gm.narration
+
+
+async def _play_fused_turn(
+    state: Dict[str, Any], payload: TurnIn, dice: Dict[str, int]
+) -> tuple[TurnOut, str | None]:
+    state_for_llm = await build_llm_state(state, payload.session_id, payload.text)
+    intent, gm = await make_fused_turn(state_for_llm, payload.text, dice)
+
+    # serverin säännöt ajetaan mallin intentille ennen GM-kenttien kirjausta;
+    # jos sanity hylkää tai kauppa hoitaa vuoron, GM:n osuus hylätään
+    early, move_text = pre_narration(state, intent, payload.text)
+    if early is not None:
+        return early, None
+
+    return apply_gm_result(state, gm, move_text, payload.text), gm.narration
+
+
+async def _turn_steps(
+    work: Dict[str, Any], session_id: str, text: str, dice: Dict[str, int], intent: Intent | None = None
+):
+    """
+    Streamivuoron vaiheet: ("intent", Intent), ("delta", teksti)..., ("result", GMResult).
+    Kutsuja ajaa pre_narrationin intentin kohdalla ennen kuin jatkaa generaattoria,
+    joten split-tilan narration näkee jo siirtymän jälkeisen tilan. Fused-tilassa
+    malli on saanut tilan ennen sääntöjä, kuten /api/turn:llakin. Valmiiksi
+    spekuloitu intent ohittaa intent-kutsun (ja fused-tilan).
+    """
+    if intent is None and _fused_turn(text):
+        state_for_llm = await build_llm_state(work, session_id, text)
+        async with contextlib.aclosing(stream_fused_turn(state_for_llm, text, dice)) as steps:
+            async for step in steps:
+                yield step
+        return
+
+    if intent is None:
+        intent = await parse_intent(work, text)
+    yield "intent", intent
+    state_for_llm = await build_llm_state(work, session_id, text)
+    async with contextlib.aclosing(stream_narration(state_for_llm, intent.model_dump(), dice)) as steps:
+        async for step in steps:
+            yield step
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/turn/stream")
+async def turn_stream(payload: TurnIn):
+    """
+    Sama vuoro kuin /api/turn, mutta Server-Sent Events -streamina:
+
+      event: narration  data: {"delta": "..."}   – narrationin paloja heti kun niitä tulee
+      event: turn       data: <TurnOut>          – lopullinen tulos, kun JSON on valmis
+      event: error      data: {"detail": "..."}  – jos vuoro epäonnistui
+
+    Vuoro ajetaan tilan kopiolla ja kopio kirjataan sessioon vasta kun GM:n
+    vastaus on kokonaan parsittu, joten keskeytynyt stream ei jätä tilaa puolivalmiiksi.
+    """
+    session_id = payload.session_id
+    key = payload.idempotency_key
+
+    def replay(out: TurnOut):
+        yield _sse("narration", {"delta": out.narration})
+        yield _sse("turn", out.model_dump())
+
+    async def events():
+        t0 = time.perf_counter()
+        try:
+            with llm_session(session_id):
+                async for frame in turn_events():
+                    yield frame
+        finally:
+            TURN_SECONDS.observe(time.perf_counter() - t0, "stream")
+
+    async def turn_events():
+        done = GATE.recent(session_id, key)
+        if done is not None:
+            for frame in replay(done):
+                yield frame
+            return
+
+        # sama sarjallistus kuin /api/turn:lla; lukko ja kiinnitys pidetään koko streamin ajan
+        async with GATE.lock(session_id):
+            with _pinned(session_id):
+                done = GATE.recent(session_id, key)
+                if done is not None:
+                    for frame in replay(done):
+                        yield frame
+                    return
+
+                state, version = await load_session(session_id)
+                spec = None
+                if CFG.speculation:
+                    spec = await SPECULATOR.take(session_id, payload.text, state["turn"])
+
+                before = base_snapshot(state, payload.base_version)
+
+                async def commit(work: Dict[str, Any], out: TurnOut) -> TurnOut:
+                    state.clear()
+                    state.update(work)
+                    await save_session(session_id, state, version)
+                    if CFG.speculation and not out.end_game:
+                        await SPECULATOR.launch(
+                            session_id,
+                            state["turn"],
+                            copy.deepcopy(state),
+                            out.choices,
+                            functools.partial(_speculate_choice, session_id),
+                        )
+                    out = finalize_turn(out.model_copy(update={"state": state}), before)
+                    GATE.remember(session_id, key, out)
+                    return out
+
+                if spec is not None and spec.turn is not None:
+                    # valmiiksi laskettu vuoro: kirjataan kerralla ja toistetaan streamina
+                    try:
+                        out = await commit(spec.state, spec.turn)
+                    except HTTPException as e:
+                        yield _sse("error", {"detail": e.detail, "status": e.status_code})
+                        return
+                    if spec.gm_text is not None:
+                        await record_memory(session_id, payload.text, spec.gm_text)
+                    for frame in replay(out):
+                        yield frame
+                    return
+
+                work = copy.deepcopy(state)
+                dice = {"d20": random.randint(1, 20)}
+                try:
+                    gm = None
+                    move_text = ""
+                    intent = spec.intent if spec is not None else None
+                    steps = _turn_steps(work, session_id, payload.text, dice, intent)
+                    async with contextlib.aclosing(steps):
+                        async for kind, value in steps:
+                            if kind == "intent":
+                                early, move_text = pre_narration(work, value, payload.text)
+                                if early is not None:
+                                    early = await commit(work, early)
+                                    for frame in replay(early):
+                                        yield frame
+                                    return
+                                if move_text:
+                                    yield _sse("narration", {"delta": move_text + " "})
+                            elif kind == "delta":
+                                yield _sse("narration", {"delta": value})
+                            else:
+                                gm = value
+
+                    out = apply_gm_result(work, gm, move_text, payload.text)
+
+                    # commit: koko vuoro kerralla sessioon
+                    out = await commit(work, out)
+                except HTTPException as e:
+                    yield _sse("error", {"detail": e.detail, "status": e.status_code})
+                    return
+                except Exception:
+                    # poikkeuksen teksti jää lokiin, asiakkaalle vain yleinen virhe
+                    logger.exception("turn stream failed for session %s", session_id)
+                    yield _sse("error", {"detail": "Internal Server Error", "status": 500})
+                    return
+
+                await record_memory(session_id, payload.text, gm.narration)
+        yield _sse("turn", out.model_dump())
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# LLM token usage: GET /admin/usage (koonti) tai /admin/usage?session_id=XYZ
+@app.get("/admin/usage")
+def admin_usage(session_id: str | None = None, top: int = 20, x_admin_token: str | None = Header(default=None)):
+    # suljettu oletuksena: top_sessions paljastaa session id:t, joilla voi pelata toisen sessiota
+    if not CFG.admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(x_admin_token or "", CFG.admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+    if session_id:
+        return session_usage(session_id)
+    return usage_report(top)
+
 # List active session ids
 @app.get("/api/sessions")
 def list_sessions():
     return {"sessions": list(SESSIONS.keys())}
 
+# Paginated turn history: GET /api/log?session_id=XYZ&cursor=N&limit=20
+# palauttaa vuorot, joiden turn < cursor (ilman cursoria uusimmat), vanhimmasta uusimpaan
+@app.get("/api/log")
+def get_log(session_id: str, cursor: int | None = None, limit: int = 20):
+    return get_history().page(session_id, before=cursor, limit=limit)
+
 # Inspect memory for a session: GET /api/memory?session_id=XYZ
 @app.get("/api/memory")
 def get_memory(session_id: str):
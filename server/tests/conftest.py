@@ -0,0 +1,10 @@
+# server/tests/conftest.py
+# Testit ajetaan server/-hakemistosta: python -m pytest -q
+# config.CFG luetaan import-hetkellä, joten mock-providerit asetetaan ennen importteja.
+import os
+import sys
+
+os.environ.setdefault("INTENT_PROVIDER", "mock")
+os.environ.setdefault("NARRATION_PROVIDER", "mock")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,50 @@
+# server/tests/test_patch.py
+import copy
+import json
+
+from config import CFG
+from core.patch import make_patch
+from core.state import append_log
+
+
+def _apply(doc, patch):
+    # clientin (web/src/api/client.ts) patch-logiikka testejä varten
+    doc = copy.deepcopy(doc)
+    for op in patch:
+        *parents, last = op["path"].split("/")[1:]
+        target = doc
+        for key in parents:
+            target = target[int(key)] if isinstance(target, list) else target[key]
+        if op["op"] == "remove":
+            del target[int(last) if isinstance(target, list) else last]
+        elif isinstance(target, list) and last == "-":
+            target.append(op["value"])
+        elif isinstance(target, list):
+            target[int(last)] = op["value"]
+        else:
+            target[last] = op["value"]
+    return doc
+
+
+def test_full_log_shifts_by_one():
+    state = {"turn": 0, "log": []}
+    for _ in range(CFG.log_tail_size + 5):
+        state["turn"] += 1
+        append_log(state, "look around", "A cold wind drifts through the village. " * 3)
+    assert len(state["log"]) == CFG.log_tail_size
+
+    before = copy.deepcopy(state)
+    state["turn"] += 1
+    append_log(state, "wait", "Nothing happens.")
+    patch = make_patch(before, state)
+
+    log_ops = [(op["op"], op["path"]) for op in patch if op["path"].startswith("/log")]
+    assert log_ops == [("remove", "/log/0"), ("add", "/log/-")]
+    assert len(json.dumps(patch)) < len(json.dumps(state)) / 4
+    assert _apply(before, patch) == state
+
+
+def test_same_length_pairwise_change():
+    old = {"inventory": [{"name": "Torch", "count": 1}, {"name": "Dagger", "count": 1}]}
+    new = {"inventory": [{"name": "Torch", "count": 2}, {"name": "Dagger", "count": 1}]}
+    assert make_patch(old, new) == [{"op": "replace", "path": "/inventory/0/count", "value": 2}]
@@ -0,0 +1,27 @@
+# server/tests/test_turn_mode.py
+import dataclasses
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def cfg(monkeypatch):
+    def set_cfg(**changes):
+        monkeypatch.setattr(server, "CFG", dataclasses.replace(server.CFG, **changes))
+    return set_cfg
+
+
+@pytest.mark.parametrize("fast_path", [True, False])
+def test_fused_bypass_follows_fast_path_flag(cfg, fast_path):
+    cfg(turn_mode="fused", intent_fast_path=fast_path)
+    # nappiteksti: fast-path tunnistaa, joten fused ohitetaan vain kun fast-path on päällä
+    assert server._fused_turn("Go to cave") is not fast_path
+    # vapaa teksti menee aina fused-kutsuun
+    assert server._fused_turn("ask the merchant about goblins")
+
+
+def test_split_mode_never_fuses(cfg):
+    cfg(turn_mode="split", intent_fast_path=False)
+    assert not server._fused_turn("ask the merchant about goblins")
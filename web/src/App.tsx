@@ -10,7 +10,10 @@ import { useGame } from "./hooks/useGame";
 import "./styles.css";
 
 export default function App() {
-  const { history, currentGM, choices, loading, send, currentPlayer, hp, maxHp, inventory, state } = useGame();
+  const {
+    history, currentGM, choices, loading, send, currentPlayer, hp, maxHp, inventory, state,
+    hasMoreHistory, loadingOlder, loadOlder,
+  } = useGame();
   const inputRef = useRef<HTMLInputElement>(null);
 
   // Animated thinking indicator
@@ -74,7 +77,12 @@ export default function App() {
         {/* game content (narrower chat) */}
         <div style={{ flex: 3, display: "flex", flexDirection: "column", minWidth: 0 }}>
           {/* History */}
-          <ChatHistory items={history} />
+          <ChatHistory
+            items={history}
+            hasMore={hasMoreHistory}
+            loadingMore={loadingOlder}
+            onLoadMore={loadOlder}
+          />
 
           {/* Current turn */}
           <TurnPanel narration={currentGM} playerInput={currentPlayer} />
@@ -1,18 +1,159 @@
+export type PatchOp = { op: "add" | "remove" | "replace"; path: string; value?: any };
+
 export type ApiResponse = {
   narration: string;
   choices: string[];
   end_game: boolean;
   state: any;
+  version?: number;
+  // set instead of state when the server answers with a delta against base_version
+  patch?: PatchOp[] | null;
+};
+
+// last full state per session; sent as base_version so the server can reply with a patch
+const knownStates = new Map<string, { version: number; state: any }>();
+
+// JSON Patch subset used by the server (add / remove / replace, "-" = append)
+export function applyPatch(doc: any, patch: PatchOp[]): any {
+  const out = structuredClone(doc);
+  for (const op of patch) {
+    const parts = op.path
+      .split("/")
+      .slice(1)
+      .map((p) => p.replace(/~1/g, "/").replace(/~0/g, "~"));
+    const last = parts.pop()!;
+    let parent = out;
+    for (const p of parts) parent = Array.isArray(parent) ? parent[Number(p)] : parent[p];
+    if (Array.isArray(parent)) {
+      if (op.op === "remove") parent.splice(Number(last), 1);
+      else if (last === "-") parent.push(op.value);
+      else if (op.op === "add") parent.splice(Number(last), 0, op.value);
+      else parent[Number(last)] = op.value;
+    } else if (op.op === "remove") {
+      delete parent[last];
+    } else {
+      parent[last] = op.value;
+    }
+  }
+  return out;
+}
+
+// turns a delta response back into a full one and remembers it as the next base
+function resolveState(sessionId: string, data: ApiResponse): ApiResponse {
+  if (data.patch) {
+    const base = knownStates.get(sessionId);
+    if (!base) throw new Error("state patch received without a base state");
+    data = { ...data, state: applyPatch(base.state, data.patch) };
+  }
+  if (data.version !== undefined) {
+    knownStates.set(sessionId, { version: data.version, state: data.state });
+  }
+  return data;
+}
+
+export type LogEntry = { turn: number; player: string; gm: string };
+
+export type LogPage = {
+  entries: LogEntry[];
+  next_cursor: number | null;
 };
 
-export async function postTurn(sessionId: string, text: string): Promise<ApiResponse> {
+// Older turns from the server-side history. cursor = turn number of the
+// oldest entry already shown; the page contains the turns before it.
+export async function fetchLog(
+  sessionId: string,
+  cursor?: number,
+  limit = 20,
+): Promise<LogPage> {
+  const params = new URLSearchParams({ session_id: sessionId, limit: String(limit) });
+  if (cursor !== undefined) params.set("cursor", String(cursor));
+  const res = await fetch(`/api/log?${params}`);
+  if (!res.ok) {
+    throw new Error(`HTTP ${res.status}`);
+  }
+  return res.json();
+}
+
+// idempotencyKey: one key per player action (see useGame); reuse it when
+// retrying so the server answers with the original result instead of
+// playing the turn twice.
+export async function postTurn(
+  sessionId: string,
+  text: string,
+  idempotencyKey: string,
+): Promise<ApiResponse> {
   const res = await fetch("/api/turn", {
     method: "POST",
     headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ session_id: sessionId, text }),
+    body: JSON.stringify({
+      session_id: sessionId,
+      text,
+      idempotency_key: idempotencyKey,
+      base_version: knownStates.get(sessionId)?.version,
+    }),
   });
   if (!res.ok) {
     throw new Error(`HTTP ${res.status}`);
   }
-  return res.json();
+  return resolveState(sessionId, await res.json());
+}
+
+// Streaming variant: /api/turn/stream sends Server-Sent Events.
+// onDelta receives narration text as soon as the model produces it;
+// the promise resolves with the final turn once the GM JSON is complete.
+export async function postTurnStream(
+  sessionId: string,
+  text: string,
+  onDelta: (delta: string) => void,
+  idempotencyKey: string,
+): Promise<ApiResponse> {
+  const res = await fetch("/api/turn/stream", {
+    method: "POST",
+    headers: { "Content-Type": "application/json", Accept: "text/event-stream" },
+    body: JSON.stringify({
+      session_id: sessionId,
+      text,
+      idempotency_key: idempotencyKey,
+      base_version: knownStates.get(sessionId)?.version,
+    }),
+  });
+  if (!res.ok || !res.body) {
+    throw new Error(`HTTP ${res.status}`);
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let result: ApiResponse | null = null;
+
+  const handleFrame = (frame: string) => {
+    let event = "message";
+    const dataLines: string[] = [];
+    for (const line of frame.split("\n")) {
+      if (line.startsWith("event:")) event = line.slice(6).trim();
+      else if (line.startsWith("data:")) dataLines.push(line.slice(5).trimStart());
+    }
+    if (dataLines.length === 0) return;
+    const data = JSON.parse(dataLines.join("\n"));
+    if (event === "narration") onDelta(data.delta ?? "");
+    else if (event === "turn") result = data as ApiResponse;
+    else if (event === "error") throw new Error(data.detail ?? "stream error");
+  };
+
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let sep: number;
+    while ((sep = buffer.indexOf("\n\n")) >= 0) {
+      handleFrame(buffer.slice(0, sep));
+      buffer = buffer.slice(sep + 2);
+    }
+  }
+  if (buffer.trim()) handleFrame(buffer);
+
+  if (!result) {
+    throw new Error("stream ended without a turn result");
+  }
+  return resolveState(sessionId, result);
 }
@@ -1,15 +1,21 @@
 import { useEffect, useRef } from "react";
 
-type Entry = { player: string; gm: string };
-type Props = { items: Entry[] };
+type Entry = { player: string; gm: string; turn?: number };
+type Props = {
+  items: Entry[];
+  hasMore?: boolean;
+  loadingMore?: boolean;
+  onLoadMore?: () => void;
+};
 
-export default function ChatHistory({ items }: Props) {
+export default function ChatHistory({ items, hasMore = false, loadingMore = false, onLoadMore }: Props) {
   const bottomRef = useRef<HTMLDivElement>(null);
+  const last = items[items.length - 1];
 
-  // scroll to bottom whenever items change
+  // scroll to bottom when a new turn arrives (not when older turns are prepended)
   useEffect(() => {
     bottomRef.current?.scrollIntoView({ behavior: "smooth" });
-  }, [items]);
+  }, [last]);
 
   return (
     <section aria-label="History" style={{ marginBottom: 16 }}>
@@ -20,8 +26,15 @@ export default function ChatHistory({ items }: Props) {
             <div style={{ opacity: 0.8 }}>No earlier turns yet.</div>
           ) : (
             <ul className="historyList">
+              {hasMore && onLoadMore && (
+                <li>
+                  <button type="button" onClick={onLoadMore} disabled={loadingMore}>
+                    {loadingMore ? "Loading…" : "Load earlier turns"}
+                  </button>
+                </li>
+              )}
               {items.map((entry, i) => (
-                <li key={i} className="historyItem">
+                <li key={entry.turn ?? i} className="historyItem">
                   <div style={{ color: "#2563eb", fontWeight: 600 }}>You:</div>
                   <div style={{ marginBottom: 6 }}>{entry.player}</div>
                   <div style={{ color: "#16a34a", fontWeight: 600 }}>GM:</div>
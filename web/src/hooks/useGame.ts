@@ -1,7 +1,30 @@
 import { useEffect, useRef, useState } from "react";
-import { postTurn, type ApiResponse } from "../api/client";
+import { fetchLog, postTurnStream, type ApiResponse } from "../api/client";
 
-type HistoryEntry = { player: string; gm: string };
+type HistoryEntry = { player: string; gm: string; turn?: number };
+
+// only the latest turns are kept in memory; older ones are fetched from /api/log on demand
+const MAX_HISTORY = 50;
+// network failures are retried with the same idempotency key
+const MAX_ATTEMPTS = 3;
+
+function isRetryable(err: unknown): boolean {
+  // fetch rejects with TypeError on network errors; HTTP 5xx / 409 are worth another try
+  if (err instanceof TypeError) return true;
+  const m = err instanceof Error ? /^HTTP (\d+)/.exec(err.message) : null;
+  return !!m && (Number(m[1]) >= 500 || m[1] === "409");
+}
+
+async function withRetries<T>(fn: () => Promise<T>, onRetry: () => void): Promise<T> {
+  for (let attempt = 1; ; attempt++) {
+    try {
+      return await fn();
+    } catch (err) {
+      if (attempt >= MAX_ATTEMPTS || !isRetryable(err)) throw err;
+      onRetry();
+    }
+  }
+}
 
 export function useGame() {
   const didInit = useRef(false);
@@ -10,6 +33,7 @@ export function useGame() {
   const [currentGM, setCurrentGM] = useState<string | null>(null);
   const [choices, setChoices] = useState<string[]>([]);
   const [loading, setLoading] = useState(false);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const [currentPlayer, setCurrentPlayer] = useState<string | null>(null);
 
   const [hp, setHp] = useState<number>(10);
@@ -19,24 +43,77 @@ export function useGame() {
 
   // store the "last player command" so we can pair it with GM narration on the next turn
   const lastPlayerRef = useRef<string | null>(null);
+  // server turn number of the current GM narration (history cursor)
+  const lastTurnRef = useRef<number | undefined>(undefined);
+  // idempotency key of the action being sent; a double click or a resend of the
+  // same text before it succeeded reuses it, so the server plays the turn once
+  const pendingRef = useRef<{ text: string; key: string } | null>(null);
+
+  // the server has older turns if the oldest shown entry is not the first turn
+  const hasMoreHistory = history.length > 0 && (history[0].turn ?? 1) > 1;
+
+  async function loadOlder() {
+    if (loadingOlder || !hasMoreHistory) return;
+    setLoadingOlder(true);
+    try {
+      const page = await fetchLog(sessionId, history[0].turn);
+      setHistory((h) => {
+        const oldest = h[0]?.turn ?? Infinity;
+        const older = page.entries.filter((e) => e.turn < oldest);
+        return [...older, ...h];
+      });
+    } finally {
+      setLoadingOlder(false);
+    }
+  }
 
   async function send(text: string) {
     const trimmed = text.trim();
     if (!trimmed) return;
 
+    const pending = pendingRef.current;
+    const key = pending && pending.text === trimmed ? pending.key : crypto.randomUUID();
+    pendingRef.current = { text: trimmed, key };
+
     setLoading(true);
     try {
       // keep track of previous GM narration and player command
       const prevCurrent = currentGM;
       const prevPlayer = lastPlayerRef.current;
+      const prevTurn = lastTurnRef.current;
       const sentNow = trimmed;
 
-      const data: ApiResponse = await postTurn(sessionId, trimmed);
+      // move the previous pair into history as soon as the new turn starts showing
+      let started = false;
+      const startTurn = () => {
+        if (started) return;
+        started = true;
+        if (prevCurrent && prevPlayer) {
+          setHistory((h) => [...h, { player: prevPlayer, gm: prevCurrent, turn: prevTurn }].slice(-MAX_HISTORY));
+        }
+        setCurrentPlayer(sentNow);
+        setCurrentGM("");
+      };
 
-      // if we have a previous pair, move it into history now
-      if (prevCurrent && prevPlayer) {
-        setHistory((h) => [...h, { player: prevPlayer, gm: prevCurrent }]);
-      }
+      // narration streams in token by token; the final turn replaces it below
+      const data: ApiResponse = await withRetries(
+        () =>
+          postTurnStream(
+            sessionId,
+            trimmed,
+            (delta) => {
+              startTurn();
+              setCurrentGM((g) => (g ?? "") + delta);
+            },
+            key,
+          ),
+        // a retry replays the narration from the start
+        () => {
+          if (started) setCurrentGM("");
+        },
+      );
+      startTurn();
+      if (pendingRef.current?.key === key) pendingRef.current = null;
 
       // update current GM narration and choices
       setCurrentGM(data.narration ?? "");
@@ -50,6 +127,7 @@ export function useGame() {
 
       // remember the player's command for the next turn
       lastPlayerRef.current = sentNow;
+      lastTurnRef.current = data.state.turn;
       setCurrentPlayer(sentNow);
 
       return data;
@@ -69,5 +147,8 @@ export function useGame() {
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, []);
 
-  return { sessionId, history, currentGM, choices, loading, send, currentPlayer, hp, maxHp, inventory, state };
+  return {
+    sessionId, history, currentGM, choices, loading, send, currentPlayer, hp, maxHp, inventory, state,
+    hasMoreHistory, loadingOlder, loadOlder,
+  };
 }